@@ -19,8 +19,14 @@ import websockets
 from websockets.exceptions import ConnectionClosed
 
 from config import Config
-from wifi_setup import WiFiSetupServer
 from print_handler import print_handler # Use the singleton instance
+from printer_worker import PrinterWorker
+from printer_status import PrinterState, PrinterStatusMonitor
+from print_spool import PrintSpool, PRINTED, FAILED
+from frames import FrameError, parse_binary_frame
+from message_queue import MessageQueue, QueueFull, message_id_of
+from outbound import OutboundChannel
+from reconnect import AttemptLog, ReconnectPolicy, classify, timed_connect
 
 # ─────────────────────────────────────────────────────────────────────
 # CONFIGURATION
@@ -32,6 +38,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger('paperdrop')
 
+# Tasks draining the inbound queue; one can sit on a slow send while the
+# other keeps dispatching
+DISPATCHERS = 2
+
 
 class DeviceState(Enum):
     """Device operating states"""
@@ -56,14 +66,69 @@ class PaperDropAgent:
         self.state = DeviceState.WIFI_SETUP
         self.websocket: Optional[websockets.WebSocketClientProtocol] = None
         self.print_handler = print_handler # Use singleton
-        self.wifi_setup = WiFiSetupServer(self.config, self.on_wifi_configured)
+        # All printer I/O goes through the worker thread, never the event loop.
+        # The status monitor runs there too and holds jobs while the printer
+        # can't print (paper out, cover open, ...)
+        if self.config.PRINTER_PROCESS:
+            # Same thing, one process removed: rendering stays off our GIL
+            # and a printer-side crash doesn't drop the cloud connection
+            from printer_process import PrinterProcess
+            self.printer = PrinterProcess(
+                self.config.PRINTER_RING_BYTES,
+                poll_interval=self.config.PRINTER_STATUS_INTERVAL,
+                on_change=self.on_printer_state_changed,
+            )
+            self.printer_monitor = self.printer.monitor
+        else:
+            self.printer_monitor = PrinterStatusMonitor(
+                self.print_handler, on_change=self.on_printer_state_changed
+            )
+            self.printer = PrinterWorker(
+                self.print_handler,
+                monitor=self.printer_monitor,
+                poll_interval=self.config.PRINTER_STATUS_INTERVAL,
+            )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._job_tasks: set[asyncio.Task] = set()
+        # The one writer to the cloud socket (see outbound.py)
+        self.outbound = OutboundChannel(on_undelivered=self.on_frame_undelivered)
+        # Parsed cloud messages waiting for a dispatcher (see message_queue.py)
+        self.inbox = MessageQueue(
+            self.config.JOB_QUEUE_CAPACITY, on_pause=self.on_backpressure_changed
+        )
+        # Durable ledger so jobs and status reports survive crashes/reboots
+        self.spool = PrintSpool(self.config.SPOOL_FILE)
+        self._wifi_setup = None  # FastAPI/uvicorn are loaded on first use
         self.running = True
-        self.reconnect_delay = 5  # Start with 5 second reconnect delay
-        self.max_reconnect_delay = 60  # Max 60 seconds between attempts
+        self.reconnect_policy = ReconnectPolicy(
+            cap=self.config.RECONNECT_MAX_DELAY,
+            auth_cap=self.config.AUTH_RETRY_MAX_DELAY,
+        )
+        # Phase timings of recent cloud connection attempts
+        self.connect_log = AttemptLog()
         
+    @property
+    def wifi_setup(self):
+        """
+        Captive portal server. Created on first use so FastAPI and uvicorn
+        are only imported when we actually enter setup/fallback mode.
+        """
+        if self._wifi_setup is None:
+            from wifi_setup import WiFiSetupServer
+            self._wifi_setup = WiFiSetupServer(self.config, self.on_wifi_configured)
+        return self._wifi_setup
+
     async def run(self):
         """Main entry point - runs the agent forever"""
         logger.info(f"PaperDrop Agent starting - Device: {self.config.device_code}")
+        self._loop = asyncio.get_running_loop()
+        # Opens the printer in the background; we don't wait for it here
+        self.printer.start()
+        asyncio.create_task(self.report_printer_warmup())
+        asyncio.create_task(self.flush_spool_periodically())
+        for _ in range(DISPATCHERS):
+            self._spawn_job(self.dispatch_messages())
+        self.resume_spooled_jobs()
         
         # Set up signal handlers for graceful shutdown
         for sig in (signal.SIGTERM, signal.SIGINT):
@@ -131,10 +196,14 @@ class PaperDropAgent:
                     # Try to connect
                     success = await self.connect_to_home_wifi()
                     if success:
-                        logger.info("WiFi Connected! Keeping AP alive for 60s to show Success Page...")
-                        # Allow time for UI on the AP to update and user to see "Connected" and the Code
-                        await asyncio.sleep(60) 
-                        await self.wifi_setup.stop()
+                        if self._wifi_setup and self._wifi_setup.is_running:
+                            logger.info("WiFi Connected! Keeping AP alive for 60s to show Success Page...")
+                            # Allow time for UI on the AP to update and user to see "Connected" and the Code
+                            await asyncio.sleep(60) 
+                            await self.wifi_setup.stop()
+                        else:
+                            # Normal boot: no portal was up, nobody to show a page to
+                            logger.info("WiFi Connected!")
                         
                         self.state = DeviceState.ONLINE
                         self.connection_start_time = 0 # Reset
@@ -199,7 +268,9 @@ class PaperDropAgent:
         self.running = False
         if self.websocket:
             await self.websocket.close()
-        # self.print_handler.disconnect() # Handled by GC/exit usually
+        await self.printer.stop()
+        print_handler.close()
+        self.spool.close()
     
     # ─────────────────────────────────────────────────────────────────
     # WIFI SETUP MODE
@@ -214,7 +285,7 @@ class PaperDropAgent:
         logger.info("Entering WiFi setup mode")
         
         # Print setup instructions
-        self.print_handler.print_text("SETUP MODE ACTIVE\nConnect to 'PaperDrop' WiFi")
+        self.printer.submit("print_text", "SETUP MODE ACTIVE\nConnect to 'PaperDrop' WiFi")
         
         # Start the WiFi setup server (AP + captive portal)
         # This will block until WiFi is configured and verified
@@ -322,109 +393,265 @@ class PaperDropAgent:
         """
         Main operating mode - connected to cloud, listening for print jobs.
         """
-        self.reconnect_delay = 5  # Reset reconnect delay on successful connection
-        
         logger.info(f"Starting ONLINE mode. Cloud URL: {self.config.cloud_ws_url}")
 
         while self.running:
+            attempt = self.connect_log.begin()
+            error = None
             try:
-                await self.connect_to_cloud()
-                self.state = DeviceState.ONLINE
-                
-                # If we return from connect_to_cloud, it means connection closed cleanly or we logic'd out
-                # Usually listen_for_messages runs until error
+                await self.connect_to_cloud(attempt)
+                # listen_for_messages ends quietly on a normal close (1000/1001)
                 
             except ConnectionClosed as e:
                 logger.warning(f"WebSocket connection closed: {e}")
-                self.state = DeviceState.OFFLINE
+                error = e
                 
             except Exception as e:
                 logger.error(f"Error in online mode: {e}")
-                self.state = DeviceState.OFFLINE
-            
-            # Reconnect with exponential backoff
+                error = e
+            self.state = DeviceState.OFFLINE
+
+            close_code = None
+            if error is None and self.websocket:
+                close_code = self.websocket.close_code
+            kind = classify(error, close_code)
+            session = self.connect_log.ended(attempt, kind, error, close_code)
+
+            # Immediate first retry, then jittered backoff (see reconnect.py)
             if self.running:
-                logger.info(f"Reconnecting in {self.reconnect_delay} seconds...")
-                await asyncio.sleep(self.reconnect_delay)
-                self.reconnect_delay = min(
-                    self.reconnect_delay * 1.5, 
-                    self.max_reconnect_delay
-                )
+                delay = self.reconnect_policy.next_delay(kind, session)
+                attempt["retry_in_s"] = round(delay, 2)
+                logger.info(f"Reconnecting in {delay:.1f} seconds ({kind} failure "
+                            f"#{self.reconnect_policy.failures})...")
+                await asyncio.sleep(delay)
     
-    async def connect_to_cloud(self):
+    async def connect_to_cloud(self, attempt: dict):
         """Establish WebSocket connection to PaperDrop cloud"""
         logger.info("Connecting to cloud...")
         
-        self.websocket = await websockets.connect(
+        self.websocket = await timed_connect(
             self.config.cloud_ws_url,
+            attempt,
             additional_headers={
                 "X-Device-Code": self.config.device_code,
                 "X-Device-Secret": self.config.device_secret,
             },
             ping_interval=30,
             ping_timeout=10,
+            max_size=self.config.MAX_FRAME_SIZE,
+        )
+        self.state = DeviceState.ONLINE
+        self.connect_log.connected(attempt)
+        logger.info(
+            f"Cloud connection up in {attempt['total_ms']:.0f}ms "
+            f"(dns {attempt.get('dns_ms')}, tcp {attempt.get('tcp_ms')}, "
+            f"tls {attempt.get('tls_ms')}, upgrade {attempt.get('upgrade_ms')}), "
+            f"{attempt['downtime_ms']}ms after the link went down"
         )
         
-        self.reconnect_delay = 5  # Reset on successful connection
-        
+        self.outbound.attach(self.websocket)
+        try:
+            await self.run_session()
+        finally:
+            # Final statuses still queued get spooled for the next session
+            await self.outbound.detach()
+
+    async def run_session(self):
+        """Greet the cloud on a fresh connection, then serve it until it closes"""
         # Send hello message
-        await self.websocket.send(json.dumps({
+        await self.outbound.deliver({
             "type": "device_hello",
             "device_code": self.config.device_code,
             "firmware_version": self.config.firmware_version,
             "local_ip": self.get_local_ip(),
-            "printer_status": {"connected": True}, # Mock status
-        }))
+            "printer_status": self.printer_monitor.state.to_dict(),
+            "printer_warmup_ms": self.printer_warmup_ms(),
+            "capabilities": self.print_handler.capabilities(),
+            # Jobs the cloud may send before waiting for print_status credits
+            "credits": self.inbox.open_credits(),
+            # Newest job printed: the cloud replays what we missed after it
+            "cursor": self.spool.cursor,
+            # How this connection came up, and how long we were away
+            "connect_timing": self.connect_log.recent(1)[0],
+        })
         
         logger.info("Connected to cloud!")
+        await self.flush_status_reports()
+        if self.inbox.paused:
+            # Still full from before the drop: the new session starts paused too
+            self.push_backpressure(True)
         await self.listen_for_messages()
     
     async def listen_for_messages(self):
-        """Listen for incoming messages from cloud"""
+        """
+        Receive loop: parse each frame and queue it for the dispatchers.
+        Nothing here waits on a handler, so a slow print never delays the
+        next frame.
+        """
         async for raw_message in self.websocket:
             try:
-                message = json.loads(raw_message)
-                await self.handle_cloud_message(message)
+                if isinstance(raw_message, bytes):
+                    # Binary frame: small JSON header + raw image bytes
+                    message, payload = parse_binary_frame(raw_message)
+                else:
+                    message, payload = json.loads(raw_message), None
             except json.JSONDecodeError as e:
                 logger.error(f"Invalid JSON from cloud: {e}")
+                continue
+            except FrameError as e:
+                logger.error(f"Invalid binary frame from cloud: {e}")
+                continue
+
+            if not isinstance(message, dict):
+                logger.error(f"Ignoring non-object message from cloud: {type(message).__name__}")
+                continue
+            try:
+                self.inbox.put(message, payload)
+            except QueueFull as e:
+                # Deferred, never dropped: it prints once a slot frees up
+                logger.warning(f"Deferring {message.get('type')} {message_id_of(message)}: {e}")
+                self.inbox.defer(self._park(message, payload))
+
+    def _park(self, message: dict, payload) -> tuple:
+        """
+        Backlog item for a deferred job. Print jobs are written to the
+        spool so their payloads wait on disk, not in RAM; anything else
+        (test prints, reprints, redeliveries the spool already has) is
+        small and kept as is. Returns (message, payload, spooled id).
+        """
+        message_id = message_id_of(message)
+        if (message.get("type") in ("print_job", "new_message") and message_id
+                and self.spool.record_received(message_id, message, payload)):
+            return message, None, message_id
+        return message, payload, None
+
+    def _admit_deferred(self):
+        """Move deferred jobs into the inbox while slots are free"""
+        while (item := self.inbox.admit()) is not None:
+            message, payload, spooled_id = item
+            if spooled_id:
+                stored = self.spool.get_job(spooled_id)
+                if stored is None:
+                    continue  # Finished meanwhile (replayed and printed)
+                message, payload = stored
+            self.inbox.put(message, payload, resumed=bool(spooled_id), from_backlog=True)
+
+    async def dispatch_messages(self):
+        """Dispatcher task: drain the inbound queue for the agent's lifetime"""
+        while self.running:
+            entry = await self.inbox.get()
+            try:
+                task = await self.handle_cloud_message(
+                    entry.message, entry.payload, resumed=entry.resumed
+                )
             except Exception as e:
                 logger.error(f"Error handling message: {e}")
-    
-    async def handle_cloud_message(self, message: dict):
-        """Route incoming cloud messages to appropriate handlers"""
+                task = None
+            if task is None:
+                self._job_finished(entry)
+            else:
+                # A job keeps its slot until it has printed
+                task.add_done_callback(lambda _, entry=entry: self._job_finished(entry))
+
+    def _job_finished(self, entry):
+        """
+        Free a job's slot if its final print_status didn't already, and
+        let deferred jobs have it. Jobs that end without one (reprint
+        miss, no id, ...) still owe the cloud its credit, which then goes
+        out on its own.
+        """
+        self.inbox.release(entry)
+        self._admit_deferred()
+        if self.inbox.credits_due:
+            self.return_credits()
+
+    async def handle_cloud_message(
+        self, message: dict, payload: Optional[memoryview] = None, resumed: bool = False
+    ) -> Optional[asyncio.Task]:
+        """
+        Route incoming cloud messages to appropriate handlers.
+        `payload` is the raw body of a binary frame, if any; `resumed`
+        marks a print job that was deferred to the spool.
+        Returns the background task of a print job.
+        """
         # Support both 'print_job' (Spec) and 'new_message' (Current Backend Implementation)
         msg_type = message.get("type")
         
         logger.info(f"Received message type: {msg_type}")
 
         if msg_type == "print_job" or msg_type == "new_message":
-            await self.handle_print_job(message)
+            # Don't wait for paper: keep reading frames while the worker prints.
+            # The worker queue keeps jobs in arrival order.
+            return self._spawn_job(self.handle_print_job(message, payload, resumed=resumed))
         
         elif msg_type == "ping":
-            await self.websocket.send(json.dumps({"type": "pong"}))
+            # Per-stage queue depths let the backend see where bursts pile up
+            self.outbound.send({
+                "type": "pong",
+                "pipeline": self.printer.stats(),
+                "inbox": self.inbox.stats(),
+                "outbound": self.outbound.stats(),
+            })
         
         elif msg_type == "claimed":
             owner_name = message.get("owner_name", "Someone")
-            self.print_handler.print_text(
-                f"Obtained by {owner_name}!\n\nREADY."
+            self.printer.submit(
+                "print_text", f"Obtained by {owner_name}!\n\nREADY."
             )
         
+        elif msg_type == "get_connection_log":
+            # Recent connection attempts with per-phase timings
+            self.outbound.send({
+                "type": "connection_log",
+                "attempts": self.connect_log.recent(message.get("limit")),
+            })
+
+        elif msg_type == "replay_done":
+            # The cloud has queued what we missed while away; it comes in
+            # as new_message frames, paced by our credits
+            logger.info(f"Session resumed, {message.get('count', 0)} job(s) queued in the cloud "
+                        f"({message.get('requeued', 0)} being resent)")
+
         elif msg_type == "test_print":
-            self.print_handler.print_text(
-                f"Test Print\n{datetime.now()}"
-            )
-            await self.report_print_status(message.get("request_id"), "printed")
+            return self._spawn_job(self.handle_test_print(message))
+
+        elif msg_type == "reprint":
+            return self._spawn_job(self.handle_reprint(message))
         
         else:
             logger.warning(f"Unknown message type: {msg_type}")
+        return None
+
+    def _spawn_job(self, coro) -> asyncio.Task:
+        """Run a job coroutine in the background, keeping a reference until done"""
+        task = asyncio.create_task(coro)
+        self._job_tasks.add(task)
+        task.add_done_callback(self._job_tasks.discard)
+        return task
+
+    def on_backpressure_changed(self, paused: bool):
+        """Called by the inbox when it fills up or has drained again"""
+        self.push_backpressure(paused)
+
+    def push_backpressure(self, paused: bool):
+        """Ask the cloud to hold (or resume sending) print jobs"""
+        self.outbound.send({
+            "type": "backpressure",
+            "paused": paused,
+            "queue_depth": self.inbox.jobs,
+            "capacity": self.inbox.capacity,
+        })
     
     # ─────────────────────────────────────────────────────────────────
     # PRINT JOB HANDLING
     # ─────────────────────────────────────────────────────────────────
     
-    async def handle_print_job(self, job: dict):
+    async def handle_print_job(self, job: dict, payload=None, resumed: bool = False):
         """
         Process and print a message from the cloud.
+        `payload` holds the image bytes of a binary frame.
+        `resumed` is set for jobs replayed from the spool: after a restart,
+        or deferred there while every job slot was taken.
         """
         # Backend sends { type: 'new_message', message: { ... } }
         # Spec sends { type: 'print_job', content: { ... } }
@@ -435,6 +662,7 @@ class PaperDropAgent:
             msg_obj = job['message']
             message_id = msg_obj.get('id')
             content_type = msg_obj.get('contentType', 'text')
+            created_at = msg_obj.get('createdAt')
             
             # Content might be a JSON string or object depending on parsing
             content = msg_obj.get('content')
@@ -452,60 +680,235 @@ class PaperDropAgent:
             # Spec format
             message_id = job.get("message_id")
             content_type = job.get("content_type")
+            created_at = job.get("created_at")
             content = job.get("content", {})
+
+        # Binary frames carry a MIME type (image/png, image/jpeg, ...)
+        if content_type and content_type.startswith("image/"):
+            content_type = "image"
+        elif content_type in ("raster1bpp", "application/x-paperdrop-raster"):
+            content_type = "raster"
         
         sender_name = job.get("sender_name", "Unknown") # Spec
         if 'message' in job and 'sender' in job['message']:
              # Attempt to find sender name if nested (backend might not send it yet)
              pass
 
+        if message_id and not resumed:
+            # Replays after a reconnect take the same path:
+            # anything the spool already has is deduplicated here
+            if not self.spool.record_received(message_id, job, payload):
+                # Redelivery of a job we already have. Failed jobs get another
+                # attempt; if it printed, the cloud probably missed our report.
+                state = self.spool.get_state(message_id)
+                if state == FAILED:
+                    logger.info(f"Retrying previously failed print job {message_id}")
+                    self.spool.reset(message_id, job, payload)
+                else:
+                    logger.info(f"Duplicate print job {message_id} ({state}), not reprinting")
+                    if state == PRINTED:
+                        await self.report_print_status(message_id, PRINTED)
+                    return
+
         logger.info(f"Processing print job: {message_id} ({content_type})")
         
         try:
-            # Acknowledge
-            if message_id:
-                await self.websocket.send(json.dumps({
-                    "type": "print_status",
-                    "message_id": message_id,
-                    "status": "printing"
-                }))
-
+            # Queue on the printer worker before the first await so jobs
+            # keep their arrival order
+            print_job = None
             if content_type == "text":
-                self.print_handler.print_message({ 
+                print_job = self.printer.submit("print_message", {
                     'content': content, 
                     'sender_name': sender_name 
                 })
             
             elif content_type == "image":
-                # Backend sends base64 string directly as 'content' sometimes
-                img_data = content if isinstance(content, str) else content.get('image_url')
-                self.print_handler.print_image(img_data)
+                if payload is not None:
+                    img_data = payload
+                else:
+                    # Backend sends base64 string directly as 'content' sometimes
+                    img_data = content if isinstance(content, str) else content.get('image_url')
+                print_job = self.printer.submit("print_image", img_data, message_id=message_id)
+
+            elif content_type == "raster":
+                # Pre-dithered on the server: { width, height, compression, data }
+                # data is base64 in JSON, or the binary frame payload
+                raster = content if isinstance(content, dict) else {}
+                print_job = self.printer.submit(
+                    "print_raster",
+                    raster.get("width"),
+                    raster.get("height"),
+                    payload if payload is not None else raster.get("data", ""),
+                    compression=raster.get("compression", "none"),
+                    message_id=message_id,
+                )
+
+            # Acknowledge
+            if message_id:
+                self.spool.mark_printing(message_id)
+                await self.report_print_status(message_id, "printing")
+
+            if print_job:
+                await print_job
             
             # Report success
+            if message_id:
+                self.spool.mark_printed(message_id)
+                if created_at:
+                    self.spool.advance_cursor(message_id, created_at)
             await self.report_print_status(message_id, "printed")
             logger.info(f"Print job completed: {message_id}")
             
         except Exception as e:
+            if not self.running:
+                # Shutting down while the job was held; leave it in the spool
+                # so it resumes on the next start
+                logger.info(f"Print job {message_id} left in spool for next start")
+                return
             logger.error(f"Print job failed: {message_id} - {e}")
+            if message_id:
+                self.spool.mark_failed(message_id, str(e))
             await self.report_print_status(message_id, "failed", str(e))
     
+    async def handle_test_print(self, message: dict):
+        """Print a test page and acknowledge it"""
+        request_id = message.get("request_id")
+        try:
+            await self.printer.submit(
+                "print_text", f"Test Print\n{datetime.now()}"
+            )
+        except Exception as e:
+            logger.error(f"Test print failed: {request_id} - {e}")
+            await self.report_print_status(request_id, "failed", str(e))
+            return
+        await self.report_print_status(request_id, "printed")
+
+    async def handle_reprint(self, message: dict):
+        """Print a cached image job again by message_id (no payload sent)"""
+        message_id = message.get("message_id")
+        try:
+            await self.printer.submit("reprint", message_id)
+        except LookupError:
+            # Evicted or never cached; the cloud has to send the full job
+            logger.info(f"Reprint cache miss for {message_id}")
+            self.outbound.send({"type": "reprint_miss", "message_id": message_id})
+            return
+        except Exception as e:
+            logger.error(f"Reprint failed: {message_id} - {e}")
+            return
+        logger.info(f"Reprinted {message_id} from cache")
+        await self.report_print_status(message.get("request_id"), "printed")
+
     async def report_print_status(
         self, 
         message_id: str, 
         status: str, 
         error: str = None
     ):
-        """Report print job completion back to cloud"""
-        if not self.websocket or not message_id:
+        """Report print job progress/completion back to cloud"""
+        if not message_id:
             return
-        
-        await self.websocket.send(json.dumps({
+
+        frame = {
             "type": "print_status",
             "message_id": message_id,
             "status": status,
-            "error": error,
-            "printed_at": datetime.utcnow().isoformat() + "Z",
-        }))
+        }
+        if status != "printing":
+            frame["error"] = error
+            frame["printed_at"] = datetime.utcnow().isoformat() + "Z"
+        if status in (PRINTED, FAILED):
+            # The job is off the device: its slot goes back to the cloud
+            # as a credit on this very frame
+            self.inbox.complete(message_id)
+        credits = self.inbox.take_credits()
+        if credits:
+            frame["credits"] = credits
+        # Queued, not sent: a slow link never holds up the job
+        self.outbound.send(frame)
+
+    def return_credits(self):
+        """Hand back credits no print_status carried"""
+        credits = self.inbox.take_credits()
+        if credits:
+            self.outbound.send({"type": "credit", "credits": credits})
+
+    def on_frame_undelivered(self, frame: dict):
+        """The outbound channel couldn't send `frame` (offline, link dropped)"""
+        if frame.get("type") == "print_status" and frame.get("status") in (PRINTED, FAILED):
+            # Final outcomes must reach the cloud; hold them until reconnect.
+            # Credits are not: the next device_hello grants afresh.
+            frame = {k: v for k, v in frame.items() if k != "credits"}
+            self.spool.queue_report(frame)
+
+    # ─────────────────────────────────────────────────────────────────
+    # PRINTER STATUS
+    # ─────────────────────────────────────────────────────────────────
+
+    def printer_warmup_ms(self) -> Optional[int]:
+        """Printer warm-up time, or None while it is still warming up"""
+        ready = self.printer.ready
+        if not ready.done() or ready.exception():
+            return None
+        return round(ready.result() * 1000)
+
+    async def report_printer_warmup(self):
+        """
+        Log how long printer start-up took and tell the cloud. The first
+        device_hello usually goes out before warm-up is done; later ones
+        carry it too.
+        """
+        try:
+            elapsed = await self.printer.wait_ready()
+        except Exception as e:
+            logger.error(f"Printer warm-up failed: {e}")
+            return
+        logger.info(f"Printer ready after {elapsed * 1000:.0f}ms warm-up")
+        if self.outbound.websocket is not None:
+            self.push_printer_status(self.printer_monitor.state)
+
+    def on_printer_state_changed(self, state: PrinterState):
+        """Called on the printer worker thread (event loop in split-process mode) when the state changes"""
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.push_printer_status, state)
+
+    def push_printer_status(self, state: PrinterState):
+        """Tell the cloud so it can hold jobs instead of burning retries"""
+        self.outbound.send({
+            "type": "printer_status",
+            "printer_status": state.to_dict(),
+            "printer_warmup_ms": self.printer_warmup_ms(),
+        })
+
+    # ─────────────────────────────────────────────────────────────────
+    # SPOOL (crash recovery)
+    # ─────────────────────────────────────────────────────────────────
+
+    def resume_spooled_jobs(self):
+        """Re-queue jobs that were received but not printed before a restart"""
+        pending = self.spool.pending_jobs()
+        if pending:
+            logger.info(f"Resuming {len(pending)} spooled print job(s)")
+        for message_id, job, body in pending:
+            self._spawn_job(self.handle_print_job(job, body, resumed=True))
+
+    async def flush_status_reports(self):
+        """Deliver status reports queued while we were offline"""
+        reports = self.spool.pending_reports()
+        if reports:
+            logger.info(f"Flushing {len(reports)} queued status report(s)")
+        # All queued at once so the writer can batch them
+        sent = await asyncio.gather(*(self.outbound.deliver(frame) for _, frame in reports))
+        for (row_id, _), ok in zip(reports, sent):
+            if ok:
+                self.spool.ack_report(row_id)
+
+    async def flush_spool_periodically(self):
+        """Group-commit spool transitions on a short interval"""
+        while self.running:
+            await asyncio.sleep(self.config.SPOOL_COMMIT_INTERVAL)
+            if self.spool.dirty:
+                await asyncio.to_thread(self.spool.flush)
 
 # ─────────────────────────────────────────────────────────────────────
 # ENTRY POINT
@@ -513,6 +916,11 @@ class PaperDropAgent:
 
 def main():
     """Entry point for the agent"""
+    if "--import-report" in sys.argv[1:]:
+        # Startup import-time report + budget check, see startup_profile.py
+        import startup_profile
+        sys.exit(startup_profile.main([a for a in sys.argv[1:] if a != "--import-report"]))
+
     agent = PaperDropAgent()
     asyncio.run(agent.run())
 
@@ -0,0 +1,254 @@
+"""
+Buffered ESC/POS command builder.
+
+python-escpos turns every `set()`, `text()`, `qr()` and `cut()` into its
+own USB bulk transfer, so a chat message of a dozen calls paid a dozen
+round trips. CommandBuffer offers the same calls, appends the bytes to
+one bytearray and sends the whole job with `flush()` in
+printer-buffer-sized writes. Style changes are emitted lazily, only
+when they differ from what this buffer already set.
+
+Printers without a raw byte interface (MockPrinter) get the calls passed
+straight through, so the handler code is the same for both.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger('paperdrop.commands')
+
+ESC = b"\x1b"
+GS = b"\x1d"
+
+# TM-T20III receive buffer; larger writes just stall in the USB stack
+FLUSH_BYTES = 4096
+
+_ALIGN = {"left": 0, "center": 1, "right": 2}
+_FONT = {"a": 0, "b": 1}
+# Lines fed before cutting so the last line clears the cutter (as escpos does)
+_CUT_FEED_LINES = 6
+_QR_MODEL_2 = 50
+_QR_EC_LOW = 48
+
+
+class TransferStats:
+    """Bulk-write counters, to check how many transfers a job really costs"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.writes = 0
+        self.bytes = 0
+        self.commands = 0
+        self.last_flush: dict = {}
+
+    def record(self, commands: int, writes: int, nbytes: int):
+        with self._lock:
+            self.flushes += 1
+            self.commands += commands
+            self.writes += writes
+            self.bytes += nbytes
+            self.last_flush = {"commands": commands, "writes": writes, "bytes": nbytes}
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "flushes": self.flushes,
+                "commands": self.commands,
+                "writes": self.writes,
+                "bytes": self.bytes,
+                "last_flush": dict(self.last_flush),
+            }
+
+
+class CommandBuffer:
+    """
+    The subset of the python-escpos printer API the handler uses, writing
+    into a bytearray. Nothing reaches the printer until `flush()`.
+    """
+
+    def __init__(self, printer, stats: TransferStats = None,
+                 flush_bytes: int = FLUSH_BYTES, encoder=None):
+        self.printer = printer
+        self.stats = stats
+        # text_encoder.TextEncoder; plain cp437 without one
+        self.encoder = encoder
+        self.flush_bytes = flush_bytes
+        self.buffer = bytearray()
+        self.commands = 0
+        # Printer style as set by this buffer, and set() calls not yet
+        # emitted. Nothing is assumed about the state a job starts in.
+        self._style: dict = {}
+        self._pending_style: dict = {}
+        # Code page selected by this buffer (None: whatever the printer has)
+        self._page = None
+        # NV graphics registries with uploads in this buffer, confirmed
+        # once flush() has written them
+        self._registries: list = []
+        # MockPrinter & co. have no raw channel: forward calls as-is
+        self._direct = not hasattr(printer, "_raw")
+
+    # ─────────────────────────────────────────────────────────────────
+    # ESCPOS API
+    # ─────────────────────────────────────────────────────────────────
+
+    def _raw(self, data: bytes):
+        self.buffer += data
+
+    def text(self, txt: str):
+        if self._direct:
+            return self.printer.text(txt)
+        self.commands += 1
+        self._apply_style()
+        self._encode(txt)
+
+    def set(self, align=None, font=None, bold=None, underline=None,
+            double_width=None, double_height=None, invert=None, **_):
+        requested = {k: v for k, v in (
+            ("align", align), ("font", font), ("bold", bold), ("underline", underline),
+            ("double_width", double_width), ("double_height", double_height),
+            ("invert", invert),
+        ) if v is not None}
+        if self._direct:
+            if hasattr(self.printer, "set"):
+                self.printer.set(**requested)
+            return
+
+        # Only recorded here; _apply_style() emits what actually changed
+        # right before the next text, so no-op and overwritten set() calls
+        # never reach the printer
+        self.commands += 1
+        for name, value in requested.items():
+            if isinstance(value, str):
+                value = value.lower()
+            elif name in ("bold", "double_width", "double_height", "invert"):
+                value = bool(value)
+            else:
+                value = int(value)
+            self._pending_style[name] = value
+
+    def _apply_style(self):
+        changed = {k: v for k, v in self._pending_style.items() if self._style.get(k) != v}
+        self._pending_style.clear()
+        if not changed:
+            return
+        self._style.update(changed)
+
+        if "align" in changed:
+            self._raw(ESC + b"a" + bytes((_ALIGN[changed["align"]],)))
+        if "font" in changed:
+            self._raw(ESC + b"M" + bytes((_FONT[changed["font"]],)))
+        if "bold" in changed:
+            self._raw(ESC + b"E" + bytes((changed["bold"],)))
+        if "underline" in changed:
+            self._raw(ESC + b"-" + bytes((changed["underline"],)))
+        if "double_width" in changed or "double_height" in changed:
+            size = ((0x10 if self._style.get("double_width") else 0)
+                    | (0x01 if self._style.get("double_height") else 0))
+            self._raw(GS + b"!" + bytes((size,)))
+        if "invert" in changed:
+            self._raw(GS + b"B" + bytes((changed["invert"],)))
+
+    def qr(self, content: str, size: int = 3, native: bool = True, **kwargs):
+        if self._direct or not native:
+            # escpos renders non-native QR codes as images itself
+            self._apply_style()
+            self.flush()
+            return self.printer.qr(content, size=size, native=native, **kwargs)
+
+        self.commands += 1
+        self._apply_style()
+        data = content.encode("utf-8")
+        self._qr_function(65, bytes((_QR_MODEL_2, 0)))       # model 2
+        self._qr_function(67, bytes((size,)))                # module size
+        self._qr_function(69, bytes((_QR_EC_LOW,)))          # error correction L
+        self._qr_function(80, b"0" + data)                   # store
+        self._qr_function(81, b"0")                          # print
+
+    def cut(self, mode: str = "FULL", feed: bool = True):
+        if self._direct:
+            return self.printer.cut()
+        self.commands += 1
+        if feed:
+            self._raw(ESC + b"d" + bytes((_CUT_FEED_LINES,)))
+        self._raw(GS + b"V" + (b"\x01" if mode.upper() == "PART" else b"\x00"))
+
+    def graphic(self, raster, registry=None):
+        """
+        A packed raster (raster_encoder.PackedRaster), printed by reference
+        from NV memory when `registry` has it stored, else as GS v 0
+        """
+        from raster_encoder import encode_raster, trim_raster, write_raster
+        if self._direct:
+            return write_raster(self.printer, raster)
+
+        self.commands += 1
+        self._apply_style()  # ESC a centres graphics too
+        command = registry.lookup(self.printer, raster, pin=True) if registry else None
+        if command:
+            if registry not in self._registries:
+                self._registries.append(registry)
+            self._raw(command)
+            return
+        for band in encode_raster(trim_raster(raster)):
+            self._raw(band)
+
+    def _qr_function(self, fn: int, data: bytes):
+        # GS ( k pL pH cn fn [data], cn 49 = QR Code
+        n = len(data) + 2
+        self._raw(GS + b"(k" + bytes((n & 0xFF, n >> 8, 49, fn)) + data)
+
+    def _encode(self, txt: str):
+        if self.encoder is None:
+            self._raw(txt.encode("cp437", errors="replace"))
+            return
+        data, self._page = self.encoder.encode(txt, self._page)
+        self._raw(data)
+
+    # ─────────────────────────────────────────────────────────────────
+    # OUTPUT
+    # ─────────────────────────────────────────────────────────────────
+
+    def flush(self):
+        """Send everything buffered so far in as few bulk writes as possible"""
+        if self._direct or not self.buffer:
+            self.commands = 0
+            return
+
+        writes = 0
+        try:
+            with memoryview(self.buffer) as view:
+                for start in range(0, len(view), self.flush_bytes):
+                    self.printer._raw(bytes(view[start:start + self.flush_bytes]))
+                    writes += 1
+        except BaseException:
+            self.discard()
+            raise
+        for registry in self._registries:
+            registry.confirm()
+        self._registries.clear()
+
+        nbytes = len(self.buffer)
+        logger.debug(f"Flushed {self.commands} commands as {writes} write(s), {nbytes} bytes")
+        if self.stats:
+            self.stats.record(self.commands, writes, nbytes)
+        self.buffer.clear()
+        self.commands = 0
+
+    def discard(self):
+        """Drop everything buffered, NV uploads included"""
+        for registry in self._registries:
+            registry.discard()
+        self._registries.clear()
+        self.buffer.clear()
+        self.commands = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A half-built job is dropped rather than printed
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
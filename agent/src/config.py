@@ -14,6 +14,27 @@ class Config:
         
         self.DEVICE_INFO_FILE = self.CONFIG_DIR / "device.json"
         self.WIFI_CREDENTIALS_FILE = self.CONFIG_DIR / "wifi.json"
+        self.SPOOL_FILE = self.CONFIG_DIR / "spool.db"
+        # Seconds between group commits of the print spool
+        self.SPOOL_COMMIT_INTERVAL = float(os.environ.get("PAPERDROP_SPOOL_COMMIT_INTERVAL", "0.5"))
+        self.RASTER_CACHE_DIR = self.CONFIG_DIR / "raster_cache"
+        self.RASTER_CACHE_MAX_BYTES = int(os.environ.get("PAPERDROP_RASTER_CACHE_MB", "32")) * 1024 * 1024
+        # Recurring bitmaps stored in the printer's NV graphics memory
+        self.NV_GRAPHICS_ENABLED = os.environ.get("PAPERDROP_NV_GRAPHICS", "1") == "1"
+        self.NV_GRAPHICS_INDEX = self.CONFIG_DIR / "nv_graphics.json"
+        self.NV_GRAPHICS_BYTES = int(os.environ.get("PAPERDROP_NV_GRAPHICS_KB", "256")) * 1024
+        self.NV_GRAPHIC_MAX_BYTES = 32 * 1024  # logos and stickers, not photos
+        # Code page tables and rendered fallback glyphs for text_encoder
+        self.TEXT_TABLE_FILE = self.CONFIG_DIR / "codepages.json"
+        self.GLYPH_CACHE_FILE = self.CONFIG_DIR / "glyphs.json"
+        # Optional bitmap printed instead of the "PaperDrop" text header
+        self.HEADER_LOGO_FILE = self.CONFIG_DIR / "header_logo.png"
+        # Processes rendering image jobs in parallel; 0 renders on the agent's
+        # own render thread, streaming bands to the printer as they are
+        # dithered. A pool renders whole images, so printing starts later
+        # but bursts of jobs finish sooner. Each costs ~40 MB of RAM: keep 0
+        # on a Pi Zero, up to 3 on a Pi 4.
+        self.RENDER_WORKERS = int(os.environ.get("PAPERDROP_RENDER_WORKERS", "0"))
         
         self.CLOUD_WS_URL = os.environ.get(
             "PAPERDROP_WS_URL", 
@@ -21,6 +42,20 @@ class Config:
             # Defaulting to Cloud URL for production
         )
         self.FIRMWARE_VERSION = "1.0.0"
+        # Largest websocket frame we accept (binary image jobs can be big)
+        self.MAX_FRAME_SIZE = int(os.environ.get("PAPERDROP_MAX_FRAME_MB", "16")) * 1024 * 1024
+        # Longest wait between cloud reconnect attempts (see reconnect.py)
+        self.RECONNECT_MAX_DELAY = float(os.environ.get("PAPERDROP_RECONNECT_MAX", "60"))
+        # Same after the cloud rejected our credentials
+        self.AUTH_RETRY_MAX_DELAY = float(os.environ.get("PAPERDROP_AUTH_RETRY_MAX", "900"))
+        # Print jobs we are willing to hold at once (the cloud's credits, see message_queue.py)
+        self.JOB_QUEUE_CAPACITY = int(os.environ.get("PAPERDROP_JOB_QUEUE", "8"))
+        # Seconds between DLE EOT status polls while the printer is idle
+        self.PRINTER_STATUS_INTERVAL = float(os.environ.get("PAPERDROP_STATUS_INTERVAL", "5"))
+        # Run the printer (USB, rendering) in its own process, see printer_process.py
+        self.PRINTER_PROCESS = os.environ.get("PAPERDROP_PRINTER_PROCESS", "0") == "1"
+        # Shared memory ring carrying job payloads to the printer process
+        self.PRINTER_RING_BYTES = int(os.environ.get("PAPERDROP_PRINTER_RING_MB", "8")) * 1024 * 1024
         
         self._device_code = None
         self._device_secret = None
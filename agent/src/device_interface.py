@@ -1,5 +1,7 @@
 import os
+import time
 import logging
+import threading
 from pathlib import Path
 from datetime import datetime
 
@@ -22,6 +24,10 @@ class MockPrinter:
         timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
         img.save(self.output_dir / f"print_{timestamp}.png")
 
+    def raster(self, raster):
+        # Packed 1bpp raster from raster_encoder; save what the paper would show
+        self.image(raster.to_image())
+
     def cut(self):
         with open(self.output_dir / "last_print.txt", "a") as f:
             f.write("\n[--- CUT ---]\n")
@@ -34,9 +40,101 @@ class MockPrinter:
             f.write(f"\n[QR CODE: {content}]\n")
 
 
+# Epson TM-T20III
+EPSON_VID = 0x04b8
+TM_T20III_PID = 0x0e28
+
+USB_SYSFS = Path("/sys/bus/usb/devices")
+
+
+def is_mock_env():
+    return os.environ.get("PAPERDROP_ENV") in ("development", "integration")
+
+
+def printer_present(vid=EPSON_VID, pid=TM_T20III_PID):
+    """
+    Cheap hot-plug check: is the printer enumerated on the USB bus?
+    Reads sysfs only, no USB traffic. Returns True when sysfs isn't
+    available (can't tell, so let the open attempt decide).
+    """
+    if not USB_SYSFS.is_dir():
+        return True
+    want = (f"{vid:04x}", f"{pid:04x}")
+    for dev in USB_SYSFS.iterdir():
+        try:
+            found = ((dev / "idVendor").read_text().strip(),
+                     (dev / "idProduct").read_text().strip())
+        except OSError:
+            continue
+        if found == want:
+            return True
+    return False
+
+
+class PrinterConnection:
+    """
+    Owns the printer handle and reopens it on demand, so a printer that is
+    powered on after boot or goes through a USB reset comes back without
+    restarting the agent.
+
+    `get()` is cheap when connected; while the printer is away it rescans
+    the bus at most every `rescan_interval` seconds.
+    """
+    def __init__(self, factory=None, rescan_interval=2.0):
+        self.factory = factory or get_printer_connection
+        self.rescan_interval = rescan_interval
+        self._printer = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self._printer is not None
+
+    def get(self):
+        with self._lock:
+            now = time.monotonic()
+            due = now - self._last_check >= self.rescan_interval
+
+            if self._printer is not None:
+                if due and not is_mock_env():
+                    self._last_check = now
+                    if not printer_present():
+                        self._drop("printer left the USB bus")
+                return self._printer
+
+            if not due:
+                return None
+            self._last_check = now
+            if not is_mock_env() and not printer_present():
+                return None
+
+            self._printer = self.factory()
+            if self._printer is not None:
+                logger.info("Printer connection opened")
+            return self._printer
+
+    def reset(self, reason=""):
+        """Forget the current handle (USB error); the next get() reopens it"""
+        with self._lock:
+            self._drop(reason)
+
+    def _drop(self, reason):
+        if self._printer is None:
+            return
+        logger.warning(f"Printer connection lost{': ' + reason if reason else ''}")
+        try:
+            self._printer.close()
+        except Exception:
+            pass
+        self._printer = None
+        # Allow an immediate reopen attempt
+        self._last_check = 0.0
+
+
 def get_printer_connection():
     """Factory to return real or mock printer based on ENV var"""
-    if os.environ.get("PAPERDROP_ENV") == "development" or os.environ.get("PAPERDROP_ENV") == "integration":
+    if is_mock_env():
         return MockPrinter()
     
     # Real Hardware connection
@@ -44,7 +142,7 @@ def get_printer_connection():
         from escpos.printer import Usb
         # Epson TM-T20III (VID 0x04b8, PID 0x0e28)
         # We explicitly target the user's specific model
-        return Usb(0x04b8, 0x0e28, profile="TM-T20III")
+        return Usb(EPSON_VID, TM_T20III_PID, profile="TM-T20III")
     except Exception as e:
         logger.error(f"Could not connect to real printer: {e}")
         # In production, returning None might crash logic if not handled.
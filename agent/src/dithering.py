@@ -0,0 +1,203 @@
+"""
+Dithering engine for the thermal raster.
+
+Turns grayscale pixels into packed 1bpp rows (MSB first, 1 = black dot),
+which is exactly the layout ESC/POS raster commands expect.
+
+Algorithms:
+  threshold        - fixed cut at mid-gray
+  bayer            - 8x8 ordered dither
+  floyd-steinberg  - error diffusion (7/16, 3/16, 5/16, 1/16)
+  atkinson         - error diffusion, 6/8 of the error (lighter, crisper)
+
+The tone curve is a lookup table applied with Image.point(). Floyd-
+Steinberg is Pillow's own C implementation (convert('1')), the fastest
+by far; threshold and Bayer are a few vectorized NumPy ops. Atkinson has
+no C implementation, so it runs in NumPy along anti-diagonal wavefronts
+(pixel (y, x) only depends on pixels with a smaller 2*y + x): correct,
+but some 30x slower than Floyd-Steinberg, so keep it for small images.
+
+Ditherer works band by band. Bayer phase and Atkinson's diffused error
+carry over between bands; Pillow's Floyd-Steinberg starts each band
+afresh, so its error does not cross band edges.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from raster_encoder import PackedRaster
+
+THRESHOLD = "threshold"
+BAYER = "bayer"
+FLOYD_STEINBERG = "floyd-steinberg"
+ATKINSON = "atkinson"
+
+ALGORITHMS = (THRESHOLD, BAYER, FLOYD_STEINBERG, ATKINSON)
+
+# TM-T20III thermal paper has noticeable dot gain: mid-tones print darker
+# than they look on screen. Lift them a little and add some contrast so
+# faces and gradients don't turn into solid black.
+THERMAL_GAMMA = 1.6
+THERMAL_CONTRAST = 1.15
+
+# (dy, dx, weight); Floyd-Steinberg is left to Pillow
+_KERNELS = {
+    ATKINSON: (
+        (0, 1, 1 / 8),
+        (0, 2, 1 / 8),
+        (1, -1, 1 / 8),
+        (1, 0, 1 / 8),
+        (1, 1, 1 / 8),
+        (2, 0, 1 / 8),
+    ),
+}
+
+# Error can travel up to 2 rows down and 2 columns sideways
+_PAD_ROWS = 2
+_PAD_COLS = 2
+
+_BAYER_8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32)
+_BAYER_THRESHOLDS = ((_BAYER_8 + 0.5) * (256 / 64)).astype(np.uint8)
+
+
+@lru_cache(maxsize=8)
+def tone_lut(gamma: float = THERMAL_GAMMA, contrast: float = THERMAL_CONTRAST) -> np.ndarray:
+    """256-entry gray -> corrected gray table (contrast around mid-gray, then gamma)"""
+    x = np.arange(256, dtype=np.float32) / 255.0
+    x = np.clip((x - 0.5) * contrast + 0.5, 0.0, 1.0)
+    x = np.power(x, 1.0 / gamma)
+    lut = np.round(x * 255.0).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def to_grayscale(img):
+    """
+    Convert a PIL image to 'L', flattening any transparency onto white
+    (canvas exports are RGBA; a plain convert() would print the
+    transparent background as solid black).
+    """
+    from PIL import Image
+
+    if img.mode == "L":
+        return img
+    if img.mode == "P" and "transparency" in img.info:
+        img = img.convert("RGBA")
+    if img.mode in ("RGBA", "LA", "PA"):
+        background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+        background.alpha_composite(img.convert("RGBA"))
+        img = background
+    return img.convert("L")
+
+
+class Ditherer:
+    """
+    Stateful 1bpp converter for images `width` pixels wide.
+
+    Feed 'L' bands top to bottom with `process()`; each call returns the
+    packed rows for that band.
+    """
+
+    def __init__(self, width: int, algorithm: str = FLOYD_STEINBERG,
+                 gamma: float = THERMAL_GAMMA, contrast: float = THERMAL_CONTRAST):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown dither algorithm '{algorithm}' (expected one of {ALGORITHMS})")
+        self.width = width
+        self.algorithm = algorithm
+        self.lut = tone_lut(gamma, contrast)
+        self._point_table = self.lut.tolist()
+        self._row = 0
+        self._carry = np.zeros((_PAD_ROWS, width + 2 * _PAD_COLS), dtype=np.float32)
+
+    def process(self, band: Image.Image) -> np.ndarray:
+        """
+        Dither an 'L' band `width` pixels wide. Returns (rows, row_bytes)
+        uint8 packed bits.
+        """
+        if band.mode != "L" or band.width != self.width:
+            raise ValueError(f"Expected an 'L' image {self.width} wide, got {band.mode} {band.size}")
+
+        tone = band.point(self._point_table)
+        if self.algorithm == FLOYD_STEINBERG:
+            self._row += band.height
+            return self._pil_floyd_steinberg(tone)
+        return self._dither(np.asarray(tone, dtype=np.uint8))
+
+    def _pil_floyd_steinberg(self, tone: Image.Image) -> np.ndarray:
+        # Mode '1' rows are packed MSB first like ours, but 1 = white
+        packed = np.frombuffer(
+            tone.convert("1", dither=Image.Dither.FLOYDSTEINBERG).tobytes(), dtype=np.uint8
+        ).reshape(tone.height, -1)
+        packed = packed ^ 0xFF
+        spare = -self.width % 8
+        if spare:
+            # Padding bits past the last dot must stay white
+            packed[:, -1] &= (0xFF << spare) & 0xFF
+        return packed
+
+    def _dither(self, tone: np.ndarray) -> np.ndarray:
+        if self.algorithm == THRESHOLD:
+            bits = tone < 128
+        elif self.algorithm == BAYER:
+            bits = self._bayer(tone)
+        else:
+            bits = self._diffuse(tone, _KERNELS[self.algorithm])
+
+        self._row += tone.shape[0]
+        return np.packbits(bits, axis=1)
+
+    def _bayer(self, tone: np.ndarray) -> np.ndarray:
+        rows, width = tone.shape
+        ys = (np.arange(rows) + self._row) % 8
+        xs = np.arange(width) % 8
+        return tone < _BAYER_THRESHOLDS[ys[:, None], xs[None, :]]
+
+    def _diffuse(self, tone: np.ndarray, kernel) -> np.ndarray:
+        rows, width = tone.shape
+        buf = np.zeros((rows + _PAD_ROWS, width + 2 * _PAD_COLS), dtype=np.float32)
+        buf[:rows, _PAD_COLS:_PAD_COLS + width] = tone
+        buf[:_PAD_ROWS] += self._carry
+        bits = np.zeros((rows, width), dtype=bool)
+
+        # Wavefront t holds every pixel with 2*y + x == t
+        for t in range(2 * (rows - 1) + width):
+            y_lo = max(0, (t - width + 2) // 2)
+            y_hi = min(rows - 1, t // 2)
+            if y_lo > y_hi:
+                continue
+            ys = np.arange(y_lo, y_hi + 1)
+            xs = t - 2 * ys
+            cols = xs + _PAD_COLS
+
+            old = buf[ys, cols]
+            black = old < 128.0
+            bits[ys, xs] = black
+            err = old - np.where(black, 0.0, 255.0)
+            for dy, dx, weight in kernel:
+                buf[ys + dy, cols + dx] += err * weight
+
+        # Error that spilled below this band seeds the next one
+        carry = buf[rows:rows + _PAD_ROWS].copy()
+        carry[:, :_PAD_COLS] = 0
+        carry[:, _PAD_COLS + width:] = 0
+        self._carry = carry
+        return bits
+
+
+def dither_image(img, algorithm: str = FLOYD_STEINBERG,
+                 gamma: float = THERMAL_GAMMA, contrast: float = THERMAL_CONTRAST) -> PackedRaster:
+    """Dither a whole PIL image into a PackedRaster"""
+    gray = to_grayscale(img)
+    packed = Ditherer(gray.width, algorithm, gamma, contrast).process(gray)
+    return PackedRaster(gray.width, gray.height, packed.tobytes())
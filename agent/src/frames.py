@@ -0,0 +1,107 @@
+"""
+Binary websocket frames.
+
+Lets the cloud send image jobs as raw bytes instead of a base64 data URL
+inside JSON inside JSON. Layout:
+
+    b"PD" | version (1 byte) | header length N (uint16, big-endian)
+    | N bytes UTF-8 JSON header | payload bytes
+
+The header carries the same fields as a JSON print job, e.g.
+    {"type": "print_job", "message_id": "...", "content_type": "image/png",
+     "sender_name": "..."}
+
+The payload is exposed as a memoryview over the received frame and read
+by PIL through MemoryReader, so the image bytes are never copied whole.
+JSON text frames remain the default for older backends.
+"""
+
+import io
+import json
+import struct
+
+MAGIC = b"PD"
+VERSION = 1
+_PREFIX = struct.Struct(">2sBH")
+
+
+class FrameError(ValueError):
+    """Malformed binary frame"""
+
+
+def parse_binary_frame(frame) -> tuple[dict, memoryview]:
+    """Split a binary frame into (header dict, payload memoryview)"""
+    view = memoryview(frame)
+    if len(view) < _PREFIX.size:
+        raise FrameError("Frame too short")
+
+    magic, version, header_len = _PREFIX.unpack_from(view)
+    if magic != MAGIC:
+        raise FrameError("Bad frame magic")
+    if version != VERSION:
+        raise FrameError(f"Unsupported frame version {version}")
+
+    start = _PREFIX.size
+    end = start + header_len
+    if len(view) < end:
+        raise FrameError("Truncated frame header")
+
+    try:
+        header = json.loads(bytes(view[start:end]))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise FrameError(f"Bad frame header: {e}") from e
+    if not isinstance(header, dict):
+        raise FrameError("Frame header must be a JSON object")
+
+    return header, view[end:]
+
+
+def build_binary_frame(header: dict, payload: bytes) -> bytes:
+    """Inverse of parse_binary_frame, for tooling and local testing"""
+    encoded = json.dumps(header).encode()
+    return _PREFIX.pack(MAGIC, VERSION, len(encoded)) + encoded + bytes(payload)
+
+
+class MemoryReader(io.RawIOBase):
+    """Read-only seekable file over a buffer, without copying the buffer"""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self._view[self._pos:self._pos + len(b)]
+        n = len(chunk)
+        memoryview(b).cast("B")[:n] = chunk
+        self._pos += n
+        return n
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._view) - self._pos
+        chunk = bytes(self._view[self._pos:self._pos + size])
+        self._pos += len(chunk)
+        return chunk
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if pos < 0:
+            raise ValueError("Negative seek position")
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
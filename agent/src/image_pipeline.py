@@ -0,0 +1,95 @@
+"""
+Streaming, banded image pipeline.
+
+Scales, dithers and hands off an image in horizontal bands so the
+working set is O(band) instead of O(image): a scroll-style canvas
+thousands of pixels tall never exists as a full-size resampled,
+grayscale, float error-diffusion or packed bitmap. The first band is on
+its way to the printer before the last one has been scaled.
+
+What is not banded is the decoded source: Pillow inflates it in one
+pass, at the source's own size and mode (1 byte per pixel for palette
+and grayscale PNGs, 3-4 for truecolor). JPEGs are decoded through
+draft() at the smallest scale that still covers the print width, which
+is where most of the decode memory goes on big phone photos. Sources in
+modes Pillow can't resample with a real filter (palette, 1-bit, 16-bit
+and float) are converted band by band, never as a full-size copy.
+"""
+
+import logging
+import math
+from typing import Iterator
+
+from PIL import Image
+
+from dithering import (
+    FLOYD_STEINBERG, THERMAL_CONTRAST, THERMAL_GAMMA, Ditherer, to_grayscale,
+)
+from raster_encoder import DEFAULT_BAND_HEIGHT, PackedRaster
+
+logger = logging.getLogger('paperdrop.pipeline')
+
+
+def output_size(img: Image.Image, width: int) -> tuple[int, int]:
+    """Printed size of `img` scaled to `width` dots, keeping aspect ratio"""
+    src_w, src_h = img.size
+    return width, max(1, int(src_h * (width / float(src_w))))
+
+
+# Modes Pillow resamples with nearest neighbour only, or not at all
+_CONVERT_MODES = ("1", "P", "I", "I;16", "F")
+# Source rows Lanczos reads beyond a box edge, per unit of scale
+_LANCZOS_SUPPORT = 3
+
+
+def prepare_source(img: Image.Image, width: int) -> Image.Image:
+    """Get a lazily opened image ready for band-wise resampling (shrinks JPEG decoding via draft())"""
+    if img.format == "JPEG":
+        _, height = output_size(img, width)
+        img.draft("L", (width, height))
+    return img
+
+
+def _resample_mode(img: Image.Image) -> str:
+    """Mode a band of `img` is converted to before resampling"""
+    if img.mode == "P" and "transparency" in img.info:
+        return "RGBA"
+    return "L"
+
+
+def iter_raster_bands(img: Image.Image, width: int,
+                      band_height: int = DEFAULT_BAND_HEIGHT,
+                      algorithm: str = FLOYD_STEINBERG,
+                      gamma: float = THERMAL_GAMMA,
+                      contrast: float = THERMAL_CONTRAST) -> Iterator[PackedRaster]:
+    """
+    Yield the image as consecutive PackedRaster bands of at most
+    `band_height` rows, `width` dots wide.
+    """
+    img = prepare_source(img, width)
+    src_w, src_h = img.size
+    out_w, out_h = output_size(img, width)
+    scale = src_h / float(out_h)
+    ditherer = Ditherer(out_w, algorithm, gamma, contrast)
+
+    for top in range(0, out_h, band_height):
+        rows = min(band_height, out_h - top)
+        if src_w == out_w:
+            # Already print-ready width (the cloud honoured our capabilities):
+            # no resampling at all, just slice
+            band = img.crop((0, top, src_w, top + rows))
+        elif img.mode in _CONVERT_MODES:
+            # Convert just the source rows this band reads (its box plus the
+            # filter support), then resample them as below
+            margin = math.ceil(_LANCZOS_SUPPORT * max(scale, 1.0)) + 1
+            y0 = max(0, math.floor(top * scale) - margin)
+            y1 = min(src_h, math.ceil((top + rows) * scale) + margin)
+            source = img.crop((0, y0, src_w, y1)).convert(_resample_mode(img))
+            box = (0, top * scale - y0, src_w, (top + rows) * scale - y0)
+            band = source.resize((out_w, rows), Image.Resampling.LANCZOS, box=box)
+        else:
+            # box= resamples just this slice of the source; Pillow still reads
+            # the filter support across the box edges, so bands join seamlessly
+            box = (0, top * scale, src_w, (top + rows) * scale)
+            band = img.resize((out_w, rows), Image.Resampling.LANCZOS, box=box)
+        yield PackedRaster(out_w, rows, ditherer.process(to_grayscale(band)).tobytes())
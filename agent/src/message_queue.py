@@ -0,0 +1,247 @@
+"""
+Inbound message queue.
+
+The websocket receive loop only parses frames and puts them here;
+dispatcher tasks take them off. A slow handler therefore never holds up
+the next frame, and a ping that arrives behind a burst of print jobs is
+answered first.
+
+Control messages (ping, claimed, ...) are never refused. Print jobs are
+bounded: a job holds its slot from arrival until it has printed (or
+failed), so `capacity` caps what the device is really holding, not just
+what is waiting here. A job arriving when all slots are taken (or while
+earlier jobs are still deferred) gets QueueFull; the agent then parks it
+with `defer()` (print jobs go to the spool, not RAM) and takes it back
+with `admit()` once a slot frees up, so nothing is dropped and arrival
+order is kept. The queue is `paused` from the first deferral until the
+backlog is gone and it has drained to half its capacity; `on_pause` is
+called on every flip so the agent can tell the cloud to stop and resume
+sending.
+
+Job slots double as flow-control credits. The cloud is granted the free
+slots when a session starts (`open_credits()`), spends one per message
+job it sends (new_message / print_job; test prints and reprints are not
+paced), and gets one back for every such job that leaves the device,
+printed or failed (`take_credits()`). A cloud that sticks to its credits
+keeps bursts queued on its side and never makes the device defer
+anything.
+"""
+
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger('paperdrop.inbox')
+
+CONTROL = 0
+JOB = 1
+
+# Messages that end up as paper and so take a job slot
+JOB_TYPES = frozenset(("print_job", "new_message", "test_print", "reprint"))
+# Jobs the cloud spends a credit on
+CREDITED_TYPES = frozenset(("print_job", "new_message"))
+
+
+class QueueFull(Exception):
+    """A print job can't have a slot yet: all taken, or earlier jobs are deferred"""
+
+
+def message_id_of(message: dict) -> Optional[str]:
+    """The id a job's print_status reports use, in either message format"""
+    if message.get("type") in ("test_print", "reprint"):
+        return message.get("request_id")
+    inner = message.get("message")
+    if isinstance(inner, dict) and inner.get("id"):
+        return inner["id"]
+    return message.get("message_id") or message.get("request_id")
+
+
+class InboundMessage:
+    __slots__ = ("priority", "seq", "message", "payload", "enqueued_at", "slot", "job_id",
+                 "resumed")
+
+    def __init__(self, priority: int, seq: int, message: dict, payload, slot: bool,
+                 resumed: bool = False):
+        self.priority = priority
+        self.seq = seq
+        self.message = message
+        self.payload = payload
+        self.enqueued_at = time.monotonic()
+        # Holds a job slot until release()
+        self.slot = slot
+        self.job_id = message_id_of(message) if slot else None
+        # Already in the spool (deferred there): skip the duplicate check
+        self.resumed = resumed
+
+    @property
+    def type(self) -> Optional[str]:
+        return self.message.get("type")
+
+    def __lt__(self, other: "InboundMessage") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class MessageQueue:
+    """
+    Priority queue of parsed cloud messages: control before jobs, arrival
+    order within each. Only used from the event loop.
+    """
+
+    def __init__(self, capacity: int, on_pause: Optional[Callable[[bool], None]] = None):
+        self.capacity = max(1, capacity)
+        self.on_pause = on_pause
+        self.paused = False
+        self._heap: list[InboundMessage] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        # Job slots taken: queued here or still being printed
+        self.jobs = 0
+        # job_id -> entry holding its slot, so a status report can free it
+        self._held: dict[str, InboundMessage] = {}
+        # Jobs that arrived with no slot free, oldest first (see defer())
+        self._backlog: collections.deque = collections.deque()
+        # Credits owed to the cloud since they were last handed back
+        self.credits_due = 0
+        self.received = 0
+        self.deferred = 0
+        self.max_depth = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+
+    # ─────────────────────────────────────────────────────────────────
+    # RECEIVE SIDE
+    # ─────────────────────────────────────────────────────────────────
+
+    def put(self, message: dict, payload=None, resumed: bool = False,
+            from_backlog: bool = False) -> InboundMessage:
+        """
+        Queue a parsed message. Raises QueueFull for a job with no free
+        slot, or one that would overtake deferred jobs.
+        """
+        is_job = message.get("type") in JOB_TYPES
+        if is_job:
+            if self.jobs >= self.capacity or (self._backlog and not from_backlog):
+                self._set_paused(True)
+                raise QueueFull(f"{self.jobs}/{self.capacity} jobs held, "
+                                f"{len(self._backlog)} deferred")
+            self.jobs += 1
+
+        entry = InboundMessage(JOB if is_job else CONTROL, next(self._seq),
+                               message, payload, slot=is_job, resumed=resumed)
+        if entry.job_id:
+            self._held.setdefault(entry.job_id, entry)
+        heapq.heappush(self._heap, entry)
+        self.received += 1
+        self.max_depth = max(self.max_depth, len(self._heap))
+        self._wakeup.set()
+        return entry
+
+    # ─────────────────────────────────────────────────────────────────
+    # DISPATCH SIDE
+    # ─────────────────────────────────────────────────────────────────
+
+    async def get(self) -> InboundMessage:
+        """Next message to dispatch, waiting for one if needed"""
+        while not self._heap:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        entry = heapq.heappop(self._heap)
+
+        waited = time.monotonic() - entry.enqueued_at
+        self._waited += 1
+        self._wait_total += waited
+        self._wait_last = waited
+        self._wait_max = max(self._wait_max, waited)
+        return entry
+
+    def release(self, entry: InboundMessage):
+        """The message is fully handled; a job gives its slot back"""
+        if not entry.slot:
+            return
+        entry.slot = False
+        self.jobs -= 1
+        if entry.type in CREDITED_TYPES:
+            self.credits_due += 1
+        if self._held.get(entry.job_id) is entry:
+            del self._held[entry.job_id]
+        if self.paused and not self._backlog and self.jobs <= self.capacity // 2:
+            self._set_paused(False)
+
+    def complete(self, job_id: Optional[str]):
+        """Release the slot of the job reported under `job_id`, if one is held"""
+        entry = self._held.get(job_id) if job_id else None
+        if entry:
+            self.release(entry)
+
+    # ─────────────────────────────────────────────────────────────────
+    # BACKLOG
+    # ─────────────────────────────────────────────────────────────────
+
+    def defer(self, item):
+        """Park a job QueueFull turned away; `item` is whatever the caller needs to put() it later"""
+        self.deferred += 1
+        self._backlog.append(item)
+
+    def admit(self):
+        """The oldest deferred item if a slot is free now (put() it with from_backlog=True)"""
+        if self._backlog and self.jobs < self.capacity:
+            return self._backlog.popleft()
+        return None
+
+    # ─────────────────────────────────────────────────────────────────
+    # CREDITS
+    # ─────────────────────────────────────────────────────────────────
+
+    def open_credits(self) -> int:
+        """
+        Credits for a new session: the free slots. Whatever the previous
+        session was owed is void; held jobs pay theirs back as they finish.
+        """
+        self.credits_due = 0
+        return max(0, self.capacity - self.jobs - len(self._backlog))
+
+    def take_credits(self) -> int:
+        """Credits owed to the cloud, handed over (and so no longer owed)"""
+        credits, self.credits_due = self.credits_due, 0
+        return credits
+
+    def _set_paused(self, paused: bool):
+        if paused == self.paused:
+            return
+        self.paused = paused
+        logger.warning(f"Job queue {'full, pausing' if paused else 'drained, resuming'} "
+                       f"({self.jobs}/{self.capacity})")
+        if self.on_pause:
+            self.on_pause(paused)
+
+    # ─────────────────────────────────────────────────────────────────
+    # METRICS
+    # ─────────────────────────────────────────────────────────────────
+
+    @property
+    def depth(self) -> int:
+        return len(self._heap)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.depth,
+            "jobs": self.jobs,
+            "capacity": self.capacity,
+            "paused": self.paused,
+            "credits_due": self.credits_due,
+            "received": self.received,
+            "deferred": self.deferred,
+            "backlog": len(self._backlog),
+            "max_queued": self.max_depth,
+            "wait_ms": {
+                "last": round(self._wait_last * 1000, 1),
+                "avg": round(self._wait_total / self._waited * 1000, 1) if self._waited else 0.0,
+                "max": round(self._wait_max * 1000, 1),
+            },
+        }
@@ -0,0 +1,241 @@
+"""
+NV graphics registry.
+
+The header logo printed on every message is uploaded once to the
+TM-T20III's NV graphics memory with `GS ( L` function 67 and afterwards
+printed with the 11-byte function 69 instead of resending the raster.
+
+NV memory is flash: writes are slow (the printer is busy while it
+stores) and wear it, and nothing here ever deletes a graphic. So only
+graphics the caller pins (the header logo, which changes about never)
+are uploaded; photos and stickers from jobs are always sent as rasters,
+however often they are reprinted, unless the same bitmap is already
+resident. When the memory is full, pinned bitmaps are sent as rasters
+too. Which bitmaps are resident, under which key code, is tracked by
+content hash in a JSON index next to the raster cache. A bitmap only
+counts as resident once the bytes defining it have reached the printer
+(`confirm()`); an upload that never went out is forgotten
+(`discard()`), so a logo never turns into a reference to an empty slot.
+
+`FS q` (legacy NV bit images) rewrites the whole NV area on every
+definition, so only GS ( L is used.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from raster_encoder import PackedRaster, trim_raster
+
+logger = logging.getLogger('paperdrop.nv')
+
+GS = b"\x1d"
+
+_M = 48
+_FN_CAPACITY = 51
+_FN_KEY_LIST = 64
+_FN_DEFINE_RASTER = 67
+_FN_PRINT = 69
+# Reply headers: 37h, then an identifier per function (30h is function
+# 48's total capacity; function 51, the remaining capacity, answers 31h)
+_CAPACITY_REPLY = b"\x37\x31"
+_KEY_LIST_REPLY = b"\x37\x72"
+# a: fixed at 48 for function 67
+_TONE_A = 48
+# b: number of colours in the data (1 = monochrome)
+_ONE_COLOR = 1
+# c: which colour the data is for
+_COLOR_1 = 49
+
+# GS ( L limits for one graphic
+MAX_WIDTH = 8192
+MAX_HEIGHT = 2304
+
+# All our key codes share the first byte; the second picks the slot
+_KC1 = ord("P")
+_KC2_RANGE = range(32, 127)
+
+
+def gs_l(fn: int, params: bytes) -> bytes:
+    """`GS ( L pL pH m fn ...`, or `GS 8 L` when the parameters exceed 64KB"""
+    n = len(params) + 2
+    if n <= 0xFFFF:
+        return GS + b"(L" + n.to_bytes(2, "little") + bytes((_M, fn)) + params
+    return GS + b"8L" + n.to_bytes(4, "little") + bytes((_M, fn)) + params
+
+
+def define_command(key: bytes, raster: PackedRaster) -> bytes:
+    """Store `raster` in NV memory under the two-byte `key`"""
+    return gs_l(_FN_DEFINE_RASTER, bytes((_TONE_A,)) + key + bytes((_ONE_COLOR,))
+                + raster.width.to_bytes(2, "little")
+                + raster.height.to_bytes(2, "little")
+                + bytes((_COLOR_1,)) + bytes(raster.data))
+
+
+def print_command(key: bytes, scale_x: int = 1, scale_y: int = 1) -> bytes:
+    """Print the NV graphic stored under `key`"""
+    return gs_l(_FN_PRINT, key + bytes((scale_x, scale_y)))
+
+
+def raster_digest(raster: PackedRaster) -> str:
+    h = hashlib.sha256()
+    h.update(f"{raster.width}x{raster.height}:".encode())
+    h.update(raster.data)
+    return h.hexdigest()
+
+
+class GraphicsRegistry:
+    def __init__(self, index_file: Path, capacity: int, max_graphic_bytes: int):
+        self.index_file = Path(index_file)
+        self.capacity = capacity
+        self.max_graphic_bytes = max_graphic_bytes
+        self._lock = threading.Lock()
+        # digest -> {"key": "P!", "bytes": n}
+        self._resident: dict[str, dict] = {}
+        # Uploads handed out by lookup() but not yet written to the printer
+        self._uploading: dict[str, dict] = {}
+        self._checked_printer = None
+        self._load()
+
+    # ─────────────────────────────────────────────────────────────────
+    # PRINTING
+    # ─────────────────────────────────────────────────────────────────
+
+    def lookup(self, printer, raster: PackedRaster, pin: bool = False) -> Optional[bytes]:
+        """
+        Bytes that print `raster` from NV memory, preceded by its upload
+        if it is `pin`ned and not stored yet. None means send the raster
+        as usual. Once the bytes are written, call `confirm()` (or
+        `discard()` if writing them failed).
+        """
+        raster = trim_raster(raster)
+        if not self._eligible(raster):
+            return None
+
+        digest = raster_digest(raster)
+        with self._lock:
+            self._check_printer(printer)
+            entry = self._resident.get(digest) or self._uploading.get(digest)
+            if entry:
+                # An upload still in flight sits earlier in the same buffer
+                return print_command(entry["key"].encode("latin-1"))
+
+            if not pin:
+                return None
+
+            key = self._free_key()
+            uploading = sum(e["bytes"] for e in self._uploading.values())
+            if key is None or self.used_bytes + uploading + len(raster.data) > self.capacity:
+                logger.info("NV graphics memory full, sending raster instead")
+                return None
+
+            self._uploading[digest] = {"key": key.decode("latin-1"), "bytes": len(raster.data)}
+        logger.info(f"Storing {raster.width}x{raster.height} graphic in NV memory as {key!r}")
+        return define_command(key, raster) + print_command(key)
+
+    def confirm(self):
+        """The bytes from lookup() reached the printer: uploads are now resident"""
+        with self._lock:
+            if not self._uploading:
+                return
+            self._resident.update(self._uploading)
+            self._uploading.clear()
+            self._save()
+
+    def discard(self):
+        """The bytes from lookup() were never written: forget their uploads"""
+        with self._lock:
+            self._uploading.clear()
+
+    def _eligible(self, raster: PackedRaster) -> bool:
+        return (0 < raster.width <= MAX_WIDTH and 0 < raster.height <= MAX_HEIGHT
+                and len(raster.data) <= self.max_graphic_bytes)
+
+    @property
+    def used_bytes(self) -> int:
+        return sum(e["bytes"] for e in self._resident.values())
+
+    def _free_key(self) -> Optional[bytes]:
+        used = {e["key"] for e in self._resident.values()}
+        used.update(e["key"] for e in self._uploading.values())
+        for kc2 in _KC2_RANGE:
+            key = bytes((_KC1, kc2))
+            if key.decode("latin-1") not in used:
+                return key
+        return None
+
+    # ─────────────────────────────────────────────────────────────────
+    # PRINTER CHECKS
+    # ─────────────────────────────────────────────────────────────────
+
+    def _check_printer(self, printer):
+        """
+        Once per printer handle: ask what's really stored (another printer
+        plugged in, NV cleared by the utility...) and how much room is left.
+        Printers we can't read from are trusted to match the index.
+        """
+        if printer is self._checked_printer:
+            return
+        self._checked_printer = printer
+        if not (hasattr(printer, "_raw") and hasattr(printer, "_read")):
+            return
+
+        try:
+            keys = self._query_keys(printer)
+            free = self._query(printer, gs_l(_FN_CAPACITY, b""), prefix=_CAPACITY_REPLY)
+        except Exception as e:
+            logger.warning(f"NV graphics query failed: {e}")
+            return
+
+        if keys is not None:
+            stale = [d for d, e in self._resident.items() if e["key"] not in keys]
+            for digest in stale:
+                del self._resident[digest]
+            if stale:
+                logger.warning(f"{len(stale)} NV graphic(s) no longer on the printer")
+                self._save()
+        if free is not None and free.isdigit():
+            self.capacity = min(self.capacity, self.used_bytes + int(free))
+
+    def _query_keys(self, printer) -> Optional[set]:
+        reply = self._query(printer, gs_l(_FN_KEY_LIST, b"KC"), prefix=_KEY_LIST_REPLY)
+        if reply is None or not reply or reply[0] != 0x40:
+            # 0x41: more pages follow; not worth the round trips, trust the index
+            return None
+        codes = reply[1:]
+        return {codes[i:i + 2].decode("latin-1") for i in range(0, len(codes) - 1, 2)}
+
+    @staticmethod
+    def _query(printer, command: bytes, prefix: bytes) -> Optional[bytes]:
+        """Send a GS ( L query and return the reply between header and NUL"""
+        printer._raw(command)
+        reply = printer._read()
+        if not reply:
+            return None
+        reply = bytes(reply)
+        start = reply.find(prefix)
+        end = reply.find(b"\x00", start)
+        if start < 0 or end < 0:
+            return None
+        return reply[start + len(prefix):end]
+
+    # ─────────────────────────────────────────────────────────────────
+    # INDEX
+    # ─────────────────────────────────────────────────────────────────
+
+    def _load(self):
+        try:
+            self._resident = json.loads(self.index_file.read_text())
+        except FileNotFoundError:
+            pass
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"NV graphics index unreadable, starting fresh: {e}")
+
+    def _save(self):
+        tmp = self.index_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._resident))
+        os.replace(tmp, self.index_file)
@@ -0,0 +1,228 @@
+"""
+Outbound frame channel.
+
+Everything the agent sends to the cloud goes through one writer task,
+so job handlers, the ping dispatcher and status pushes never await a
+slow socket and never interleave on it. `send()` only queues.
+
+While a frame waits it can still be replaced:
+
+- print_status frames for the same message_id coalesce, so a job whose
+  "printing" hasn't gone out yet sends only "printed" (credits add up);
+- pong, backpressure and printer_status keep only their latest value;
+- credit frames add up.
+
+When the writer finds several status updates waiting (the link is slow
+or a burst just finished) it sends them as one `print_status_batch`
+frame, `{"type": "print_status_batch", "updates": [...]}`, each update
+a print_status frame without its type.
+
+Frames that can't be written (not connected, connection dropped) go to
+`on_undelivered`, so final outcomes can be spooled for the next session.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Callable, Optional
+
+from websockets.exceptions import ConnectionClosed
+
+logger = logging.getLogger('paperdrop.outbound')
+
+# Most status updates packed into one print_status_batch frame
+BATCH_MAX = 32
+
+# Frame types where only the newest unsent value matters
+_LATEST_ONLY = frozenset(("pong", "backpressure", "printer_status"))
+
+
+class _Pending:
+    __slots__ = ("frame", "waiters", "notify")
+
+    def __init__(self, frame: dict):
+        self.frame = frame
+        # Futures of deliver() calls, resolved with whether it went out
+        self.waiters: list[asyncio.Future] = []
+        # Some send() caller counts on on_undelivered if it doesn't
+        self.notify = False
+
+
+class OutboundChannel:
+    def __init__(self, on_undelivered: Optional[Callable[[dict], None]] = None):
+        self.on_undelivered = on_undelivered
+        self.websocket = None
+        # Coalescing key -> pending frame; dicts keep arrival order
+        self._pending: dict = {}
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._unkeyed = 0
+        self.frames = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.undelivered = 0
+
+    # ─────────────────────────────────────────────────────────────────
+    # CONNECTION
+    # ─────────────────────────────────────────────────────────────────
+
+    def attach(self, websocket):
+        """Start writing to a freshly opened connection"""
+        self.websocket = websocket
+        self._writer = asyncio.create_task(self._run())
+
+    async def detach(self):
+        """Stop the writer; whatever is still queued is undelivered"""
+        self.websocket = None
+        writer, self._writer = self._writer, None
+        if writer:
+            writer.cancel()
+            try:
+                await writer
+            except asyncio.CancelledError:
+                pass
+        pending, self._pending = self._pending, {}
+        self._fail(list(pending.values()))
+
+    # ─────────────────────────────────────────────────────────────────
+    # QUEUEING
+    # ─────────────────────────────────────────────────────────────────
+
+    def send(self, frame: dict):
+        """Queue `frame` for the writer. Never blocks."""
+        self._restart_writer()
+        if self._writer is None:
+            entry = _Pending(frame)
+            entry.notify = True
+            self._fail([entry])
+            return
+        self._queue(frame).notify = True
+
+    async def deliver(self, frame: dict) -> bool:
+        """
+        Queue `frame` and wait until it is written. False if it wasn't;
+        `on_undelivered` is left to the caller then.
+        """
+        self._restart_writer()
+        if self._writer is None:
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._queue(frame).waiters.append(future)
+        return await future
+
+    def _restart_writer(self):
+        """A writer that died on an error is started again while connected"""
+        if self._writer is None and self.websocket is not None:
+            self._writer = asyncio.create_task(self._run())
+
+    def _queue(self, frame: dict) -> _Pending:
+        key = self._key(frame)
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = _Pending(frame)
+        else:
+            self.coalesced += 1
+            entry.frame = self._merge(entry.frame, frame)
+        self._wakeup.set()
+        return entry
+
+    def _key(self, frame: dict):
+        kind = frame.get("type")
+        if kind == "print_status" and frame.get("message_id"):
+            return (kind, frame["message_id"])
+        if kind in _LATEST_ONLY or kind == "credit":
+            return (kind,)
+        self._unkeyed += 1
+        return (kind, None, self._unkeyed)
+
+    @staticmethod
+    def _merge(old: dict, new: dict) -> dict:
+        credits = old.get("credits", 0) + new.get("credits", 0)
+        merged = dict(new)
+        if credits:
+            merged["credits"] = credits
+        return merged
+
+    # ─────────────────────────────────────────────────────────────────
+    # WRITER
+    # ─────────────────────────────────────────────────────────────────
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            entries, self._pending = list(self._pending.values()), {}
+            framed = self._framed(entries)
+            for i, (wire, group) in enumerate(framed):
+                try:
+                    await self.websocket.send(json.dumps(wire))
+                except (ConnectionClosed, asyncio.CancelledError) as e:
+                    # On a close listen_for_messages stops too and we get
+                    # detached; anything queued until then fails there
+                    self._fail([entry for _, unsent in framed[i:] for entry in unsent])
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                    return
+                except Exception as e:
+                    # Anything else (a frame json can't encode, a transport
+                    # error) would leave frames queued for a writer that is
+                    # gone: fail them all and let the next send() restart it
+                    logger.error(f"Outbound writer failed on a {wire.get('type')} frame: {e}")
+                    pending, self._pending = self._pending, {}
+                    self._fail([entry for _, unsent in framed[i:] for entry in unsent]
+                               + list(pending.values()))
+                    self._writer = None
+                    return
+                self.frames += 1
+                if wire["type"] == "print_status_batch":
+                    self.batches += 1
+                for entry in group:
+                    for waiter in entry.waiters:
+                        if not waiter.done():
+                            waiter.set_result(True)
+
+    def _framed(self, entries: list) -> list:
+        """Wire frames for `entries`, as (frame, entries it carries) pairs"""
+        statuses = [e for e in entries if e.frame.get("type") == "print_status"]
+        if len(statuses) < 2:
+            return [(e.frame, [e]) for e in entries]
+
+        out = []
+        batched = False
+        for entry in entries:
+            if entry.frame.get("type") != "print_status":
+                out.append((entry.frame, [entry]))
+            elif not batched:
+                # All status updates go out where the first one was queued
+                batched = True
+                for start in range(0, len(statuses), BATCH_MAX):
+                    group = statuses[start:start + BATCH_MAX]
+                    out.append(({
+                        "type": "print_status_batch",
+                        "updates": [{k: v for k, v in e.frame.items() if k != "type"}
+                                    for e in group],
+                    }, group))
+        return out
+
+    def _fail(self, entries: list):
+        for entry in entries:
+            self.undelivered += 1
+            for waiter in entry.waiters:
+                if not waiter.done():
+                    waiter.set_result(False)
+            if entry.notify and self.on_undelivered:
+                self.on_undelivered(entry.frame)
+
+    # ─────────────────────────────────────────────────────────────────
+    # METRICS
+    # ─────────────────────────────────────────────────────────────────
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._pending),
+            "frames": self.frames,
+            "batches": self.batches,
+            "coalesced": self.coalesced,
+            "undelivered": self.undelivered,
+        }
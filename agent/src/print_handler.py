@@ -1,43 +1,349 @@
-from PIL import Image
-import io
+import os
+import sys
+import time
+import contextlib
+import queue
 import base64
-from device_interface import get_printer_connection
+from config import config
+from frames import MemoryReader
+from device_interface import PrinterConnection
+from command_buffer import CommandBuffer, TransferStats
+from raster_cache import RasterCache, cache_key
+from raster_encoder import (
+    COMPRESSION_NONE, COMPRESSION_RLE, PackedRaster, decode_raster_payload,
+    write_raster, write_raster_bands,
+)
+# NumPy/PIL-based modules (dithering, image_pipeline) and the render pool
+# are imported lazily: they cost hundreds of ms on a Pi and only image
+# jobs need them
+
+# 80mm paper on the TM-T20III: 576 dots per line
+PRINT_WIDTH = 576
+
+# What we can take from the cloud without conversion
+CONTENT_ENCODINGS = ("png", "jpeg", "webp", "raster1bpp")
+RASTER_COMPRESSIONS = (COMPRESSION_NONE, COMPRESSION_RLE)
+# Printed natively by the TM-T20III (GS ( k); MockPrinter logs them
+SYMBOLOGIES = ("qr",)
+
+# Validated against dithering.ALGORITHMS in warm_up()
+DITHER_ALGORITHM = os.environ.get("PAPERDROP_DITHER", "floyd-steinberg")
+
+
+def _is_usb_error(e):
+    """A pyusb transfer error, i.e. the printer handle is likely stale"""
+    # pyusb is only loaded once a real printer was opened; without it no
+    # USBError can have been raised
+    usb_core = sys.modules.get("usb.core")
+    return usb_core is not None and isinstance(e, usb_core.USBError)
+
+class PreparedImage:
+    """
+    An image job after pipeline stage one: decoded and looked up in the
+    raster cache off the printer thread. When streamed, render() runs on
+    the render thread and hands bands over as they are dithered, so the
+    printer thread starts on the first band while the rest are rendered.
+    """
+
+    def __init__(self, key, raster=None, img=None, streamed=False, pending=None):
+        self.key = key
+        self.raster = raster  # cache hit: nothing to render
+        self.pending = pending  # Future[PackedRaster] from the render pool
+        self._img = img
+        self._bands = queue.Queue() if streamed and img is not None else None
+
+    def _render_bands(self):
+        from image_pipeline import iter_raster_bands
+        img, self._img = self._img, None
+        yield from iter_raster_bands(img, PRINT_WIDTH, algorithm=DITHER_ALGORITHM)
+
+    def render(self):
+        """Render thread: dither every band into the hand-over queue"""
+        if self._bands is None:
+            return
+        try:
+            for band in self._render_bands():
+                self._bands.put(band)
+        except BaseException as e:
+            self._bands.put(e)
+        else:
+            self._bands.put(None)
+
+    def bands(self):
+        """Printer thread: bands in order, as soon as they exist"""
+        if self._bands is None:
+            yield from self._render_bands()
+            return
+        while True:
+            band = self._bands.get()
+            if band is None:
+                return
+            if isinstance(band, BaseException):
+                raise band
+            yield band
+
 
 class PrintHandler:
     def __init__(self):
-        self.p = get_printer_connection()
+        # Nothing slow here: importing this module must not touch USB or disk.
+        # warm_up() does the real work on the printer worker thread once the
+        # agent is running.
+        self.connection = None
+        self.cache = None
+        self.render_pool = None
+        self.warmup_seconds = None
+        self.transfers = TransferStats()
+        self.graphics = None
+        self.text_encoder = None
+        self._header_logo = None
+
+    def warm_up(self):
+        """
+        Open the printer and load everything the first job needs.
+        Returns how long it took (seconds).
+        """
+        started = time.monotonic()
+
+        # Reopened on demand when the printer is plugged in / after USB resets
+        self.connection = PrinterConnection()
         if not self.p:
             print("WARNING: No printer connection established (Real or Mock).")
+        self.cache = RasterCache(config.RASTER_CACHE_DIR, config.RASTER_CACHE_MAX_BYTES)
+        from text_encoder import TextEncoder
+        self.text_encoder = TextEncoder(config.TEXT_TABLE_FILE, config.GLYPH_CACHE_FILE)
+        if config.NV_GRAPHICS_ENABLED:
+            from nv_graphics import GraphicsRegistry
+            self.graphics = GraphicsRegistry(
+                config.NV_GRAPHICS_INDEX, config.NV_GRAPHICS_BYTES, config.NV_GRAPHIC_MAX_BYTES
+            )
 
-    def print_text(self, text):
-        if not self.p: return
+        # PIL + NumPy + resampling code, so the first image job doesn't pay
+        # for the import
+        import image_pipeline  # noqa: F401
+        from dithering import ALGORITHMS, FLOYD_STEINBERG
+
+        global DITHER_ALGORITHM
+        if DITHER_ALGORITHM not in ALGORITHMS:
+            print(f"WARNING: Unknown PAPERDROP_DITHER '{DITHER_ALGORITHM}', using {FLOYD_STEINBERG}")
+            DITHER_ALGORITHM = FLOYD_STEINBERG
+
+        if config.RENDER_WORKERS > 0 and self.render_pool is None:
+            from render_pool import RenderPool
+            pool = RenderPool(config.RENDER_WORKERS)
+            try:
+                pool.start()
+            except Exception as e:
+                # No /dev/shm, no fork server...: render in-process instead
+                print(f"WARNING: Render pool unavailable, rendering in-process: {e}")
+                pool.shutdown()
+            else:
+                self.render_pool = pool
+
+        self.warmup_seconds = time.monotonic() - started
+        return self.warmup_seconds
+
+    def close(self):
+        """Stop helper processes; called once the printer worker has drained"""
+        if self.render_pool:
+            self.render_pool.shutdown()
+            self.render_pool = None
+
+    @property
+    def p(self):
+        if self.connection is None:
+            return None
+        return self.connection.get()
+
+    def reset_connection(self, reason=""):
+        """Drop a broken printer handle; it is reopened on next use"""
+        if self.connection:
+            self.connection.reset(reason)
+
+    @contextlib.contextmanager
+    def _printing(self):
+        """
+        Let errors reach the caller (the worker reports the job failed),
+        dropping the printer handle first if USB failed under us
+        """
         try:
-            self.p.text(text + "\n")
-            self.p.cut()
+            yield
         except Exception as e:
-            print(f"Print error: {e}")
+            if _is_usb_error(e):
+                self.reset_connection(str(e))
+            raise
+
+    def commands(self):
+        """Buffered ESC/POS writer for the current printer; flush() sends it in bulk"""
+        return CommandBuffer(self.p, self.transfers, encoder=self.text_encoder)
+
+    def stats(self):
+        """USB transfer counters (merged into the worker's stats)"""
+        return {"usb": self.transfers.to_dict()}
 
-    def print_image(self, base64_image):
+    def _cut(self):
+        with self.commands() as out:
+            out.cut()
+
+    def _write_raster(self, raster):
+        """Send a raster, by reference if the same bitmap is resident in NV memory"""
+        if self.graphics and hasattr(self.p, "_raw"):
+            command = self.graphics.lookup(self.p, raster)
+            if command:
+                try:
+                    self.p._raw(command)
+                except BaseException:
+                    self.graphics.discard()
+                    raise
+                self.graphics.confirm()
+                return
+        write_raster(self.p, raster)
+
+    def header_logo(self):
+        """Packed bitmap of HEADER_LOGO_FILE, or None to print the text header"""
+        if self._header_logo is None:
+            self._header_logo = False
+            if config.HEADER_LOGO_FILE.exists():
+                try:
+                    from PIL import Image
+                    from image_pipeline import iter_raster_bands
+                    img = Image.open(config.HEADER_LOGO_FILE)
+                    width = min(img.width, PRINT_WIDTH)  # never upscale a logo
+                    self._header_logo = PackedRaster.concat(list(
+                        iter_raster_bands(img, width, algorithm=DITHER_ALGORITHM)
+                    ))
+                except Exception as e:
+                    print(f"WARNING: Can't load header logo: {e}")
+        return self._header_logo or None
+
+    def capabilities(self):
+        """What this device can print, so the cloud can send print-ready payloads"""
+        return {
+            "dot_width": PRINT_WIDTH,
+            "content_encodings": list(CONTENT_ENCODINGS),
+            "raster_compression": list(RASTER_COMPRESSIONS),
+            "binary_frames": True,
+            "max_frame_size": config.MAX_FRAME_SIZE,
+            "queue_capacity": config.JOB_QUEUE_CAPACITY,
+            "symbologies": list(SYMBOLOGIES),
+        }
+
+    def print_text(self, text):
         if not self.p: return
-        try:
+        with self._printing(), self.commands() as out:
+            out.text(text + "\n")
+            out.cut()
+
+    def prepare_print_image(self, image, message_id=None):
+        """
+        Pipeline stage one for print_image (see PrinterWorker), run on the
+        render thread. Must not touch the printer.
+        """
+        return self._prepare_image(image, streamed=True)
+
+    def _prepare_image(self, image, streamed=False):
+        """Decode the payload and look it up in the raster cache"""
+        if isinstance(image, str):
             # Remove header if present (data:image/png;base64,...)
-            if 'base64,' in base64_image:
-                base64_image = base64_image.split('base64,')[1]
-            
-            image_data = base64.b64decode(base64_image)
-            img = Image.open(io.BytesIO(image_data))
-            
-            # Resize logic (max width 576px for 80mm TM-T20III)
-            width = 576
-            w_percent = (width / float(img.size[0]))
-            h_size = int((float(img.size[1]) * float(w_percent)))
-            img = img.resize((width, h_size), Image.Resampling.LANCZOS)
-
-            self.p.image(img)
-            self.p.cut()
-            
-        except Exception as e:
-            print(f"Print image error: {e}")
+            if 'base64,' in image:
+                image = image.split('base64,')[1]
+            image_data = base64.b64decode(image)
+        else:
+            image_data = image
+
+        from dithering import THERMAL_CONTRAST, THERMAL_GAMMA
+        key = cache_key(
+            image_data, width=PRINT_WIDTH, dither=DITHER_ALGORITHM,
+            gamma=THERMAL_GAMMA, contrast=THERMAL_CONTRAST,
+        )
+
+        raster = self.cache.get(key)
+        if raster:
+            # Seen this exact image before: straight to USB
+            return PreparedImage(key, raster=raster)
+
+        # PIL is only needed when we actually render; pre-dithered
+        # raster jobs and cache hits never import it
+        from PIL import Image
+        img = Image.open(MemoryReader(image_data))
+
+        if streamed and self.render_pool:
+            # Header is all we read here; a pool process decodes the rest
+            from image_pipeline import output_size
+            _, out_height = output_size(img, PRINT_WIDTH)
+            pending = self.render_pool.submit(
+                image_data, PRINT_WIDTH, out_height, DITHER_ALGORITHM,
+                THERMAL_GAMMA, THERMAL_CONTRAST,
+            )
+            return PreparedImage(key, pending=pending)
+        return PreparedImage(key, img=img, streamed=streamed)
+
+    def print_image(self, image, message_id=None):
+        """
+        `image` is a base64 string / data URL, raw bytes from a binary frame,
+        or a PreparedImage from the worker's render stage
+        """
+        if not self.p: return
+        with self._printing():
+            if isinstance(image, PreparedImage):
+                prepared = image
+            else:
+                # Called directly: bands are dithered as they're written
+                prepared = self._prepare_image(image)
+
+            if prepared.pending is not None:
+                # Rendered whole by the pool
+                prepared.raster = prepared.pending.result()
+                self.cache.put(prepared.key, prepared.raster)
+
+            if prepared.raster:
+                self._write_raster(prepared.raster)
+            else:
+                # Scale to 576px (80mm TM-T20III), dither and send band by band,
+                # so tall canvases never sit in memory as full-size bitmaps.
+                # Packed bands (1/8 of a grayscale bitmap) are kept for the cache.
+                bands = []
+                def rendered():
+                    for band in prepared.bands():
+                        bands.append(band)
+                        yield band
+                write_raster_bands(self.p, rendered())
+                self.cache.put(prepared.key, PackedRaster.concat(bands))
+
+            if message_id:
+                self.cache.remember(message_id, prepared.key)
+            self._cut()
+
+    def print_raster(self, width, height, data, compression=COMPRESSION_NONE, message_id=None):
+        """
+        Print a raster the cloud already rendered and dithered: packed 1bpp
+        rows (1 = black), optionally PackBits-compressed. No PIL, no resize,
+        no dither on the device.
+        """
+        if not self.p: return
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        raster = decode_raster_payload(width, height, data, compression)
+        if raster.width > PRINT_WIDTH:
+            raise ValueError(f"Raster is {raster.width} dots wide, printer takes {PRINT_WIDTH}")
+
+        with self._printing():
+            self._write_raster(raster)
+            self._cut()
+
+        if message_id:
+            key = cache_key(raster.data, width=raster.width, height=raster.height, format="raster1bpp")
+            self.cache.put(key, raster)
+            self.cache.remember(message_id, key)
+
+    def reprint(self, message_id):
+        """Print a previously rendered image job again, from the raster cache"""
+        if not self.p: return
+        raster = self.cache.get_for_message(message_id)
+        if raster is None:
+            raise LookupError(f"No cached raster for message {message_id}")
+        with self._printing():
+            self._write_raster(raster)
+            self._cut()
 
     def print_message(self, message):
          if not self.p: return
@@ -45,29 +351,33 @@ class PrintHandler:
          # { "body": "...", "timestamp": true }
          body = message.get('content')
          
-         # Basic formatting commands
-         # Note: MockPrinter wraps these calls, Real printer uses escpos commands
-         # We assume 'set' method exists on both interfaces
-         if hasattr(self.p, 'set'):
-             self.p.set(align='center', bold=True)
+         # Everything below lands in one buffer and goes out as a single
+         # bulk write when the block ends (MockPrinter gets the calls directly)
+         with self._printing(), self.commands() as out:
+             out.set(align='center', bold=True)
          
-         self.p.text("PaperDrop\n")
-         self.p.text("----------------\n")
+             logo = self.header_logo()
+             if logo:
+                 # Stored in NV memory on first use, then an 11-byte command
+                 out.graphic(logo, self.graphics)
+             else:
+                 out.text("PaperDrop\n")
+             out.text("----------------\n")
          
-         if hasattr(self.p, 'set'):
-             self.p.set(align='left', bold=False)
+             out.set(align='left', bold=False)
          
-         if isinstance(body, str):
-             self.p.text(body + "\n")
-         elif isinstance(body, dict):
-             if body.get('body'):
-                 self.p.text(body.get('body') + "\n")
+             if isinstance(body, str):
+                 out.text(body + "\n")
+             elif isinstance(body, dict):
+                 if body.get('body'):
+                     out.text(body.get('body') + "\n")
+                 if body.get('qr') and hasattr(self.p, 'qr'):
+                     out.qr(body.get('qr'), native=True, size=6)
          
-         self.p.text("\n")
-         if hasattr(self.p, 'set'):
-             self.p.set(align='center')
-         self.p.text("----------------\n")
-         self.p.text(f"Sent by {message.get('sender_name', 'Unknown')}\n")
-         self.p.cut()
+             out.text("\n")
+             out.set(align='center')
+             out.text("----------------\n")
+             out.text(f"Sent by {message.get('sender_name', 'Unknown')}\n")
+             out.cut()
 
 print_handler = PrintHandler()
@@ -0,0 +1,307 @@
+"""
+Crash-safe print spool.
+
+A SQLite (WAL) ledger under CONFIG_DIR that records every job the cloud
+hands us, keyed by message_id, through received -> printing ->
+printed/failed. Status reports that could not be delivered are kept in
+an outbox and flushed on reconnect. The newest printed job is kept as
+the session cursor, so a reconnect can ask the cloud for what it missed.
+
+Writes are group-committed: transitions are queued in memory and
+`flush()`, which the agent runs on a worker thread at a short interval,
+applies them in one transaction and commits it (one WAL fsync). That
+keeps SD card writes down when a burst of jobs arrives, and a write from
+the event loop never waits for an fsync: it only appends to the queue.
+Reads apply the queued writes first, so they see them; the few that run
+on the event loop (duplicates, deferred jobs, reconnect) may wait for a
+commit in progress. Duplicate deliveries are caught from an in-memory
+set of known message_ids, without reading the database; finished jobs
+older than `keep_days` leave both the table and that set, at start-up
+and then hourly from flush().
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger('paperdrop.spool')
+
+RECEIVED = "received"
+PRINTING = "printing"
+PRINTED = "printed"
+FAILED = "failed"
+
+PENDING_STATES = (RECEIVED, PRINTING)
+
+# Seconds between prunes of old finished jobs
+PRUNE_INTERVAL = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    message_id  TEXT PRIMARY KEY,
+    state       TEXT NOT NULL,
+    payload     TEXT,
+    body        BLOB,
+    error       TEXT,
+    received_at REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, received_at);
+
+CREATE TABLE IF NOT EXISTS outbox (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id  TEXT NOT NULL,
+    frame       TEXT NOT NULL,
+    queued_at   REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS session (
+    key         TEXT PRIMARY KEY,
+    value       TEXT NOT NULL
+);
+"""
+
+
+class PrintSpool:
+    """Persistent job ledger + status outbox"""
+
+    def __init__(self, path: Path, keep_days: int = 7):
+        self.path = Path(path)
+        self.keep_days = keep_days
+        # Guards the write queue and the known ids; never held across I/O
+        self._lock = threading.Lock()
+        # Guards the connection, held through a COMMIT
+        self._db_lock = threading.Lock()
+        self._queued: list[tuple[str, tuple]] = []
+        # Writes applied to the open transaction but not committed yet
+        self._uncommitted = False
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode; we manage BEGIN/COMMIT ourselves for group commit.
+        # The connection is shared between the event loop and flush threads.
+        self._db = sqlite3.connect(
+            str(self.path), isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # FULL: every COMMIT fsyncs the WAL, so a flushed transition survives
+        # power loss. Batching is what keeps the fsync count low.
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(SCHEMA)
+        self._known: set[str] = {
+            row[0] for row in self._db.execute("SELECT message_id FROM jobs")
+        }
+        with self._db_lock:
+            self._prune()
+        self.cursor: Optional[dict] = self._load_cursor()
+
+    # ─────────────────────────────────────────────────────────────────
+    # GROUP COMMIT
+    # ─────────────────────────────────────────────────────────────────
+
+    def _write(self, sql: str, params: tuple = ()):
+        """Queue a write for the next flush()"""
+        with self._lock:
+            self._queued.append((sql, params))
+
+    def _apply_queued(self):
+        """Run the queued writes in the open transaction; caller holds _db_lock"""
+        with self._lock:
+            queued, self._queued = self._queued, []
+            if not queued:
+                return
+            self._uncommitted = True
+        if not self._db.in_transaction:
+            self._db.execute("BEGIN")
+        for sql, params in queued:
+            self._db.execute(sql, params)
+
+    def _read(self, sql: str, params: tuple = ()) -> list:
+        """Rows of a query that sees every write made so far"""
+        with self._db_lock:
+            self._apply_queued()
+            return self._db.execute(sql, params).fetchall()
+
+    @property
+    def dirty(self) -> bool:
+        # Not _db_lock: the event loop asks, and must not wait out a COMMIT
+        with self._lock:
+            return bool(self._queued) or self._uncommitted
+
+    def flush(self):
+        """Commit all queued transitions (one fsync)"""
+        with self._db_lock:
+            self._apply_queued()
+            if self._db.in_transaction:
+                self._db.execute("COMMIT")
+            with self._lock:
+                self._uncommitted = False
+            if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+                self._prune()
+
+    def close(self):
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    # ─────────────────────────────────────────────────────────────────
+    # JOB LEDGER
+    # ─────────────────────────────────────────────────────────────────
+
+    def record_received(self, message_id: str, job: dict, body=None) -> bool:
+        """
+        Store a newly received job. `body` is the raw payload of a binary frame.
+        Returns False if the message_id is already known (duplicate delivery).
+        """
+        now = time.time()
+        with self._lock:
+            if message_id in self._known:
+                return False
+            self._known.add(message_id)
+            self._queued.append((
+                "INSERT OR IGNORE INTO jobs "
+                "(message_id, state, payload, body, received_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (message_id, RECEIVED, json.dumps(job), body, now, now),
+            ))
+        return True
+
+    def reset(self, message_id: str, job: dict, body=None):
+        """Put a finished job back to received (cloud asked for a retry)"""
+        self._write(
+            "UPDATE jobs SET state = ?, payload = ?, body = ?, error = NULL, updated_at = ? "
+            "WHERE message_id = ?",
+            (RECEIVED, json.dumps(job), body, time.time(), message_id),
+        )
+
+    def mark_printing(self, message_id: str):
+        self._set_state(message_id, PRINTING)
+
+    def mark_printed(self, message_id: str):
+        # Payload is no longer needed once paper is out; keep the row for dedupe
+        self._write(
+            "UPDATE jobs SET state = ?, payload = NULL, body = NULL, error = NULL, updated_at = ? "
+            "WHERE message_id = ?",
+            (PRINTED, time.time(), message_id),
+        )
+
+    def mark_failed(self, message_id: str, error: Optional[str] = None):
+        self._write(
+            "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE message_id = ?",
+            (FAILED, error, time.time(), message_id),
+        )
+
+    def _set_state(self, message_id: str, state: str):
+        self._write(
+            "UPDATE jobs SET state = ?, updated_at = ? WHERE message_id = ?",
+            (state, time.time(), message_id),
+        )
+
+    def get_state(self, message_id: str) -> Optional[str]:
+        rows = self._read("SELECT state FROM jobs WHERE message_id = ?", (message_id,))
+        return rows[0][0] if rows else None
+
+    def get_job(self, message_id: str) -> Optional[tuple[dict, Optional[bytes]]]:
+        """(job, body) of a job still waiting to print, else None"""
+        rows = self._read(
+            "SELECT payload, body FROM jobs WHERE message_id = ? AND state = ? "
+            "AND payload IS NOT NULL",
+            (message_id, RECEIVED),
+        )
+        if not rows:
+            return None
+        payload, body = rows[0]
+        try:
+            return json.loads(payload), body
+        except json.JSONDecodeError:
+            logger.error(f"Corrupt spool entry for {message_id}, dropping")
+            self.mark_failed(message_id, "corrupt spool entry")
+            return None
+
+    def pending_jobs(self) -> list[tuple[str, dict, Optional[bytes]]]:
+        """
+        Jobs that were received but never finished printing, oldest first,
+        as (message_id, job, body)
+        """
+        rows = self._read(
+            "SELECT message_id, payload, body FROM jobs "
+            "WHERE state IN (?, ?) AND payload IS NOT NULL "
+            "ORDER BY received_at",
+            PENDING_STATES,
+        )
+
+        jobs = []
+        for message_id, payload, body in rows:
+            try:
+                jobs.append((message_id, json.loads(payload), body))
+            except json.JSONDecodeError:
+                logger.error(f"Corrupt spool entry for {message_id}, dropping")
+                self.mark_failed(message_id, "corrupt spool entry")
+        return jobs
+
+    # ─────────────────────────────────────────────────────────────────
+    # STATUS OUTBOX
+    # ─────────────────────────────────────────────────────────────────
+
+    def queue_report(self, frame: dict):
+        """Keep a status frame that couldn't be sent, for delivery on reconnect"""
+        self._write(
+            "INSERT INTO outbox (message_id, frame, queued_at) VALUES (?, ?, ?)",
+            (frame.get("message_id") or "", json.dumps(frame), time.time()),
+        )
+
+    def pending_reports(self) -> list[tuple[int, dict]]:
+        rows = self._read("SELECT id, frame FROM outbox ORDER BY id")
+        return [(row_id, json.loads(frame)) for row_id, frame in rows]
+
+    def ack_report(self, row_id: int):
+        self._write("DELETE FROM outbox WHERE id = ?", (row_id,))
+
+    # ─────────────────────────────────────────────────────────────────
+    # SESSION CURSOR
+    # ─────────────────────────────────────────────────────────────────
+
+    def advance_cursor(self, message_id: str, created_at: str):
+        """
+        Remember the newest job printed so far ({message_id, created_at},
+        created_at as the cloud sent it). Older jobs printed late, such as
+        replays, leave it where it is.
+        """
+        if self.cursor and created_at < self.cursor["created_at"]:
+            return
+        self.cursor = {"message_id": message_id, "created_at": created_at}
+        self._write(
+            "INSERT OR REPLACE INTO session (key, value) VALUES ('cursor', ?)",
+            (json.dumps(self.cursor),),
+        )
+
+    def _load_cursor(self) -> Optional[dict]:
+        rows = self._read("SELECT value FROM session WHERE key = 'cursor'")
+        try:
+            return json.loads(rows[0][0]) if rows else None
+        except json.JSONDecodeError:
+            logger.error("Corrupt session cursor, starting without one")
+            return None
+
+    # ─────────────────────────────────────────────────────────────────
+    # MAINTENANCE
+    # ─────────────────────────────────────────────────────────────────
+
+    def _prune(self):
+        """Forget finished jobs older than keep_days; caller holds _db_lock"""
+        self._pruned_at = time.monotonic()
+        params = (PRINTED, FAILED, time.time() - self.keep_days * 86400)
+        old = [row[0] for row in self._db.execute(
+            "SELECT message_id FROM jobs WHERE state IN (?, ?) AND updated_at < ?", params
+        )]
+        if not old:
+            return
+        self._db.execute(
+            "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?", params
+        )
+        with self._lock:
+            self._known.difference_update(old)
+        logger.info(f"Pruned {len(old)} finished job(s) from the spool")
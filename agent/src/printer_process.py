@@ -0,0 +1,422 @@
+"""
+Split-process printer.
+
+Optional alternative to running the PrinterWorker threads inside the
+agent (PAPERDROP_PRINTER_PROCESS=1). A separate process owns the USB
+device, the PrintHandler and its render pipeline, so decoding and
+dithering never compete with `listen_for_messages` for the GIL, and a
+crash on the printer side (segfault in a native lib, OOM kill) costs the
+jobs in flight, not the cloud connection.
+
+    agent process                               printer process
+    PrinterProcess.submit() --descriptor-->     PrinterWorker.submit()
+       payload bytes  ==> shared memory ring ==>  memoryview, no copy
+    on_change / job futures <--status/done--    PrinterStatusMonitor
+
+Job payloads (image bytes, pre-dithered rasters) are copied once, from
+the received frame into the ring; the printer process hands a memoryview
+of its slot straight to the handler. Descriptors and everything flowing
+back (readiness, printer state, job results) go over a Pipe. Slots are
+released when the job's result comes back; the agent process is the
+only allocator, so the ring needs no cross-process locking.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import signal
+import threading
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, NamedTuple, Optional
+
+from printer_status import PrinterState
+from printer_worker import PrintJob
+
+logger = logging.getLogger('paperdrop.printer_process')
+
+# Seconds to wait before restarting a crashed printer process
+RESTART_DELAY = 2.0
+
+_ALIGN = 8
+
+
+class PrinterProcessDied(RuntimeError):
+    """The printer process exited while the job was in flight"""
+
+
+class _RingSlice(NamedTuple):
+    """Stands in for a payload argument in a job descriptor"""
+    offset: int
+    length: int
+
+
+class RingAllocator:
+    """
+    FIFO space allocator for the shared ring. Slots are handed out in
+    submission order and freed (possibly out of order) when their job
+    finishes; space is reclaimed from the oldest live slot.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._live: "collections.OrderedDict[int, list]" = collections.OrderedDict()
+
+    @property
+    def used(self) -> int:
+        return sum(length for _, length, _ in self._live.values())
+
+    def alloc(self, owner: int, length: int) -> Optional[int]:
+        """Offset of a free slot of `length` bytes, or None if it doesn't fit right now"""
+        length = -(-length // _ALIGN) * _ALIGN
+        if not self._live:
+            start = 0 if length <= self.size else None
+        else:
+            first = next(iter(self._live.values()))
+            last = next(reversed(self._live.values()))
+            tail, head = first[0], last[0] + last[1]
+            if head > tail:
+                # Live data is contiguous: room after it, or wrap to the front
+                if head + length <= self.size:
+                    start = head
+                elif length <= tail:
+                    start = 0
+                else:
+                    start = None
+            else:
+                # Already wrapped: only the gap up to the oldest slot is free
+                start = head if head + length <= tail else None
+
+        if start is not None:
+            self._live[owner] = [start, length, False]
+        return start
+
+    def release(self, owner: int):
+        slot = self._live.get(owner)
+        if slot is None:
+            return
+        slot[2] = True
+        while self._live and next(iter(self._live.values()))[2]:
+            self._live.popitem(last=False)
+
+    def clear(self):
+        self._live.clear()
+
+
+class _StatusMirror:
+    """The printer process's PrinterStatusMonitor, as seen from the agent"""
+
+    def __init__(self):
+        self.state = PrinterState()
+
+
+# ─────────────────────────────────────────────────────────────────────
+# AGENT SIDE
+# ─────────────────────────────────────────────────────────────────────
+
+class PrinterProcess:
+    """
+    Drop-in for PrinterWorker that runs the printer in a child process.
+
+    Same interface for the agent: start(), await stop(), submit()
+    returning an awaitable PrintJob, ready/wait_ready(), stats(). The
+    printer state is mirrored on `monitor.state` and changes are passed
+    to `on_change`, like PrinterStatusMonitor does.
+    """
+
+    def __init__(self, ring_size: int, poll_interval: float = 5.0,
+                 on_change: Optional[Callable[[PrinterState], None]] = None):
+        self.ring_size = ring_size
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self.monitor = _StatusMirror()
+        self.ready: concurrent.futures.Future = concurrent.futures.Future()
+        self.restarts = 0
+        self._ids = itertools.count(1)
+        self._ring: Optional[SharedMemory] = None
+        self._alloc = RingAllocator(ring_size)
+        self._process = None
+        self._conn = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._jobs: dict[int, PrintJob] = {}
+        # job_id -> Pipe end it was sent on, to know what a dead process took with it
+        self._links: dict = {}
+        self._remote_stats: dict = {}
+        self._stopping = False
+
+    # ─────────────────────────────────────────────────────────────────
+    # LIFECYCLE
+    # ─────────────────────────────────────────────────────────────────
+
+    def start(self):
+        """Start the printer process (idempotent). Call from the event loop."""
+        if self._process and self._process.is_alive():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        if self._ring is None:
+            self._ring = SharedMemory(create=True, size=self.ring_size)
+        self._spawn()
+
+    def _spawn(self):
+        ctx = multiprocessing.get_context("forkserver")
+        parent_conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(
+            target=printer_process_main,
+            args=(child_conn, self._ring.name, self.poll_interval),
+            name="paperdrop-printer", daemon=True,
+        )
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        threading.Thread(
+            target=self._read_loop, args=(parent_conn,),
+            name="paperdrop-printer-link", daemon=True,
+        ).start()
+        logger.info(f"Printer process started (pid {self._process.pid})")
+
+    async def stop(self, timeout: float = 10.0):
+        """Let the printer process finish queued jobs, then stop it"""
+        if not self._process:
+            return
+        self._stopping = True
+        process, self._process = self._process, None
+        if self._conn:
+            try:
+                self._conn.send(("stop",))
+            except (OSError, ValueError):
+                pass
+        await asyncio.get_running_loop().run_in_executor(None, process.join, timeout)
+        if process.is_alive():
+            logger.warning("Printer process didn't stop in time, terminating it")
+            process.terminate()
+        self._ring.close()
+        self._ring.unlink()
+        self._ring = None
+        logger.info("Printer process stopped")
+
+    async def wait_ready(self) -> float:
+        return await asyncio.wrap_future(self.ready)
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._process and self._process.is_alive())
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._jobs)
+
+    def stats(self) -> dict:
+        """The printer process's pipeline stats, plus the process and ring"""
+        return {
+            **self._remote_stats,
+            "process": {
+                "pid": self._process.pid if self._process else None,
+                "restarts": self.restarts,
+                "in_flight": len(self._jobs),
+                "ring_used": self._alloc.used,
+                "ring_size": self.ring_size,
+            },
+        }
+
+    # ─────────────────────────────────────────────────────────────────
+    # SUBMISSION
+    # ─────────────────────────────────────────────────────────────────
+
+    def submit(self, method: str, *args, **kwargs) -> PrintJob:
+        """Queue `handler.<method>(*args, **kwargs)` in the printer process"""
+        loop = asyncio.get_running_loop()
+        job = PrintJob(next(self._ids), method, args, kwargs, loop.create_future())
+        self._jobs[job.job_id] = job
+        # Also brings a crashed process back early if a job is waiting
+        self.start()
+        self._send_job(job)
+        return job
+
+    def _send_job(self, job: PrintJob):
+        args = tuple(self._to_ring(job.job_id, a) for a in job.args)
+        self._links[job.job_id] = self._conn
+        try:
+            self._conn.send(("job", job.job_id, job.method, args, job.kwargs))
+        except (OSError, ValueError) as e:
+            # Process just died; the reader thread fails the job
+            logger.error(f"Couldn't hand {job} to the printer process: {e}")
+
+    def _to_ring(self, job_id: int, arg):
+        if not isinstance(arg, (bytes, bytearray, memoryview)) or not len(arg):
+            return arg
+        view = memoryview(arg).cast("B")
+        offset = self._alloc.alloc(job_id, len(view))
+        if offset is None:
+            # Bigger than the free space right now: pickle it through the pipe
+            logger.debug(f"Ring full, sending {len(view)} bytes of job #{job_id} through the pipe")
+            return arg
+        self._ring.buf[offset:offset + len(view)] = view
+        return _RingSlice(offset, len(view))
+
+    # ─────────────────────────────────────────────────────────────────
+    # FROM THE PRINTER PROCESS
+    # ─────────────────────────────────────────────────────────────────
+
+    def _read_loop(self, conn):
+        """Link thread: forward everything the printer process says to the loop"""
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            self._call_soon(self._on_message, msg)
+        conn.close()
+        self._call_soon(self._on_exit, conn)
+
+    def _call_soon(self, callback, *args):
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass  # Loop closed during shutdown
+
+    def _on_message(self, msg):
+        kind = msg[0]
+        if kind == "done":
+            _, job_id, result, error, stats = msg
+            self._remote_stats = stats
+            self._alloc.release(job_id)
+            self._links.pop(job_id, None)
+            job = self._jobs.pop(job_id, None)
+            if job and not job.future.done():
+                if error is not None:
+                    job.future.set_exception(error)
+                else:
+                    job.future.set_result(result)
+        elif kind == "status":
+            self._set_state(msg[1])
+        elif kind == "ready":
+            _, elapsed, error = msg
+            if not self.ready.done():
+                if error is not None:
+                    self.ready.set_exception(error)
+                else:
+                    self.ready.set_result(elapsed)
+
+    def _on_exit(self, conn):
+        # Whatever was sent is lost with the process: it may or may not
+        # have reached the paper, so report it failed rather than guess
+        for job_id, link in list(self._links.items()):
+            if link is not conn:
+                continue
+            del self._links[job_id]
+            self._alloc.release(job_id)
+            job = self._jobs.pop(job_id, None)
+            if job and not job.future.done():
+                job.future.set_exception(PrinterProcessDied(f"Printer process exited during {job}"))
+
+        if conn is not self._conn:
+            return  # A new process was already started by submit()
+        self._conn = None
+        self._set_state(PrinterState(connected=False, error="printer process restarting"))
+
+        if self._stopping:
+            return
+        self.restarts += 1
+        logger.error(f"Printer process exited unexpectedly, restarting in {RESTART_DELAY:.0f}s")
+        self._loop.call_later(RESTART_DELAY, self._restart)
+
+    def _restart(self):
+        if self._stopping or self.is_running:
+            return
+        self._spawn()
+
+    def _set_state(self, state: PrinterState):
+        if state == self.monitor.state:
+            return
+        self.monitor.state = state
+        if self.on_change:
+            try:
+                self.on_change(state)
+            except Exception as e:
+                logger.error(f"Printer state callback failed: {e}")
+
+
+# ─────────────────────────────────────────────────────────────────────
+# PRINTER SIDE
+# ─────────────────────────────────────────────────────────────────────
+
+def printer_process_main(conn, ring_name: str, poll_interval: float):
+    """Entry point of the printer process"""
+    # Ctrl-C reaches the whole process group; the agent decides when we stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(_serve(conn, ring_name, poll_interval))
+
+
+async def _serve(conn, ring_name: str, poll_interval: float):
+    from print_handler import print_handler
+    from printer_status import PrinterStatusMonitor
+    from printer_worker import PrinterWorker
+
+    ring = SharedMemory(ring_name)
+    send_lock = threading.Lock()
+
+    def send(msg):
+        with send_lock:
+            try:
+                conn.send(msg)
+            except (OSError, ValueError):
+                pass  # Agent is gone; we're about to see EOF
+            except Exception:
+                if msg[0] != "done":
+                    raise
+                # Unpicklable result/exception: send what we can
+                _, job_id, _, error, stats = msg
+                error = RuntimeError(str(error)) if error is not None else None
+                conn.send(("done", job_id, None, error, stats))
+
+    monitor = PrinterStatusMonitor(print_handler, on_change=lambda s: send(("status", s)))
+    worker = PrinterWorker(print_handler, monitor=monitor, poll_interval=poll_interval)
+    worker.ready.add_done_callback(
+        lambda f: send(("ready", None if f.exception() else f.result(), f.exception()))
+    )
+    worker.start()
+
+    loop = asyncio.get_running_loop()
+    pending: set[asyncio.Task] = set()
+
+    async def finish(job_id: int, job: PrintJob):
+        try:
+            result, error = await job, None
+        except Exception as e:
+            result, error = None, e
+        send(("done", job_id, result, error, worker.stats()))
+
+    while True:
+        try:
+            msg = await loop.run_in_executor(None, conn.recv)
+        except (EOFError, OSError):
+            logger.warning("Agent went away, finishing queued jobs")
+            break
+        if msg[0] == "stop":
+            break
+
+        _, job_id, method, args, kwargs = msg
+        args = tuple(
+            ring.buf[a.offset:a.offset + a.length] if isinstance(a, _RingSlice) else a
+            for a in args
+        )
+        try:
+            job = worker.submit(method, *args, **kwargs)
+        except AttributeError as e:
+            send(("done", job_id, None, e, worker.stats()))
+            continue
+        task = loop.create_task(finish(job_id, job))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    await worker.stop()
+    if pending:
+        await asyncio.gather(*pending)
+    print_handler.close()
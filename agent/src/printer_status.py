@@ -0,0 +1,161 @@
+"""
+Printer status monitoring via ESC/POS real-time status (DLE EOT).
+
+The monitor keeps a cached PrinterState that the printer worker consults
+before dispatching a job, so jobs are held while the paper is out or the
+cover is open instead of being "printed" into the void. State changes
+are pushed to a callback (the agent forwards them to the cloud).
+
+All queries touch the USB handle, so `poll()` must only be called from
+the printer worker thread.
+"""
+
+import logging
+import threading
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+logger = logging.getLogger('paperdrop.status')
+
+# DLE EOT n
+DLE_EOT = b"\x10\x04"
+STATUS_PRINTER = 1
+STATUS_OFFLINE_CAUSE = 2
+STATUS_ERROR_CAUSE = 3
+STATUS_PAPER_SENSOR = 4
+
+# Response bits (TM-T20III / ESC/POS spec)
+_OFFLINE = 0x08             # n=1: printer is offline
+_COVER_OPEN = 0x04          # n=2
+_STOPPED_PAPER_END = 0x20   # n=2
+_ERROR = 0x40               # n=2
+_AUTOCUTTER_ERROR = 0x08    # n=3
+_UNRECOVERABLE_ERROR = 0x20  # n=3
+_PAPER_NEAR_END = 0x0C      # n=4
+_PAPER_END = 0x60           # n=4
+
+# Fixed bits in every real-time status byte: bit 1 and 4 set, bit 7 clear
+_FIXED_MASK = 0x93
+_FIXED_BITS = 0x12
+
+
+class PrinterNotReady(RuntimeError):
+    """The printer can't take a job right now (paper out, cover open, ...)"""
+
+
+@dataclass(frozen=True)
+class PrinterState:
+    connected: bool = False
+    online: bool = False
+    paper_out: bool = False
+    paper_low: bool = False
+    cover_open: bool = False
+    error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return (self.connected and self.online and not self.paper_out
+                and not self.cover_open and not self.error)
+
+    def describe(self) -> str:
+        if not self.connected:
+            return "printer disconnected"
+        if self.cover_open:
+            return "cover open"
+        if self.paper_out:
+            return "paper out"
+        if self.error:
+            return self.error
+        if not self.online:
+            return "printer offline"
+        return "ready"
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["ready"] = self.ready
+        return data
+
+
+class PrinterStatusMonitor:
+    """Polls DLE EOT status from the handler's printer and caches the result"""
+
+    def __init__(self, handler, on_change: Optional[Callable[[PrinterState], None]] = None):
+        self.handler = handler
+        self.on_change = on_change
+        self._state = PrinterState()
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> PrinterState:
+        with self._lock:
+            return self._state
+
+    def poll(self) -> PrinterState:
+        """Query the printer now and update the cached state"""
+        state = self._query(self.handler.p)
+        with self._lock:
+            changed = state != self._state
+            self._state = state
+
+        if changed:
+            logger.info(f"Printer state: {state.describe()}")
+            if self.on_change:
+                try:
+                    self.on_change(state)
+                except Exception as e:
+                    logger.error(f"Printer state callback failed: {e}")
+        return state
+
+    def _query(self, printer) -> PrinterState:
+        if printer is None:
+            return PrinterState(connected=False)
+
+        if not (hasattr(printer, "_raw") and hasattr(printer, "_read")):
+            # MockPrinter / write-only transports: assume it's fine
+            return PrinterState(connected=True, online=True)
+
+        try:
+            status = self._read_status(printer, STATUS_PRINTER)
+            if status is None:
+                return PrinterState(connected=True, error="no status response")
+
+            offline = self._read_status(printer, STATUS_OFFLINE_CAUSE) or 0
+            paper = self._read_status(printer, STATUS_PAPER_SENSOR) or 0
+
+            error = None
+            if offline & _ERROR:
+                cause = self._read_status(printer, STATUS_ERROR_CAUSE) or 0
+                if cause & _AUTOCUTTER_ERROR:
+                    error = "autocutter error"
+                elif cause & _UNRECOVERABLE_ERROR:
+                    error = "unrecoverable printer error"
+                else:
+                    error = "printer error"
+
+            return PrinterState(
+                connected=True,
+                online=not (status & _OFFLINE),
+                paper_out=bool(paper & _PAPER_END or offline & _STOPPED_PAPER_END),
+                paper_low=bool(paper & _PAPER_NEAR_END),
+                cover_open=bool(offline & _COVER_OPEN),
+                error=error,
+            )
+        except Exception as e:
+            logger.warning(f"Printer status query failed: {e}")
+            # Most likely a stale handle after unplug/USB reset: drop it so
+            # the connection manager reopens it once the printer is back
+            if hasattr(self.handler, "reset_connection"):
+                self.handler.reset_connection(str(e))
+            return PrinterState(connected=False, error=str(e))
+
+    @staticmethod
+    def _read_status(printer, n: int) -> Optional[int]:
+        """Send DLE EOT n and return the status byte (None if no valid reply)"""
+        printer._raw(DLE_EOT + bytes((n,)))
+        reply = printer._read()
+        if not reply:
+            return None
+        value = reply[-1]
+        if value & _FIXED_MASK != _FIXED_BITS:
+            return None
+        return value
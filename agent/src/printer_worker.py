@@ -0,0 +1,370 @@
+"""
+Printer worker subsystem.
+
+Owns the PrintHandler on dedicated threads so decoding, resizing,
+rasterization and USB writes never run on the agent's asyncio loop.
+The websocket keeps answering pings while paper is moving.
+
+Jobs go through a two-stage pipeline:
+
+    submit() -> [render queue] -> render thread -> [print queue] -> printer thread
+
+A handler method `foo` can have a `prepare_foo(*args, **kwargs)`
+companion: the render thread calls it and the job's first argument is
+replaced by its result before the printer thread runs `foo`. If the
+result has a `render()` method the render thread calls it after handing
+the job on, so job N+1 is decoded and dithered while job N is still on
+its way to the printer. Jobs without a prepare step pass straight
+through; order is kept across both stages.
+"""
+
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import queue
+import threading
+import time
+from typing import Any, Optional
+
+from printer_status import PrinterNotReady, PrinterStatusMonitor
+
+logger = logging.getLogger('paperdrop.worker')
+
+_STOP = object()
+
+
+class PrintJob:
+    """
+    Awaitable handle for a job submitted to the PrinterWorker.
+
+    `await job` returns the handler's return value or raises its exception.
+    """
+
+    def __init__(self, job_id: int, method: str, args: tuple, kwargs: dict,
+                 future: asyncio.Future):
+        self.job_id = job_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.submitted_at = time.monotonic()
+        self.render_started_at: Optional[float] = None
+        self.render_finished_at: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def __await__(self):
+        return self.future.__await__()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    @property
+    def render_time(self) -> Optional[float]:
+        """Seconds the render stage spent preparing the job"""
+        if self.render_started_at is None or self.render_finished_at is None:
+            return None
+        return self.render_finished_at - self.render_started_at
+
+    @property
+    def wait_time(self) -> Optional[float]:
+        """Seconds from submission until the printer thread picked the job up"""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+    @property
+    def run_time(self) -> Optional[float]:
+        """Seconds the worker spent executing the job"""
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def __repr__(self):
+        return f"<PrintJob #{self.job_id} {self.method}>"
+
+
+class StageStats:
+    """Counters for one pipeline stage, to see which one is the bottleneck"""
+
+    def __init__(self, name: str, queue_: "queue.Queue"):
+        self.name = name
+        self._queue = queue_
+        self.jobs = 0
+        self.busy_seconds = 0.0
+        self._busy_since: Optional[float] = None
+
+    def begin(self):
+        self._busy_since = time.monotonic()
+
+    def end(self):
+        if self._busy_since is not None:
+            self.busy_seconds += time.monotonic() - self._busy_since
+            self.jobs += 1
+            self._busy_since = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def to_dict(self) -> dict:
+        return {
+            "queued": self.depth,
+            "busy": self._busy_since is not None,
+            "jobs": self.jobs,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+
+class PrinterWorker:
+    """
+    Runs PrintHandler calls one at a time on the printer thread, with
+    their prepare step pipelined on a render thread.
+
+    Usage (from the event loop):
+        job = worker.submit("print_image", data)
+        await job
+    """
+
+    def __init__(self, handler, monitor: Optional[PrinterStatusMonitor] = None,
+                 poll_interval: float = 5.0):
+        self.handler = handler
+        # With a monitor, the worker polls printer status while idle and
+        # holds jobs until the printer is ready
+        self.monitor = monitor
+        self.poll_interval = poll_interval
+        self._render_queue: "queue.Queue" = queue.Queue()
+        self._queue: "queue.Queue" = queue.Queue()
+        self.render_stats = StageStats("render", self._render_queue)
+        self.print_stats = StageStats("print", self._queue)
+        self._render_thread: Optional[threading.Thread] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._ids = itertools.count(1)
+        self.current_job: Optional[PrintJob] = None
+        # Resolved with the warm-up duration (seconds) once the handler is ready
+        self.ready: concurrent.futures.Future = concurrent.futures.Future()
+
+    # ─────────────────────────────────────────────────────────────────
+    # LIFECYCLE
+    # ─────────────────────────────────────────────────────────────────
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="paperdrop-printer", daemon=True
+        )
+        self._render_thread = threading.Thread(
+            target=self._run_render, name="paperdrop-render", daemon=True
+        )
+        self._thread.start()
+        self._render_thread.start()
+        logger.info("Printer worker started")
+
+    async def stop(self, timeout: float = 10.0):
+        """Finish already queued jobs, then stop the worker threads"""
+        if not self._thread:
+            return
+        self._stopping.set()
+        # Flows through the render stage, so everything ahead of it prints
+        self._render_queue.put(_STOP)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._thread.join, timeout
+        )
+        self._thread = None
+        self._render_thread = None
+        logger.info("Printer worker stopped")
+
+    async def wait_ready(self) -> float:
+        """Wait until the handler has warmed up; returns the warm-up time"""
+        return await asyncio.wrap_future(self.ready)
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs waiting in either stage"""
+        return self._render_queue.qsize() + self._queue.qsize()
+
+    def stats(self) -> dict:
+        """Per-stage queue depth and busy time, plus whatever the handler reports"""
+        stats = {"render": self.render_stats.to_dict(), "print": self.print_stats.to_dict()}
+        handler_stats = getattr(self.handler, "stats", None)
+        if handler_stats:
+            stats.update(handler_stats())
+        return stats
+
+    # ─────────────────────────────────────────────────────────────────
+    # SUBMISSION
+    # ─────────────────────────────────────────────────────────────────
+
+    def submit(self, method: str, *args, **kwargs) -> PrintJob:
+        """
+        Queue `handler.<method>(*args, **kwargs)` on the printer thread.
+        Must be called from the event loop thread.
+        """
+        if not hasattr(self.handler, method):
+            raise AttributeError(f"PrintHandler has no method '{method}'")
+
+        loop = asyncio.get_running_loop()
+        job = PrintJob(next(self._ids), method, args, kwargs, loop.create_future())
+        self._render_queue.put((loop, job))
+        self.start()
+        return job
+
+    # ─────────────────────────────────────────────────────────────────
+    # WORKER THREAD
+    # ─────────────────────────────────────────────────────────────────
+
+    def _warm_up(self):
+        """Initialize the handler before taking any job off the queue"""
+        if self.ready.done():
+            return
+        try:
+            warm_up = getattr(self.handler, "warm_up", None)
+            elapsed = warm_up() if warm_up else 0.0
+        except Exception as e:
+            # The render thread fails every job from now on
+            logger.error(f"Printer warm-up failed: {e}")
+            self.ready.set_exception(e)
+        else:
+            self.ready.set_result(elapsed)
+
+    def _run_render(self):
+        """Stage one: run prepare steps, then hand jobs to the printer thread"""
+        # The handler's caches are set up by warm-up on the printer thread
+        concurrent.futures.wait([self.ready])
+        warm_up_error = self.ready.exception()
+
+        while True:
+            item = self._render_queue.get()
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+
+            loop, job = item
+            if warm_up_error is not None:
+                # No caches, encoders or printer: fail the job outright
+                # instead of letting it break halfway through
+                self._resolve(loop, job, exception=PrinterNotReady(
+                    f"Printer warm-up failed: {warm_up_error}"
+                ))
+                continue
+
+            prepare = getattr(self.handler, f"prepare_{job.method}", None)
+            if prepare is None or job.future.cancelled():
+                self._queue.put(item)
+                continue
+
+            self.render_stats.begin()
+            job.render_started_at = time.monotonic()
+            try:
+                prepared = prepare(*job.args, **job.kwargs)
+            except Exception as e:
+                job.render_finished_at = time.monotonic()
+                self.render_stats.end()
+                logger.error(f"{job} failed to prepare: {e}")
+                self._resolve(loop, job, exception=e)
+                continue
+
+            job.args = (prepared,) + job.args[1:]
+            self._queue.put(item)
+            # Printer thread may already be consuming the first bands
+            render = getattr(prepared, "render", None)
+            if render:
+                render()
+            job.render_finished_at = time.monotonic()
+            self.render_stats.end()
+
+    def _run(self):
+        # Jobs queued meanwhile wait behind this on the same thread
+        self._warm_up()
+        if self.monitor:
+            self.monitor.poll()
+
+        while True:
+            try:
+                item = self._queue.get(timeout=self.poll_interval if self.monitor else None)
+            except queue.Empty:
+                # Idle: keep the cached printer state fresh
+                self.monitor.poll()
+                continue
+            if item is _STOP:
+                break
+
+            loop, job = item
+            if job.future.cancelled():
+                continue
+
+            self.current_job = job
+            try:
+                self._wait_until_ready(job)
+                job.started_at = time.monotonic()
+                self.print_stats.begin()
+                result = getattr(self.handler, job.method)(*job.args, **job.kwargs)
+                self._check_after(job)
+            except BaseException as e:
+                if job.started_at is None:
+                    job.started_at = time.monotonic()
+                job.finished_at = time.monotonic()
+                self.print_stats.end()
+                logger.error(f"{job} failed: {e}")
+                self._resolve(loop, job, exception=e)
+            else:
+                job.finished_at = time.monotonic()
+                self.print_stats.end()
+                logger.debug(
+                    f"{job} done (waited {job.wait_time:.3f}s, ran {job.run_time:.3f}s; "
+                    f"queued render={self.render_stats.depth} print={self.print_stats.depth})"
+                )
+                self._resolve(loop, job, result=result)
+            finally:
+                self.current_job = None
+
+    def _wait_until_ready(self, job: PrintJob):
+        """Hold the job while the printer reports it can't print"""
+        if not self.monitor:
+            return
+        state = self.monitor.state
+        if state.ready:
+            return
+
+        logger.warning(f"Holding {job}: {state.describe()}")
+        while not state.ready:
+            if self._stopping.wait(self.poll_interval):
+                raise PrinterNotReady(f"Shutting down while {state.describe()}")
+            if job.future.cancelled():
+                raise PrinterNotReady("Job cancelled while held")
+            state = self.monitor.poll()
+        logger.info(f"Printer ready again, releasing {job}")
+
+    def _check_after(self, job: PrintJob):
+        """Re-check status so a job that ran into paper-out isn't reported as printed"""
+        if not self.monitor:
+            return
+        state = self.monitor.poll()
+        if not state.ready:
+            raise PrinterNotReady(f"{state.describe()} during {job.method}")
+
+    @staticmethod
+    def _resolve(loop, job: PrintJob, result: Any = None,
+                 exception: Optional[BaseException] = None):
+        def _set():
+            if job.future.done():
+                return
+            if exception is not None:
+                job.future.set_exception(exception)
+            else:
+                job.future.set_result(result)
+
+        try:
+            loop.call_soon_threadsafe(_set)
+        except RuntimeError:
+            # Loop already closed (shutdown); nobody is waiting on the result
+            pass
@@ -0,0 +1,142 @@
+"""
+Content-addressed raster cache.
+
+Keeps the final packed 1bpp raster of recent image jobs under
+CONFIG_DIR, keyed by a hash of the source bytes plus the render
+settings. A repeat of the same image (re-sent sticker, retried job,
+"print again") skips decode/resize/dither entirely, and `reprint` jobs
+can print by message_id with no payload.
+
+Eviction is LRU by file mtime (touched on every hit), bounded by total
+size on disk.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Optional
+
+from raster_encoder import PackedRaster
+
+logger = logging.getLogger('paperdrop.cache')
+
+_MAGIC = b"PDR1"
+_HEADER = struct.Struct("<4sII")  # magic, width, height
+_SUFFIX = ".raster"
+
+# How many message_id -> key mappings to remember for reprints
+MAX_INDEX_ENTRIES = 500
+
+
+def cache_key(source: bytes, **settings) -> str:
+    """sha256 over the source bytes and the render settings that shaped the raster"""
+    h = hashlib.sha256()
+    h.update(json.dumps(settings, sort_keys=True).encode())
+    h.update(b"\0")
+    h.update(source)
+    return h.hexdigest()
+
+
+class RasterCache:
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.index_file = self.directory / "index.json"
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index: dict[str, str] = self._load_index()
+
+    # ─────────────────────────────────────────────────────────────────
+    # RASTERS
+    # ─────────────────────────────────────────────────────────────────
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}{_SUFFIX}"
+
+    def get(self, key: str) -> Optional[PackedRaster]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                magic, width, height = _HEADER.unpack(f.read(_HEADER.size))
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, struct.error) as e:
+            logger.warning(f"Unreadable cache entry {key[:12]}: {e}")
+            return None
+
+        raster = PackedRaster(width, height, data)
+        if magic != _MAGIC or len(data) != raster.row_bytes * height:
+            logger.warning(f"Corrupt cache entry {key[:12]}, discarding")
+            path.unlink(missing_ok=True)
+            return None
+
+        os.utime(path)  # LRU touch
+        return raster
+
+    def put(self, key: str, raster: PackedRaster):
+        size = _HEADER.size + len(raster.data)
+        if size > self.max_bytes:
+            return
+
+        path = self._path(key)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, raster.width, raster.height))
+            f.write(raster.data)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until we fit in max_bytes"""
+        with self._lock:
+            entries = []
+            total = 0
+            for path in self.directory.glob(f"*{_SUFFIX}"):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                logger.debug(f"Evicted {path.name} from raster cache")
+
+    # ─────────────────────────────────────────────────────────────────
+    # MESSAGE INDEX (for reprints)
+    # ─────────────────────────────────────────────────────────────────
+
+    def _load_index(self) -> dict:
+        try:
+            return json.loads(self.index_file.read_text())
+        except FileNotFoundError:
+            return {}
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Raster cache index unreadable, starting fresh: {e}")
+            return {}
+
+    def remember(self, message_id: str, key: str):
+        """Associate a message with its raster so it can be reprinted"""
+        with self._lock:
+            self._index.pop(message_id, None)
+            self._index[message_id] = key
+            while len(self._index) > MAX_INDEX_ENTRIES:
+                self._index.pop(next(iter(self._index)))
+
+            tmp = self.index_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self._index))
+            os.replace(tmp, self.index_file)
+
+    def get_for_message(self, message_id: str) -> Optional[PackedRaster]:
+        key = self._index.get(message_id)
+        return self.get(key) if key else None
@@ -0,0 +1,287 @@
+"""
+Native ESC/POS raster encoder.
+
+Frames packed 1bpp rows as `GS v 0` raster bit-image commands and
+writes them straight to the printer's bulk endpoint, skipping
+python-escpos' generic image pipeline (PIL conversions, column-format
+fallbacks, fragment splitting).
+
+Pure bytes work: no NumPy or PIL at import, so pre-rendered raster jobs
+and cache hits never load them.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Union
+
+logger = logging.getLogger('paperdrop.raster')
+
+
+@dataclass
+class PackedRaster:
+    """A 1bpp bitmap: `height` rows of `row_bytes` bytes, 1 = black dot"""
+    width: int
+    height: int
+    data: bytes
+
+    @property
+    def row_bytes(self) -> int:
+        return (self.width + 7) // 8
+
+    @classmethod
+    def concat(cls, bands: list["PackedRaster"]) -> "PackedRaster":
+        """Stack bands of equal width into one raster"""
+        width = bands[0].width if bands else 0
+        return cls(
+            width,
+            sum(b.height for b in bands),
+            b"".join(bytes(b.data) for b in bands),
+        )
+
+    def to_image(self):
+        """PIL '1' image of the raster (debug output / MockPrinter)"""
+        from PIL import Image
+        # PIL's '1' mode uses 1 = white, so decode with the inverted packer
+        return Image.frombytes(
+            "1", (self.width, self.height), bytes(self.data), "raw", "1;I"
+        )
+
+
+GS_V0 = b"\x1dv0"
+MODE_NORMAL = 0
+
+# TM-T20III accepts up to 2303 rows per GS v 0 command. Bands that are a
+# multiple of the 24-dot head pass and ~17KB at 576 dots keep the
+# printer's receive buffer streaming without stalls.
+DEFAULT_BAND_HEIGHT = 240
+MAX_BAND_HEIGHT = 2303
+
+# Blank (all-white) rows are fed with `ESC J n` instead of being sent as
+# 72 zero bytes each. Shorter blank runs stay in the raster: splitting a
+# GS v 0 block costs a header and the head may leave a faint seam.
+ESC_J = b"\x1bJ"
+MAX_FEED_DOTS = 255
+MIN_BLANK_RUN = 8
+# `GS P 0 203`: vertical motion unit = 1/203", one dot row at 203 dpi,
+# so ESC J n feeds exactly n raster rows
+SET_MOTION_UNIT = b"\x1dP\x00\xcb"
+
+# Compression of pre-rendered raster payloads from the cloud
+COMPRESSION_NONE = "none"
+COMPRESSION_RLE = "rle"  # PackBits (TIFF/Apple), per whole payload
+
+
+def unpack_bits(data, expected_len: int) -> bytes:
+    """
+    Decode PackBits RLE: a header byte n then
+      0..127   -> copy the next n+1 bytes literally
+      129..255 -> repeat the next byte 257-n times
+      128      -> no-op
+    """
+    src = memoryview(data)
+    out = bytearray()
+    i = 0
+    end = len(src)
+    while i < end and len(out) < expected_len:
+        n = src[i]
+        i += 1
+        if n < 128:
+            count = n + 1
+            if i + count > end:
+                raise ValueError("Truncated literal run in RLE raster")
+            out += src[i:i + count]
+            i += count
+        elif n > 128:
+            if i >= end:
+                raise ValueError("Truncated repeat run in RLE raster")
+            out += bytes((src[i],)) * (257 - n)
+            i += 1
+
+    if len(out) != expected_len:
+        raise ValueError(f"RLE raster decoded to {len(out)} bytes, expected {expected_len}")
+    return bytes(out)
+
+
+def decode_raster_payload(width: int, height: int, data,
+                          compression: str = COMPRESSION_NONE) -> PackedRaster:
+    """Validate a pre-dithered 1bpp payload from the cloud and wrap it"""
+    width, height = int(width), int(height)
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid raster size {width}x{height}")
+
+    expected = ((width + 7) // 8) * height
+    if compression == COMPRESSION_RLE:
+        data = unpack_bits(data, expected)
+    elif compression in (None, COMPRESSION_NONE):
+        if len(data) != expected:
+            raise ValueError(
+                f"Raster payload is {len(data)} bytes, expected {expected} for {width}x{height}"
+            )
+    else:
+        raise ValueError(f"Unknown raster compression '{compression}'")
+    return PackedRaster(width, height, data)
+
+
+def gs_v0_header(row_bytes: int, rows: int, mode: int = MODE_NORMAL) -> bytes:
+    """`GS v 0 m xL xH yL yH` for a band of `rows` rows"""
+    return GS_V0 + bytes((
+        mode,
+        row_bytes & 0xFF, (row_bytes >> 8) & 0xFF,
+        rows & 0xFF, (rows >> 8) & 0xFF,
+    ))
+
+
+def encode_raster(raster: PackedRaster,
+                  band_height: int = DEFAULT_BAND_HEIGHT) -> Iterator[bytes]:
+    """Yield one complete `GS v 0` command per band of the raster"""
+    if not 1 <= band_height <= MAX_BAND_HEIGHT:
+        raise ValueError(f"band_height must be 1..{MAX_BAND_HEIGHT}")
+
+    row_bytes = raster.row_bytes
+    expected = row_bytes * raster.height
+    if len(raster.data) != expected:
+        raise ValueError(
+            f"Raster data is {len(raster.data)} bytes, expected {expected} "
+            f"for {raster.width}x{raster.height}"
+        )
+
+    data = memoryview(raster.data)
+    for top in range(0, raster.height, band_height):
+        rows = min(band_height, raster.height - top)
+        start = top * row_bytes
+        yield gs_v0_header(row_bytes, rows) + data[start:start + rows * row_bytes]
+
+
+def feed_command(dots: int) -> bytes:
+    """`ESC J n` commands feeding `dots` rows of paper"""
+    out = bytearray()
+    while dots > 0:
+        n = min(dots, MAX_FEED_DOTS)
+        out += ESC_J + bytes((n,))
+        dots -= n
+    return bytes(out)
+
+
+def optimize_bands(bands: Iterable[PackedRaster], min_blank_run: int = MIN_BLANK_RUN,
+                   trim: bool = True) -> Iterator[Union[PackedRaster, int]]:
+    """
+    Split a stream of bands into inked PackedRaster stretches and blank
+    runs (yielded as ints: rows to feed). With `trim`, blank rows at the
+    top and bottom are dropped entirely. Still streams: nothing is held
+    back beyond the current band and a count of pending blank rows.
+    """
+    started = False
+    blank = 0  # blank rows since the last inked row, possibly across bands
+    for band in bands:
+        rb = band.row_bytes
+        zero = bytes(rb)
+        data = bytes(band.data)
+        parts = []
+        rows = 0
+        seg = None  # first row of the inked stretch being collected
+
+        for y in range(band.height):
+            if data[y * rb:(y + 1) * rb] == zero:
+                if seg is not None:
+                    parts.append(data[seg * rb:y * rb])
+                    rows += y - seg
+                    seg = None
+                blank += 1
+                continue
+
+            if blank:
+                if not started and trim:
+                    pass  # top margin
+                elif blank >= min_blank_run:
+                    if rows:
+                        yield PackedRaster(band.width, rows, b"".join(parts))
+                        parts, rows = [], 0
+                    yield blank
+                else:
+                    parts.append(zero * blank)
+                    rows += blank
+                blank = 0
+            started = True
+            if seg is None:
+                seg = y
+
+        if seg is not None:
+            parts.append(data[seg * rb:])
+            rows += band.height - seg
+        if rows:
+            yield PackedRaster(band.width, rows, b"".join(parts))
+
+    if blank and not trim:
+        yield blank
+
+
+def trim_raster(raster: PackedRaster) -> PackedRaster:
+    """`raster` without its blank top and bottom rows"""
+    pieces = optimize_bands([raster], min_blank_run=raster.height + 1)
+    return PackedRaster.concat(list(pieces)) if raster.height else raster
+
+
+def _write_optimized(printer, pieces: Iterable[Union[PackedRaster, int]],
+                     band_height: int):
+    """Raw channel: GS v 0 for inked stretches, ESC J for blank runs"""
+    motion_unit_set = False
+    for piece in pieces:
+        if isinstance(piece, int):
+            if not motion_unit_set:
+                printer._raw(SET_MOTION_UNIT)
+                motion_unit_set = True
+            printer._raw(feed_command(piece))
+        else:
+            for band in encode_raster(piece, band_height):
+                printer._raw(band)
+
+
+def _flatten(pieces: Iterable[Union[PackedRaster, int]], width: int) -> PackedRaster:
+    """What optimized output looks like on paper, as one raster (MockPrinter)"""
+    row_bytes = (width + 7) // 8
+    return PackedRaster.concat([
+        PackedRaster(width, p, bytes(row_bytes * p)) if isinstance(p, int) else p
+        for p in pieces
+    ])
+
+
+def write_raster(printer, raster: PackedRaster,
+                 band_height: int = DEFAULT_BAND_HEIGHT, optimize: bool = True):
+    """
+    Send a raster to the printer.
+
+    Real printers get raw `GS v 0` bands on the bulk endpoint, with blank
+    runs fed and blank margins trimmed when `optimize` is set. The
+    MockPrinter (or anything without a raw channel) gets an equivalent
+    image through its own API.
+    """
+    write_raster_bands(printer, [raster], band_height, optimize)
+
+
+def write_raster_bands(printer, bands: Iterable[PackedRaster],
+                       band_height: int = DEFAULT_BAND_HEIGHT, optimize: bool = True):
+    """
+    Send a stream of raster bands as they are produced.
+
+    The MockPrinter gets them joined into one image so a debug print is
+    still a single PNG.
+    """
+    if hasattr(printer, "_raw") and not hasattr(printer, "raster"):
+        _write_optimized(printer, optimize_bands(bands) if optimize else bands, band_height)
+        return
+
+    bands = list(bands)
+    if not bands:
+        return
+    if optimize:
+        raster = _flatten(optimize_bands(bands), bands[0].width)
+    else:
+        raster = PackedRaster.concat(bands)
+    if raster.height == 0:
+        return
+
+    if hasattr(printer, "raster"):
+        printer.raster(raster)
+    else:
+        logger.debug("Printer has no raw channel, falling back to image()")
+        printer.image(raster.to_image())
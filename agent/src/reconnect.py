@@ -0,0 +1,249 @@
+"""
+Cloud reconnect policy and connection-attempt telemetry.
+
+After a drop the first retry is immediate: most drops are a WiFi blip or
+a NAT timeout and the next attempt just works. Later delays use
+decorrelated jitter (each one random between the base and three times
+the previous delay, capped), so a fleet knocked off by a backend deploy
+spreads its reconnects out instead of coming back in lockstep. A close
+announcing a server restart (1001, 1012, 1013) skips the immediate retry
+for the same reason.
+
+Auth failures (close code 4001, HTTP 401/403) follow a separate, much
+slower policy. Retrying bad credentials every few seconds only loads the
+backend, but the device may be re-provisioned while it waits, so it
+keeps trying.
+
+Every attempt is timed phase by phase (DNS, TCP, TLS, websocket upgrade)
+and kept in a ring buffer that the cloud can query.
+"""
+
+import asyncio
+import collections
+import itertools
+import logging
+import random
+import socket
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import websockets
+from websockets.asyncio.client import ClientConnection
+from websockets.exceptions import ConnectionClosed, InvalidStatus
+from websockets.uri import parse_uri
+
+logger = logging.getLogger('paperdrop.reconnect')
+
+# Failure kinds, each with its own delay sequence
+NETWORK = "network"
+RESTART = "restart"
+AUTH = "auth"
+
+AUTH_CLOSE_CODES = frozenset((4001,))
+# Going away, service restart, try again later
+RESTART_CLOSE_CODES = frozenset((1001, 1012, 1013))
+
+
+def classify(exc: Optional[BaseException] = None, close_code: Optional[int] = None) -> str:
+    """Failure kind of a lost session: from its exception, or its close code"""
+    if isinstance(exc, InvalidStatus) and exc.response.status_code in (401, 403):
+        return AUTH
+    if isinstance(exc, ConnectionClosed) and exc.rcvd is not None:
+        close_code = exc.rcvd.code
+    if close_code in AUTH_CLOSE_CODES:
+        return AUTH
+    if close_code in RESTART_CLOSE_CODES:
+        return RESTART
+    return NETWORK
+
+
+class ReconnectPolicy:
+    """
+    Delay before the next connection attempt.
+
+    Consecutive failures of one kind build up the delay; a session that
+    stayed up `stable_after` seconds, or a failure of another kind,
+    starts over.
+    """
+
+    def __init__(self, base: float = 0.5, cap: float = 60.0,
+                 auth_base: float = 30.0, auth_cap: float = 900.0,
+                 stable_after: float = 10.0):
+        self.base = base
+        self.cap = cap
+        self.auth_base = auth_base
+        self.auth_cap = auth_cap
+        self.stable_after = stable_after
+        self.failures = 0
+        self._kind: Optional[str] = None
+        self._delay = 0.0
+
+    def next_delay(self, kind: str, session_seconds: Optional[float] = None) -> float:
+        """
+        Seconds to wait after a failure of `kind`. `session_seconds` is how
+        long the lost connection was up, None if it never came up.
+        """
+        if kind != self._kind or (session_seconds or 0) >= self.stable_after:
+            self._kind = kind
+            self.failures = 0
+            self._delay = 0.0
+        self.failures += 1
+
+        if kind == NETWORK and self.failures == 1:
+            return 0.0
+        base, cap = (self.auth_base, self.auth_cap) if kind == AUTH else (self.base, self.cap)
+        self._delay = min(cap, random.uniform(base, max(self._delay, base) * 3))
+        return self._delay
+
+
+# ─────────────────────────────────────────────────────────────────────
+# TELEMETRY
+# ─────────────────────────────────────────────────────────────────────
+
+class AttemptLog:
+    """
+    The last `size` connection attempts, newest last, as plain dicts:
+
+        n, at, outcome (connecting/connected/<failure kind>), dns_ms, tcp_ms,
+        tls_ms, upgrade_ms, total_ms, address, phase (the one that failed),
+        error, close_code, session_s, downtime_ms, retry_in_s
+    """
+
+    def __init__(self, size: int = 32):
+        self._ring: collections.deque = collections.deque(maxlen=size)
+        self._seq = itertools.count(1)
+        self._down_since: Optional[float] = None
+        self._connected_at: Optional[float] = None
+
+    def begin(self) -> dict:
+        if self._down_since is None:
+            self._down_since = time.monotonic()
+        self._connected_at = None
+        attempt = {
+            "n": next(self._seq),
+            "at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "outcome": "connecting",
+        }
+        self._ring.append(attempt)
+        return attempt
+
+    def connected(self, attempt: dict):
+        now = time.monotonic()
+        attempt["outcome"] = "connected"
+        attempt["downtime_ms"] = round((now - self._down_since) * 1000)
+        self._down_since = None
+        self._connected_at = now
+
+    def ended(self, attempt: dict, kind: str, exc: Optional[BaseException] = None,
+              close_code: Optional[int] = None) -> Optional[float]:
+        """
+        Record how `attempt` ended. Returns how long its session was up,
+        None if it never connected.
+        """
+        session = None
+        if self._connected_at is not None:
+            session = time.monotonic() - self._connected_at
+            attempt["session_s"] = round(session, 1)
+            self._connected_at = None
+            self._down_since = time.monotonic()
+        attempt["outcome"] = kind
+        if isinstance(exc, ConnectionClosed) and exc.rcvd is not None:
+            close_code = exc.rcvd.code
+        if close_code is not None:
+            attempt["close_code"] = close_code
+        if exc is not None:
+            attempt["error"] = str(exc) or type(exc).__name__
+        return session
+
+    def recent(self, limit: Optional[int] = None) -> list[dict]:
+        attempts = [dict(a) for a in self._ring]
+        return attempts[-limit:] if limit else attempts
+
+
+class _Phases:
+    """Lap timer writing `<phase>_ms` into an attempt"""
+
+    def __init__(self, attempt: dict, first: str):
+        self.attempt = attempt
+        self.started = self.mark = time.monotonic()
+        attempt["phase"] = first
+
+    def lap(self, next_phase: Optional[str] = None):
+        now = time.monotonic()
+        self.attempt[f"{self.attempt['phase']}_ms"] = round((now - self.mark) * 1000, 1)
+        self.mark = now
+        if next_phase:
+            self.attempt["phase"] = next_phase
+        else:
+            del self.attempt["phase"]
+
+    def stop(self):
+        self.attempt["total_ms"] = round((time.monotonic() - self.started) * 1000, 1)
+
+
+class _TimedConnection(ClientConnection):
+    """Notes when the transport is up, i.e. the TLS handshake is done"""
+
+    phases: Optional[_Phases] = None
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        if self.phases and self.phases.attempt.get("phase") == "tls":
+            self.phases.lap("upgrade")
+
+
+async def timed_connect(uri: str, attempt: dict, open_timeout: float = 10, **kwargs):
+    """
+    websockets.connect() done step by step so `attempt` gets each phase's
+    duration; if one fails, attempt["phase"] names it. Proxies are not
+    supported.
+    """
+    ws_uri = parse_uri(uri)
+    loop = asyncio.get_running_loop()
+    phases = _Phases(attempt, "dns")
+
+    def create_connection(*args, **kw):
+        connection = _TimedConnection(*args, **kw)
+        connection.phases = phases
+        return connection
+
+    async def connect():
+        infos = await loop.getaddrinfo(ws_uri.host, ws_uri.port, type=socket.SOCK_STREAM)
+        phases.lap("tcp")
+        sock = await _open_socket(loop, infos)
+        attempt["address"] = sock.getpeername()[0]
+        phases.lap("tls" if ws_uri.secure else "upgrade")
+        try:
+            websocket = await websockets.connect(
+                uri, sock=sock, create_connection=create_connection,
+                open_timeout=None, **kwargs,
+            )
+        except BaseException:
+            sock.close()
+            raise
+        phases.lap()
+        return websocket
+
+    try:
+        # wait_for rather than asyncio.timeout(), which needs Python 3.11
+        return await asyncio.wait_for(connect(), open_timeout)
+    finally:
+        phases.stop()
+
+
+async def _open_socket(loop, infos) -> socket.socket:
+    """Connect to the first address that answers, in resolver order"""
+    error: Optional[OSError] = None
+    for family, type_, proto, _, address in infos:
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+            return sock
+        except BaseException as e:
+            sock.close()
+            if not isinstance(e, OSError):
+                raise
+            error = e
+    raise error or OSError("No address to connect to")
@@ -0,0 +1,164 @@
+"""
+Process-pool image rendering.
+
+Decode, resample and dither are CPU-bound and hold the GIL for most of
+their time, so on a multi-core Pi the render thread alone leaves cores
+idle during bursts. RenderPool runs whole image jobs in worker processes
+that have already imported PIL/NumPy.
+
+Nothing big is pickled: the parent allocates one shared memory block
+per job, copies the compressed source into its head, and the worker
+writes the packed 1bpp raster (1/8 byte per dot) right behind it. Only
+the block name and a few ints cross the process boundary.
+
+Error diffusion carries error from row to row, so a single image can't
+be split across processes; parallelism is across jobs. A job rendered
+here reaches the printer once it is complete, not band by band, which
+is the latency side of the trade.
+"""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+from raster_encoder import PackedRaster
+
+logger = logging.getLogger('paperdrop.render')
+
+# Spare rows in the output area: JPEG draft() can shift the scaled height
+_SLACK_ROWS = 2
+
+
+def _init_worker():
+    # Pay for PIL/NumPy/resampling once per process, not per job
+    import image_pipeline  # noqa: F401
+
+
+def _warm():
+    return multiprocessing.current_process().pid
+
+
+def _render(shm_name: str, source_len: int, width: int, algorithm: str,
+            gamma: float, contrast: float) -> int:
+    """Worker process: render into the shared block, return the height"""
+    import io
+    from PIL import Image
+    from image_pipeline import iter_raster_bands
+
+    shm = SharedMemory(shm_name)
+    try:
+        img = Image.open(io.BytesIO(bytes(shm.buf[:source_len])))
+        offset = source_len
+        for band in iter_raster_bands(img, width, algorithm=algorithm,
+                                      gamma=gamma, contrast=contrast):
+            end = offset + len(band.data)
+            if end > shm.size:
+                raise ValueError("Rendered raster larger than its shared block")
+            shm.buf[offset:end] = band.data
+            offset = end
+    finally:
+        shm.close()
+    return (offset - source_len) // ((width + 7) // 8)
+
+
+class RenderPool:
+    """
+    A small ProcessPoolExecutor for image jobs.
+
+    `submit()` returns a concurrent.futures.Future resolving to a
+    PackedRaster. At most `workers * 2` jobs are in flight; further
+    submits block, which throttles the render stage instead of letting
+    decoded sources pile up in RAM.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes and wait until they have imported PIL/NumPy"""
+        with self._lock:
+            if self._executor is not None:
+                return
+            # The agent is multi-threaded by now; don't fork it
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_init_worker,
+            )
+            executor = self._executor
+        pids = {f.result() for f in [executor.submit(_warm) for _ in range(self.workers)]}
+        logger.info(f"Render pool ready ({len(pids)}/{self.workers} processes warm)")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, source, width: int, out_height: int, algorithm: str,
+               gamma: float, contrast: float) -> concurrent.futures.Future:
+        """
+        Render `source` (compressed image bytes) `width` dots wide.
+        `out_height` is the expected scaled height, used to size the block.
+        """
+        self._slots.acquire()
+        row_bytes = (width + 7) // 8
+        source = memoryview(source).cast("B")
+        try:
+            shm = SharedMemory(create=True,
+                               size=len(source) + row_bytes * (out_height + _SLACK_ROWS))
+        except BaseException:
+            self._slots.release()
+            raise
+        shm.buf[:len(source)] = source
+
+        result: concurrent.futures.Future = concurrent.futures.Future()
+        try:
+            task = self._get_executor().submit(
+                _render, shm.name, len(source), width, algorithm, gamma, contrast
+            )
+        except BaseException:
+            self._release(shm)
+            raise
+
+        def _done(task):
+            try:
+                height = task.result()
+                start = len(source)
+                data = bytes(shm.buf[start:start + row_bytes * height])
+                result.set_result(PackedRaster(width, height, data))
+            except BrokenProcessPool as e:
+                self._discard_executor()
+                result.set_exception(e)
+            except BaseException as e:
+                result.set_exception(e)
+            finally:
+                self._release(shm)
+
+        task.add_done_callback(_done)
+        return result
+
+    def _get_executor(self):
+        if self._executor is None:
+            self.start()
+        return self._executor
+
+    def _discard_executor(self):
+        # A worker died (OOM killer on a Pi Zero, most likely): start a
+        # fresh pool on the next submit
+        logger.error("Render pool broke, restarting it on next job")
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False)
+
+    def _release(self, shm: SharedMemory):
+        shm.close()
+        shm.unlink()
+        self._slots.release()
@@ -0,0 +1,115 @@
+"""
+Startup import report.
+
+Runs `python -X importtime -c "import agent"` in a fresh interpreter and
+summarizes where the time goes, then checks it against the import
+budget. Everything the agent needs before it can send device_hello is
+imported eagerly; FastAPI/uvicorn (setup hotspot), PIL/NumPy (image
+jobs) and escpos (printer warm-up) must not be, so the report also
+fails if any of them show up at startup.
+
+    python agent.py --import-report
+    python startup_profile.py --budget-ms 400 --top 15
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import NamedTuple
+
+# Cumulative `import agent` time we allow, measured on a Pi 3.
+# Override with PAPERDROP_IMPORT_BUDGET_MS for slower/faster boards.
+IMPORT_BUDGET_MS = float(os.environ.get("PAPERDROP_IMPORT_BUDGET_MS", "600"))
+
+# Top-level packages that may only load once their mode is entered
+LAZY_MODULES = ("fastapi", "uvicorn", "starlette", "pydantic", "PIL", "numpy", "escpos", "usb")
+
+_SRC_DIR = Path(__file__).resolve().parent
+
+
+class ImportRecord(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def measure(target: str = "agent") -> list[ImportRecord]:
+    """Import `target` in a fresh interpreter and return its -X importtime records"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=_SRC_DIR, capture_output=True, text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {target} failed:\n{proc.stderr.strip()}")
+    return parse_importtime(proc.stderr)
+
+
+def parse_importtime(output: str) -> list[ImportRecord]:
+    records = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # column header
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        records.append(ImportRecord(
+            module=stripped,
+            self_us=int(fields[0]),
+            cumulative_us=int(fields[1]),
+            depth=(len(name) - len(stripped)) // 2,
+        ))
+    return records
+
+
+def report(records: list[ImportRecord], budget_ms: float = IMPORT_BUDGET_MS,
+           top: int = 10, target: str = "agent") -> bool:
+    """Print the summary; returns False if the startup budget is blown"""
+    total_ms = next(
+        (r.cumulative_us for r in records if r.module == target and r.depth == 0), 0
+    ) / 1000
+    # Top-level entries cover everything imported at startup, the
+    # interpreter's own site imports included
+    overall_ms = sum(r.cumulative_us for r in records if r.depth == 0) / 1000
+
+    print(f"Slowest imports under '{target}' (cumulative):")
+    for r in sorted(records, key=lambda r: r.cumulative_us, reverse=True)[:top]:
+        print(f"  {r.cumulative_us / 1000:8.1f} ms  {r.self_us / 1000:8.1f} ms self  {r.module}")
+    print(f"import {target}: {total_ms:.1f} ms (budget {budget_ms:.0f} ms), "
+          f"{overall_ms:.1f} ms including interpreter startup imports")
+
+    ok = True
+    loaded = sorted({r.module.split(".")[0] for r in records} & set(LAZY_MODULES))
+    if loaded:
+        print(f"FAIL: imported at startup but should be lazy: {', '.join(loaded)}")
+        ok = False
+    if total_ms > budget_ms:
+        print(f"FAIL: import {target} took {total_ms:.1f} ms, over the {budget_ms:.0f} ms budget")
+        ok = False
+    if ok:
+        print("OK")
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="PaperDrop agent import-time report")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--module", default="agent")
+    args = parser.parse_args(argv)
+
+    try:
+        records = measure(args.module)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 2
+    return 0 if report(records, args.budget_ms, args.top, args.module) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
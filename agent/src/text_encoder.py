@@ -0,0 +1,231 @@
+"""
+Table-driven ESC/POS text encoder.
+
+Replaces python-escpos' magic encoding, which tries code pages character
+by character on every `text()` call. The character -> byte tables of
+the code pages the TM-T20III supports are built once and cached as JSON
+under CONFIG_DIR; encoding is then a dict lookup per character.
+
+Code page switches (`ESC t n`) are only emitted when the current page
+can't encode the next character, so a run of accented letters stays in
+one page. Characters no page has (emoji, CJK, ...) are drawn with a
+TrueType font into 24-dot `ESC *` bit images, which print inline on the
+text line; those glyphs are cached on disk too. Without Pillow or a
+usable font they come out as "?".
+"""
+
+import base64
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger('paperdrop.text')
+
+ESC_T = b"\x1bt"
+ESC_STAR = b"\x1b*"
+
+# ESC t n -> Python codec, in order of preference. PC437 is the power-on page.
+CODE_PAGES = (
+    (0, "cp437"),
+    (16, "cp1252"),
+    (2, "cp850"),
+    (19, "cp858"),
+    (18, "cp852"),
+    (17, "cp866"),
+    (3, "cp860"),
+    (4, "cp863"),
+    (5, "cp865"),
+)
+
+# Bump when CODE_PAGES or the table layout changes
+TABLE_VERSION = 1
+
+# ESC * m = 33: 24-dot double density, the height of font A
+_GLYPH_MODE = 33
+GLYPH_HEIGHT = 24
+_GLYPH_FONT_SIZE = 21
+GLYPH_FONTS = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+_REPLACEMENT = b"?"
+# Not in any font: renders as the font's .notdef box
+_MISSING = "\U0010FFFD"
+
+
+def build_tables() -> dict[int, dict[str, int]]:
+    """{page: {char: byte}} for the upper half of every code page"""
+    tables = {}
+    for page, codec in CODE_PAGES:
+        table = {}
+        for byte in range(0x80, 0x100):
+            try:
+                char = bytes((byte,)).decode(codec)
+            except UnicodeDecodeError:
+                continue
+            if char.isprintable():
+                table[char] = byte
+        tables[page] = table
+    return tables
+
+
+class TextEncoder:
+    def __init__(self, table_file: Path, glyph_file: Optional[Path] = None,
+                 font_path: Optional[str] = None):
+        self.table_file = Path(table_file)
+        self.glyph_file = Path(glyph_file) if glyph_file else None
+        self.font_path = font_path
+        self.pages: dict[int, dict[str, int]] = self._load_tables()
+        # char -> (page, byte), first page in CODE_PAGES order that has it
+        self.preferred: dict[str, tuple[int, int]] = {}
+        for page, _ in reversed(CODE_PAGES):
+            for char, byte in self.pages[page].items():
+                self.preferred[char] = (page, byte)
+        self._glyphs: dict[str, bytes] = self._load_glyphs()
+        self._glyphs_dirty = False
+        self._font = None
+        self._lock = threading.Lock()
+
+    # ─────────────────────────────────────────────────────────────────
+    # ENCODING
+    # ─────────────────────────────────────────────────────────────────
+
+    def encode(self, text: str, page: Optional[int] = None) -> tuple[bytes, int]:
+        """
+        Encode `text` starting with code page `page` selected (None:
+        unknown). Returns the bytes and the page selected afterwards.
+        """
+        out = bytearray()
+        current = self.pages.get(page)
+        for char in text:
+            code = ord(char)
+            if code < 0x80:
+                out.append(code)
+                continue
+            if current is not None and char in current:
+                out.append(current[char])
+                continue
+            found = self.preferred.get(char)
+            if found:
+                page, byte = found
+                current = self.pages[page]
+                out += ESC_T + bytes((page,))
+                out.append(byte)
+                continue
+            out += self.glyph(char)
+
+        if self._glyphs_dirty:
+            self._save_glyphs()
+        return bytes(out), page
+
+    def glyph(self, char: str) -> bytes:
+        """Inline `ESC *` bit image of `char`, rendered once and cached"""
+        with self._lock:
+            cached = self._glyphs.get(char)
+            if cached is None:
+                cached = self._render_glyph(char)
+                if cached:
+                    self._glyphs_dirty = True
+                else:
+                    # Not persisted: a font installed later gets its chance
+                    cached = _REPLACEMENT
+                self._glyphs[char] = cached
+            return cached
+
+    def _render_glyph(self, char: str) -> Optional[bytes]:
+        font = self._get_font()
+        if not font:
+            return None
+        glyph = self._draw(font, char)
+        if glyph == self._draw(font, _MISSING):
+            return None  # Font has no such glyph either: skip the tofu box
+        return glyph
+
+    @staticmethod
+    def _draw(font, char: str) -> Optional[bytes]:
+        from PIL import Image, ImageDraw
+
+        left, _, right, _ = font.getbbox(char)
+        width = max(right, 1) + 1
+        if right - left <= 0:
+            return None
+        img = Image.new("1", (width, GLYPH_HEIGHT), 1)
+        ImageDraw.Draw(img).text((0, 1), char, font=font, fill=0)
+
+        # ESC * wants columns, top to bottom: transpose so each column is a
+        # row, then pack it with 1 = black
+        columns = img.transpose(Image.Transpose.TRANSPOSE).tobytes("raw", "1;I")
+        return ESC_STAR + bytes((_GLYPH_MODE, width & 0xFF, width >> 8)) + columns
+
+    def _get_font(self):
+        if self._font is None:
+            self._font = False
+            try:
+                from PIL import ImageFont
+            except ImportError:
+                return None
+            candidates = (self.font_path,) + GLYPH_FONTS if self.font_path else GLYPH_FONTS
+            for path in candidates:
+                if path and os.path.exists(path):
+                    try:
+                        self._font = ImageFont.truetype(path, _GLYPH_FONT_SIZE)
+                        break
+                    except OSError as e:
+                        logger.warning(f"Can't load glyph font {path}: {e}")
+            if not self._font:
+                logger.warning("No glyph font found; unprintable characters become '?'")
+        return self._font
+
+    # ─────────────────────────────────────────────────────────────────
+    # DISK CACHE
+    # ─────────────────────────────────────────────────────────────────
+
+    def _load_tables(self) -> dict[int, dict[str, int]]:
+        try:
+            data = json.loads(self.table_file.read_text())
+            if data.get("version") == TABLE_VERSION:
+                return {int(page): table for page, table in data["pages"].items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logger.warning(f"Code page table unreadable, rebuilding: {e}")
+
+        tables = build_tables()
+        try:
+            tmp = self.table_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"version": TABLE_VERSION, "pages": tables}))
+            os.replace(tmp, self.table_file)
+        except OSError as e:
+            logger.warning(f"Can't cache code page table: {e}")
+        return tables
+
+    def _load_glyphs(self) -> dict[str, bytes]:
+        if not self.glyph_file:
+            return {}
+        try:
+            data = json.loads(self.glyph_file.read_text())
+            return {char: base64.b64decode(blob) for char, blob in data.items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Glyph cache unreadable, starting fresh: {e}")
+            return {}
+
+    def _save_glyphs(self):
+        with self._lock:
+            self._glyphs_dirty = False
+            if not self.glyph_file:
+                return
+            data = {char: base64.b64encode(blob).decode()
+                    for char, blob in self._glyphs.items() if blob != _REPLACEMENT}
+        try:
+            tmp = self.glyph_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self.glyph_file)
+        except OSError as e:
+            logger.warning(f"Can't save glyph cache: {e}")
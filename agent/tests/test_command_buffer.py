@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from command_buffer import CommandBuffer, TransferStats  # noqa: E402
+
+
+class RawPrinter:
+    """Records each bulk write"""
+
+    def __init__(self):
+        self.writes = []
+
+    def _raw(self, data):
+        self.writes.append(bytes(data))
+
+
+def test_job_goes_out_in_one_write():
+    printer = RawPrinter()
+    stats = TransferStats()
+
+    with CommandBuffer(printer, stats) as out:
+        out.text("Hello\n")
+        out.text("World\n")
+        out.cut()
+        assert printer.writes == []
+
+    assert len(printer.writes) == 1
+    assert b"Hello\nWorld\n" in printer.writes[0]
+    assert printer.writes[0].endswith(b"\x1dV\x00")
+    assert stats.to_dict()["writes"] == 1
+
+
+def test_large_buffer_is_split_at_flush_bytes():
+    printer = RawPrinter()
+
+    with CommandBuffer(printer, flush_bytes=16) as out:
+        for _ in range(5):
+            out.cut(feed=False)
+
+    assert [len(w) for w in printer.writes] == [15]
+    printer.writes.clear()
+
+    with CommandBuffer(printer, flush_bytes=4) as out:
+        for _ in range(5):
+            out.cut(feed=False)
+
+    assert [len(w) for w in printer.writes] == [4, 4, 4, 3]
+    assert b"".join(printer.writes) == b"\x1dV\x00" * 5
+
+
+def test_printer_without_raw_channel_gets_calls_directly():
+    class MockPrinter:
+        def __init__(self):
+            self.calls = []
+
+        def text(self, txt):
+            self.calls.append(("text", txt))
+
+        def cut(self):
+            self.calls.append(("cut",))
+
+    printer = MockPrinter()
+    with CommandBuffer(printer) as out:
+        out.text("Hi\n")
+        out.cut()
+    assert printer.calls == [("text", "Hi\n"), ("cut",)]
+
+
+def test_only_style_changes_reach_the_printer():
+    printer = RawPrinter()
+
+    with CommandBuffer(printer) as out:
+        out.set(bold=True)
+        out.text("a")
+        out.set(bold=True)           # no change
+        out.text("b")
+        out.set(align="center")
+        out.set(align="left")        # overwritten before any text
+        out.text("c")
+
+    data = printer.writes[0]
+    assert data.count(b"\x1bE\x01") == 1
+    assert b"\x1ba\x01" not in data
+    assert data.count(b"\x1ba\x00") == 1
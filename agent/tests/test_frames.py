@@ -0,0 +1,61 @@
+import io
+import struct
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from frames import FrameError, MemoryReader, build_binary_frame, parse_binary_frame  # noqa: E402
+
+HEADER = {"type": "print_job", "message_id": "m1", "content_type": "image/png"}
+
+
+def test_round_trip():
+    payload = bytes(range(256)) * 4
+    header, body = parse_binary_frame(build_binary_frame(HEADER, payload))
+
+    assert header == HEADER
+    assert isinstance(body, memoryview)
+    assert body.tobytes() == payload
+
+
+def test_empty_payload():
+    header, body = parse_binary_frame(build_binary_frame(HEADER, b""))
+    assert header == HEADER
+    assert len(body) == 0
+
+
+def test_header_length_past_the_end():
+    frame = build_binary_frame(HEADER, b"")
+    # Claim a header longer than the whole frame
+    oversized = frame[:3] + struct.pack(">H", len(frame)) + frame[5:]
+    with pytest.raises(FrameError, match="Truncated"):
+        parse_binary_frame(oversized)
+
+
+@pytest.mark.parametrize("frame, message", [
+    (b"PD", "too short"),
+    (b"XX\x01\x00\x02{}", "magic"),
+    (b"PD\x02\x00\x02{}", "version"),
+    (b"PD\x01\x00\x02[]", "JSON object"),
+    (b"PD\x01\x00\x02{x", "Bad frame header"),
+])
+def test_malformed_frames(frame, message):
+    with pytest.raises(FrameError, match=message):
+        parse_binary_frame(frame)
+
+
+def test_memory_reader_reads_and_seeks():
+    reader = MemoryReader(memoryview(b"0123456789")[2:])
+
+    assert reader.read(3) == b"234"
+    assert reader.seek(-2, io.SEEK_END) == 6
+    assert reader.read() == b"89"
+    reader.seek(1)
+    buf = bytearray(4)
+    assert reader.readinto(buf) == 4
+    assert bytes(buf) == b"3456"
+    with pytest.raises(ValueError):
+        reader.seek(-1)
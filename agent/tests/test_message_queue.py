@@ -0,0 +1,104 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from message_queue import MessageQueue, QueueFull  # noqa: E402
+
+
+def job(message_id, kind="new_message"):
+    return {"type": kind, "message": {"id": message_id}}
+
+
+def drain(inbox):
+    """Everything queued, in dispatch order"""
+    async def take():
+        return [await inbox.get() for _ in range(inbox.depth)]
+    return asyncio.run(take())
+
+
+def test_control_messages_overtake_jobs():
+    inbox = MessageQueue(capacity=4)
+    inbox.put(job("m1"))
+    inbox.put(job("m2"))
+    inbox.put({"type": "ping"})
+
+    assert [e.type for e in drain(inbox)] == ["ping", "new_message", "new_message"]
+
+
+def test_a_job_holds_its_slot_until_released():
+    pauses = []
+    inbox = MessageQueue(capacity=2, on_pause=pauses.append)
+    inbox.put(job("m1"))
+    inbox.put(job("m2"))
+    first, _ = drain(inbox)
+
+    # Dispatched but not printed: still no room
+    with pytest.raises(QueueFull):
+        inbox.put(job("m3"))
+    assert pauses == [True]
+    # Control messages are never refused
+    inbox.put({"type": "ping"})
+
+    inbox.release(first)
+    inbox.release(first)  # a second release frees nothing
+    assert inbox.jobs == 1
+    assert pauses == [True, False]
+    inbox.put(job("m3"))
+
+
+def test_deferred_jobs_keep_arrival_order():
+    inbox = MessageQueue(capacity=1)
+    held = inbox.put(job("m1"))
+    for message_id in ("m2", "m3"):
+        with pytest.raises(QueueFull):
+            inbox.put(job(message_id))
+        inbox.defer(message_id)
+    assert inbox.admit() is None
+
+    inbox.release(held)
+    # A newcomer may not overtake the backlog, even with a slot free
+    with pytest.raises(QueueFull):
+        inbox.put(job("m4"))
+    inbox.defer("m4")
+
+    admitted = []
+    while (item := inbox.admit()) is not None:
+        admitted.append(item)
+        inbox.release(inbox.put(job(item), from_backlog=True))
+
+    assert admitted == ["m2", "m3", "m4"]
+    assert inbox.stats()["deferred"] == 3
+    assert not inbox.paused
+
+
+def test_credits_come_back_for_paced_jobs_only():
+    inbox = MessageQueue(capacity=4)
+    assert inbox.open_credits() == 4
+
+    inbox.put(job("m1"))
+    inbox.put(job("m2", kind="print_job"))
+    inbox.put({"type": "test_print", "request_id": "t1"})
+    assert inbox.open_credits() == 1
+
+    inbox.complete("m1")
+    inbox.complete("t1")  # test prints were never charged a credit
+    assert inbox.take_credits() == 1
+    assert inbox.take_credits() == 0
+
+    inbox.complete("m2")
+    assert inbox.credits_due == 1
+
+
+def test_new_session_voids_credits_owed():
+    inbox = MessageQueue(capacity=2)
+    inbox.put(job("m1"))
+    inbox.complete("m1")
+    assert inbox.credits_due == 1
+
+    # The new session is granted every free slot instead
+    assert inbox.open_credits() == 2
+    assert inbox.take_credits() == 0
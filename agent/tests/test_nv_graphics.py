@@ -0,0 +1,108 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from command_buffer import CommandBuffer  # noqa: E402
+from nv_graphics import GraphicsRegistry, define_command, print_command  # noqa: E402
+from raster_encoder import PackedRaster  # noqa: E402
+
+
+class RawPrinter:
+    """Printer with a raw channel but no read-back: trusted to match the index"""
+
+    def __init__(self, fail=False):
+        self.written = bytearray()
+        self.fail = fail
+
+    def _raw(self, data):
+        if self.fail:
+            raise OSError("USB write failed")
+        self.written += data
+
+
+def logo():
+    # 16 x 2 dots, no blank margins for trim_raster to remove
+    return PackedRaster(16, 2, b"\xff\x0f\xf0\xff")
+
+
+def registry(tmp_path):
+    return GraphicsRegistry(tmp_path / "nv.json", capacity=4096, max_graphic_bytes=1024)
+
+
+def test_define_command_bytes():
+    assert define_command(b"P!", logo()) == (
+        b"\x1d(L"           # GS ( L
+        b"\x0f\x00"         # pL pH: 15 bytes follow
+        b"\x30\x43"         # m = 48, fn = 67
+        b"\x30"             # a = 48
+        b"P!"               # kc1 kc2
+        b"\x01"             # b = 1: monochrome
+        b"\x10\x00"         # width 16
+        b"\x02\x00"         # height 2
+        b"\x31"             # c = 49: colour 1
+        b"\xff\x0f\xf0\xff"
+    )
+
+
+def test_print_command_bytes():
+    assert print_command(b"P!") == b"\x1d(L\x06\x00\x30\x45P!\x01\x01"
+
+
+def test_resident_only_after_flush(tmp_path):
+    reg = registry(tmp_path)
+    printer = RawPrinter()
+
+    with CommandBuffer(printer) as out:
+        out.graphic(logo(), reg)
+        assert reg.used_bytes == 0
+    assert printer.written.startswith(define_command(b"P ", logo()))
+    assert reg.used_bytes == 4
+
+    # Now printed by reference, and the index says so after a restart
+    assert reg.lookup(printer, logo()) == print_command(b"P ")
+    assert registry(tmp_path).used_bytes == 4
+
+
+def test_failed_upload_is_not_resident(tmp_path):
+    reg = registry(tmp_path)
+
+    with pytest.raises(OSError):
+        with CommandBuffer(RawPrinter(fail=True)) as out:
+            out.graphic(logo(), reg)
+    assert reg.used_bytes == 0
+    assert not (tmp_path / "nv.json").exists()
+
+    # The next print uploads it again instead of referencing an empty slot
+    command = reg.lookup(RawPrinter(), logo(), pin=True)
+    assert command.startswith(define_command(b"P ", logo()))
+
+
+def test_unpinned_raster_is_never_uploaded(tmp_path):
+    reg = registry(tmp_path)
+    printer = RawPrinter()
+
+    for _ in range(5):
+        assert reg.lookup(printer, logo()) is None
+    assert reg.used_bytes == 0
+
+
+class ReadablePrinter(RawPrinter):
+    """Answers the key list (one stored key, "P!") and remaining capacity queries"""
+
+    def __init__(self, free: int):
+        super().__init__()
+        self.replies = [b"\x37\x72\x40P!\x00", b"\x37\x31" + str(free).encode() + b"\x00"]
+
+    def _read(self):
+        return self.replies.pop(0)
+
+
+def test_remaining_capacity_caps_uploads(tmp_path):
+    reg = registry(tmp_path)
+
+    # 3 bytes left: the 4-byte logo doesn't fit
+    assert reg.lookup(ReadablePrinter(free=3), logo(), pin=True) is None
+    assert reg.capacity == 3
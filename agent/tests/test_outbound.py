@@ -0,0 +1,120 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from websockets.exceptions import ConnectionClosed  # noqa: E402
+
+from outbound import OutboundChannel  # noqa: E402
+
+
+class FakeSocket:
+    """Collects sent frames; `gate` holds the writer on its next send"""
+
+    def __init__(self, fail=None):
+        self.sent = []
+        self.fail = fail
+        self.gate = None
+
+    async def send(self, data):
+        if self.gate:
+            await self.gate.wait()
+        if self.fail:
+            raise self.fail
+        self.sent.append(json.loads(data))
+
+
+def status(message_id, state, **extra):
+    return {"type": "print_status", "message_id": message_id, "status": state, **extra}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_pending_status_updates_coalesce_into_one_batch():
+    async def scenario():
+        channel = OutboundChannel()
+        socket = FakeSocket()
+        socket.gate = asyncio.Event()
+        channel.attach(socket)
+
+        # First frame goes out alone and holds the writer
+        channel.send({"type": "pong"})
+        await asyncio.sleep(0)
+        channel.send(status("m1", "printing", credits=0))
+        channel.send(status("m1", "printed", credits=1))
+        channel.send(status("m2", "printed", credits=1))
+        channel.send({"type": "credit", "credits": 1})
+        channel.send({"type": "credit", "credits": 2})
+        socket.gate.set()
+        await asyncio.sleep(0.01)
+        await channel.detach()
+        return socket.sent, channel.stats()
+
+    sent, stats = run(scenario())
+    assert sent == [
+        {"type": "pong"},
+        {"type": "print_status_batch", "updates": [
+            {"message_id": "m1", "status": "printed", "credits": 1},
+            {"message_id": "m2", "status": "printed", "credits": 1},
+        ]},
+        {"type": "credit", "credits": 3},
+    ]
+    assert stats["coalesced"] == 2
+    assert stats["batches"] == 1
+
+
+def test_deliver_reports_whether_the_frame_went_out():
+    async def scenario():
+        channel = OutboundChannel()
+        assert not await channel.deliver(status("m1", "printed"))
+
+        channel.attach(FakeSocket())
+        assert await channel.deliver(status("m1", "printed"))
+        await channel.detach()
+
+    run(scenario())
+
+
+def test_frames_sent_while_offline_are_undelivered():
+    undelivered = []
+    channel = OutboundChannel(on_undelivered=undelivered.append)
+
+    channel.send(status("m1", "printed"))
+    assert undelivered == [status("m1", "printed")]
+
+
+def test_frames_pending_at_a_drop_are_undelivered():
+    async def scenario():
+        undelivered = []
+        channel = OutboundChannel(on_undelivered=undelivered.append)
+        channel.attach(FakeSocket(fail=ConnectionClosed(None, None)))
+        channel.send(status("m1", "printed"))
+        await asyncio.sleep(0.01)
+        channel.send(status("m2", "printed"))
+        await channel.detach()
+        return undelivered
+
+    assert [f["message_id"] for f in run(scenario())] == ["m1", "m2"]
+
+
+def test_writer_restarts_after_an_unexpected_error():
+    async def scenario():
+        undelivered = []
+        channel = OutboundChannel(on_undelivered=undelivered.append)
+        socket = FakeSocket()
+        channel.attach(socket)
+
+        channel.send({"type": "telemetry", "value": object()})  # not JSON
+        await asyncio.sleep(0.01)
+        channel.send(status("m1", "printed"))
+        await asyncio.sleep(0.01)
+        await channel.detach()
+        return undelivered, socket.sent
+
+    undelivered, sent = run(scenario())
+    assert [f["type"] for f in undelivered] == ["telemetry"]
+    assert sent == [status("m1", "printed")]
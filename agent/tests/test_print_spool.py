@@ -0,0 +1,122 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from print_spool import FAILED, PRINTED, PRINTING, RECEIVED, PrintSpool  # noqa: E402
+
+
+def committed_states(path):
+    """Job states another process would see: committed rows only"""
+    db = sqlite3.connect(str(path))
+    try:
+        return dict(db.execute("SELECT message_id, state FROM jobs"))
+    finally:
+        db.close()
+
+
+def test_duplicate_delivery_is_detected(tmp_path):
+    spool = PrintSpool(tmp_path / "spool.db")
+
+    assert spool.record_received("m1", {"type": "print_job"})
+    assert not spool.record_received("m1", {"type": "print_job"})
+    spool.close()
+
+    # Also after a restart
+    spool = PrintSpool(tmp_path / "spool.db")
+    assert not spool.record_received("m1", {"type": "print_job"})
+    spool.close()
+
+
+def test_transitions_are_committed_together_by_flush(tmp_path):
+    path = tmp_path / "spool.db"
+    spool = PrintSpool(path)
+
+    spool.record_received("m1", {"type": "print_job"})
+    spool.record_received("m2", {"type": "print_job"})
+    spool.mark_printing("m1")
+    spool.mark_printed("m1")
+    spool.mark_failed("m2", "paper out")
+
+    # Visible to this spool right away, to nobody else until flushed
+    assert spool.get_state("m1") == PRINTED
+    assert spool.dirty
+    assert committed_states(path) == {}
+
+    spool.flush()
+    assert not spool.dirty
+    assert committed_states(path) == {"m1": PRINTED, "m2": FAILED}
+    spool.close()
+
+
+def test_unfinished_jobs_survive_a_restart(tmp_path):
+    spool = PrintSpool(tmp_path / "spool.db")
+    spool.record_received("m1", {"type": "print_job", "n": 1}, b"\x89PNG")
+    spool.record_received("m2", {"type": "print_job", "n": 2})
+    spool.mark_printing("m2")
+    spool.record_received("m3", {"type": "print_job", "n": 3})
+    spool.mark_printed("m3")
+    spool.close()
+
+    spool = PrintSpool(tmp_path / "spool.db")
+    assert spool.pending_jobs() == [
+        ("m1", {"type": "print_job", "n": 1}, b"\x89PNG"),
+        ("m2", {"type": "print_job", "n": 2}, None),
+    ]
+    assert spool.get_state("m2") == PRINTING
+    spool.close()
+
+
+def test_reset_puts_a_failed_job_back(tmp_path):
+    spool = PrintSpool(tmp_path / "spool.db")
+    spool.record_received("m1", {"type": "print_job"})
+    spool.mark_failed("m1", "cover open")
+
+    spool.reset("m1", {"type": "print_job", "retry": True})
+    assert spool.get_state("m1") == RECEIVED
+    assert spool.pending_jobs() == [("m1", {"type": "print_job", "retry": True}, None)]
+    spool.close()
+
+
+def test_outbox_keeps_reports_until_acked(tmp_path):
+    spool = PrintSpool(tmp_path / "spool.db")
+    spool.queue_report({"type": "print_status", "message_id": "m1", "status": "printed"})
+    spool.queue_report({"type": "print_status", "message_id": "m2", "status": "failed"})
+    spool.close()
+
+    spool = PrintSpool(tmp_path / "spool.db")
+    reports = spool.pending_reports()
+    assert [frame["message_id"] for _, frame in reports] == ["m1", "m2"]
+
+    spool.ack_report(reports[0][0])
+    assert [frame["message_id"] for _, frame in spool.pending_reports()] == ["m2"]
+    spool.close()
+
+
+def test_old_finished_jobs_are_forgotten(tmp_path):
+    spool = PrintSpool(tmp_path / "spool.db", keep_days=0)
+    spool.record_received("m1", {"type": "print_job"})
+    spool.mark_printed("m1")
+    spool.record_received("m2", {"type": "print_job"})
+    spool.close()
+
+    spool = PrintSpool(tmp_path / "spool.db", keep_days=0)
+    assert spool.get_state("m1") is None
+    assert spool.get_state("m2") == RECEIVED
+    # Pruned ids are new again
+    assert spool.record_received("m1", {"type": "print_job"})
+    spool.close()
+
+
+def test_cursor_survives_a_restart_and_never_moves_back(tmp_path):
+    spool = PrintSpool(tmp_path / "spool.db")
+    assert spool.cursor is None
+
+    spool.advance_cursor("m2", "2026-03-01T10:00:02.000Z")
+    spool.advance_cursor("m1", "2026-03-01T10:00:01.000Z")  # a late replay
+    spool.close()
+
+    spool = PrintSpool(tmp_path / "spool.db")
+    assert spool.cursor == {"message_id": "m2", "created_at": "2026-03-01T10:00:02.000Z"}
+    spool.close()
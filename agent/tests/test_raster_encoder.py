@@ -0,0 +1,100 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from raster_encoder import (  # noqa: E402
+    COMPRESSION_RLE, PackedRaster, decode_raster_payload, optimize_bands, trim_raster,
+    unpack_bits,
+)
+
+
+def pack_bits(data: bytes) -> bytes:
+    """Reference PackBits encoder (the cloud side), runs of 3+ repeated"""
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        run = 1
+        while i + run < len(data) and run < 128 and data[i + run] == data[i]:
+            run += 1
+        if run >= 3:
+            out += bytes((257 - run, data[i]))
+            i += run
+            continue
+        start = i
+        while i < len(data) and i - start < 128:
+            if i + 2 < len(data) and data[i] == data[i + 1] == data[i + 2]:
+                break
+            i += 1
+        out += bytes((i - start - 1,)) + data[start:i]
+    return bytes(out)
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"\x00" * 72,
+    b"\xff" * 300,
+    bytes(range(200)),
+    b"\x00" * 40 + b"\x12\x34\x56" + b"\xff" * 29 + b"\xaa\xaa",
+])
+def test_packbits_round_trip(data):
+    assert unpack_bits(pack_bits(data), len(data)) == data
+
+
+def test_packbits_no_op_header_is_skipped():
+    assert unpack_bits(b"\x80\x01ab", 2) == b"ab"
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"\x05abc", "Truncated literal"),
+    (b"\xfd", "Truncated repeat"),
+    (b"\xfe\x00", "decoded to 3 bytes, expected 4"),
+])
+def test_packbits_truncated_input(data, message):
+    with pytest.raises(ValueError, match=message):
+        unpack_bits(data, 4)
+
+
+def test_decode_rle_payload():
+    rows = b"\xff" * 72 + b"\x00" * 72
+    raster = decode_raster_payload(576, 2, pack_bits(rows), COMPRESSION_RLE)
+    assert raster == PackedRaster(576, 2, rows)
+
+
+@pytest.mark.parametrize("width, height, data, compression", [
+    (576, 2, b"\x00" * 143, "none"),
+    (0, 2, b"", "none"),
+    (8, 1, b"\x00", "zstd"),
+])
+def test_decode_rejects_bad_payloads(width, height, data, compression):
+    with pytest.raises(ValueError):
+        decode_raster_payload(width, height, data, compression)
+
+
+def raster(rows):
+    """8-dot-wide raster from one byte per row"""
+    return PackedRaster(8, len(rows), bytes(rows))
+
+
+def test_blank_runs_become_feeds_and_margins_are_trimmed():
+    rows = [0] * 3 + [0xff] * 2 + [0] * 10 + [0x81] + [0] * 2 + [0x18] + [0] * 4
+    pieces = list(optimize_bands([raster(rows)], min_blank_run=8))
+
+    assert pieces == [
+        raster([0xff, 0xff]),
+        10,                          # long run: fed
+        raster([0x81, 0, 0, 0x18]),  # short run: kept in the raster
+    ]
+
+
+def test_blank_runs_are_counted_across_bands():
+    bands = [raster([0xff] + [0] * 5), raster([0] * 5 + [0xff])]
+    assert list(optimize_bands(bands, min_blank_run=8)) == [raster([0xff]), 10, raster([0xff])]
+
+
+def test_trim_raster_keeps_inner_blank_rows():
+    rows = [0] * 4 + [0x3c] + [0] * 20 + [0x3c] + [0] * 2
+    assert trim_raster(raster(rows)) == raster([0x3c] + [0] * 20 + [0x3c])
+    assert trim_raster(raster([0] * 3)).height == 0
@@ -0,0 +1,83 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from websockets.exceptions import ConnectionClosed  # noqa: E402
+from websockets.frames import Close  # noqa: E402
+
+from reconnect import AUTH, NETWORK, RESTART, AttemptLog, ReconnectPolicy, classify  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def seeded():
+    random.seed(1234)
+
+
+def test_network_drop_retries_at_once_then_backs_off_with_jitter():
+    policy = ReconnectPolicy(base=0.5, cap=60.0)
+    delays = [policy.next_delay(NETWORK) for _ in range(50)]
+
+    assert delays[0] == 0.0
+    previous = policy.base
+    for delay in delays[1:]:
+        assert policy.base <= delay <= policy.cap
+        assert delay <= previous * 3
+        previous = delay
+    assert max(delays) == policy.cap
+
+
+def test_restart_skips_the_immediate_retry():
+    policy = ReconnectPolicy(base=0.5, cap=60.0)
+    assert 0.5 <= policy.next_delay(RESTART) <= 1.5
+
+
+def test_auth_failures_back_off_on_their_own_scale():
+    policy = ReconnectPolicy(auth_base=30.0, auth_cap=900.0)
+    delays = [policy.next_delay(AUTH) for _ in range(20)]
+
+    assert all(30.0 <= d <= 900.0 for d in delays)
+    assert max(delays) == 900.0
+
+
+def test_stable_session_or_new_kind_starts_over():
+    policy = ReconnectPolicy(stable_after=10.0)
+    for _ in range(5):
+        policy.next_delay(NETWORK)
+
+    assert policy.next_delay(NETWORK, session_seconds=30.0) == 0.0
+    policy.next_delay(NETWORK, session_seconds=2.0)
+    assert policy.failures == 2
+
+    policy.next_delay(AUTH)
+    assert policy.failures == 1
+    assert policy.next_delay(NETWORK) == 0.0
+
+
+@pytest.mark.parametrize("code, kind", [
+    (4001, AUTH),
+    (1012, RESTART),
+    (1001, RESTART),
+    (1006, NETWORK),
+    (None, NETWORK),
+])
+def test_classify_by_close_code(code, kind):
+    assert classify(close_code=code) == kind
+    if code is not None:
+        assert classify(ConnectionClosed(Close(code, ""), None)) == kind
+
+
+def test_attempt_log_keeps_the_newest():
+    log = AttemptLog(size=3)
+    for _ in range(5):
+        attempt = log.begin()
+        log.ended(attempt, NETWORK, close_code=1006)
+
+    recent = log.recent()
+    assert [a["n"] for a in recent] == [3, 4, 5]
+    assert recent[-1]["outcome"] == NETWORK
+    assert recent[-1]["close_code"] == 1006
+    assert [a["n"] for a in log.recent(limit=1)] == [5]
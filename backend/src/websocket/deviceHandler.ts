@@ -7,6 +7,18 @@ import { Server } from 'http';
 // Map device IDs to WebSocket connections
 export const deviceConnections = new Map<string, WebSocket>();
 
+// Flow control: message jobs each connected device will still take before it
+// returns credits (in print_status / print_status_batch / credit frames).
+// null: the agent predates credits and gets jobs unpaced.
+const deviceCredits = new Map<string, number | null>();
+
+// Job frames that spend a credit; test prints and reprints are not paced
+const CREDITED_TYPES = ['new_message', 'print_job'];
+
+// Devices whose printer reported it can't print (paper out, cover open...);
+// message jobs wait in the database until it is ready again
+const printerNotReady = new Set<string>();
+
 export const setupWebSocket = (server: Server) => {
     const wss = new WebSocketServer({ server, path: '/api/device/connect' });
 
@@ -54,6 +66,8 @@ export const setupWebSocket = (server: Server) => {
         console.log(`Device connected: ${deviceCode} (${deviceId})`);
 
         deviceConnections.set(deviceId, ws);
+        // Nothing is sent until device_hello says how much the device takes
+        deviceCredits.set(deviceId, 0);
 
         // Update status to online
         await prisma.device.update({
@@ -64,15 +78,17 @@ export const setupWebSocket = (server: Server) => {
         ws.on('message', async (message) => {
             try {
                 const data = JSON.parse(message.toString());
-                handleDeviceMessage(deviceId, data);
+                await handleDeviceMessage(deviceId, data);
             } catch (e) {
-                console.error('Error parsing device message:', e);
+                console.error('Error handling device message:', e);
             }
         });
 
         ws.on('close', async () => {
             console.log(`Device disconnected: ${deviceCode}`);
             deviceConnections.delete(deviceId);
+            deviceCredits.delete(deviceId);
+            printerNotReady.delete(deviceId);
             // Update status to offline
             await prisma.device.update({
                 where: { id: deviceId },
@@ -87,27 +103,179 @@ export const setupWebSocket = (server: Server) => {
 const handleDeviceMessage = async (deviceId: string, message: any) => {
     console.log(`Received from ${deviceId}:`, message);
 
-    if (message.type === 'print_status') {
-        // Update message status
-        // message.message_id, message.status, message.error
-        if (message.message_id) {
-            await prisma.message.update({
-                where: { id: message.message_id },
-                data: {
-                    status: message.status,
-                    errorMessage: message.error || null,
-                    printedAt: message.status === 'printed' ? new Date() : null
-                }
-            });
+    if (message.type === 'device_hello') {
+        deviceCredits.set(deviceId, typeof message.credits === 'number' ? message.credits : null);
+        await updatePrinterStatus(deviceId, message.printer_status);
+        await replayMissedMessages(deviceId, message.cursor);
+        await deliverQueuedMessages(deviceId);
+    } else if (message.type === 'print_status') {
+        await updatePrintStatus(deviceId, message);
+        await returnCredits(deviceId, message.credits);
+    } else if (message.type === 'print_status_batch') {
+        // Several print_status updates (without their type) in one frame
+        let credits = 0;
+        for (const update of message.updates || []) {
+            await updatePrintStatus(deviceId, update);
+            credits += update.credits || 0;
+        }
+        await returnCredits(deviceId, credits);
+    } else if (message.type === 'credit') {
+        await returnCredits(deviceId, message.credits);
+    } else if (message.type === 'printer_status') {
+        await updatePrinterStatus(deviceId, message.printer_status);
+        await deliverQueuedMessages(deviceId);
+    } else if (message.type === 'backpressure') {
+        console.log(`Device ${deviceId} ${message.paused ? 'paused' : 'resumed'} (${message.queue_depth}/${message.capacity} jobs held)`);
+        if (!message.paused) {
+            await deliverQueuedMessages(deviceId);
         }
     }
 };
 
+const returnCredits = async (deviceId: string, credits: any) => {
+    const current = deviceCredits.get(deviceId);
+    if (typeof credits !== 'number' || credits <= 0 || current === undefined || current === null) {
+        return;
+    }
+    deviceCredits.set(deviceId, current + credits);
+    await deliverQueuedMessages(deviceId);
+};
+
+// Keep the printer state on the device (JSON, as the agent reports it:
+// connected, online, paper_out, paper_low, cover_open, error, ready)
+const updatePrinterStatus = async (deviceId: string, printerStatus: any) => {
+    if (!printerStatus || typeof printerStatus !== 'object') return;
+    if (printerStatus.ready === false) {
+        printerNotReady.add(deviceId);
+    } else {
+        printerNotReady.delete(deviceId);
+    }
+    try {
+        await prisma.device.update({
+            where: { id: deviceId },
+            data: { printerStatus: JSON.stringify(printerStatus) }
+        });
+    } catch (e) {
+        console.error(`Failed to record printer status for ${deviceId}:`, e);
+    }
+};
+
+const hasCredit = (deviceId: string): boolean => {
+    if (printerNotReady.has(deviceId)) return false;
+    const credits = deviceCredits.get(deviceId);
+    return credits === null || (credits !== undefined && credits > 0);
+};
+
+// Devices with a delivery loop running, and those whose credits came back meanwhile
+const delivering = new Set<string>();
+const deliverAgain = new Set<string>();
+
+// Send messages that were queued for a device (it was offline, or out of
+// credits) oldest first, as far as its credits go. Called whenever credits
+// come back; the rest waits in the database, not on the device.
+export const deliverQueuedMessages = async (deviceId: string) => {
+    if (delivering.has(deviceId)) {
+        deliverAgain.add(deviceId);
+        return;
+    }
+    delivering.add(deviceId);
+    try {
+        do {
+            deliverAgain.delete(deviceId);
+            while (hasCredit(deviceId)) {
+                const credits = deviceCredits.get(deviceId);
+                const queued = await prisma.message.findMany({
+                    where: { deviceId, status: 'queued' },
+                    orderBy: { createdAt: 'asc' },
+                    take: credits === null || credits === undefined ? 50 : credits,
+                });
+                if (queued.length === 0) break;
+
+                for (const message of queued) {
+                    if (!broadcastToDevice(deviceId, newMessageFrame(message))) return;
+                    await prisma.message.update({
+                        where: { id: message.id },
+                        data: { status: 'sent', sentAt: new Date() }
+                    });
+                }
+            }
+        } while (deliverAgain.has(deviceId));
+    } finally {
+        delivering.delete(deviceId);
+        deliverAgain.delete(deviceId);
+    }
+};
+
+const newMessageFrame = (message: any) => ({
+    type: 'new_message',
+    message: {
+        id: message.id,
+        content: JSON.parse(message.content),
+        contentType: message.contentType,
+        createdAt: message.createdAt
+    }
+});
+
+const updatePrintStatus = async (deviceId: string, update: any) => {
+    // Update message status
+    // update.message_id, update.status, update.error
+    if (!update.message_id) return;
+    try {
+        // Test prints and reprints report under request ids that are no
+        // Message, so this matches nothing for them
+        await prisma.message.updateMany({
+            where: { id: update.message_id, deviceId },
+            data: {
+                status: update.status,
+                errorMessage: update.error || null,
+                printedAt: update.status === 'printed' ? new Date() : null
+            }
+        });
+    } catch (e) {
+        // One bad update must not lose the rest of a batch (or its credits)
+        console.error(`Failed to record print status for ${update.message_id}:`, e);
+    }
+};
+
+// Requeue what the device missed while it was away. `cursor` is the newest
+// message it printed ({ message_id, created_at }): anything delivered after
+// it may have been lost in flight. Requeued messages go out with the ones
+// that were never delivered, through deliverQueuedMessages and so paced by
+// the device's credits. A device that sends a cursor deduplicates by
+// message id, so resending too much is harmless; one without a cursor may
+// not, so nothing is replayed to it.
+const replayMissedMessages = async (deviceId: string, cursor: any) => {
+    if (!cursor?.created_at) return;
+
+    const requeued = await prisma.message.updateMany({
+        where: {
+            deviceId,
+            status: { in: ['sent', 'printing'] },
+            createdAt: { gt: new Date(cursor.created_at) },
+        },
+        data: { status: 'queued' }
+    });
+    const queued = await prisma.message.count({ where: { deviceId, status: 'queued' } });
+
+    broadcastToDevice(deviceId, { type: 'replay_done', count: queued, requeued: requeued.count });
+};
+
+// Returns false if the device is offline, or for a message job while its
+// printer isn't ready or it is out of credits; callers leave the message
+// queued and deliverQueuedMessages sends it later.
 export const broadcastToDevice = (deviceId: string, data: any): boolean => {
     const ws = deviceConnections.get(deviceId);
-    if (ws && ws.readyState === WebSocket.OPEN) {
-        ws.send(JSON.stringify(data));
-        return true;
+    if (!ws || ws.readyState !== WebSocket.OPEN) {
+        return false;
+    }
+    if (CREDITED_TYPES.includes(data?.type)) {
+        if (printerNotReady.has(deviceId)) return false;
+        const credits = deviceCredits.get(deviceId);
+        if (credits !== null && credits !== undefined) {
+            if (credits <= 0) return false;
+            deviceCredits.set(deviceId, credits - 1);
+        }
     }
-    return false;
+    ws.send(JSON.stringify(data));
+    return true;
 };
@@ -12,6 +12,22 @@ interface Device {
     friendlyName: string;
     status: string;
     deviceCode: string;
+    printerStatus?: string | null; // JSON reported by the agent
+}
+
+// Why an online device's printer can't print right now, if it can't
+function printerProblem(device: Device): string | null {
+    if (device.status !== 'online' || !device.printerStatus) return null;
+    try {
+        const state = JSON.parse(device.printerStatus);
+        if (state.ready !== false) return null;
+        if (!state.connected) return 'Printer disconnected';
+        if (state.cover_open) return 'Cover open';
+        if (state.paper_out) return 'Out of paper';
+        return state.error || 'Printer offline';
+    } catch {
+        return null;
+    }
 }
 
 export function Dashboard() {
@@ -109,6 +125,9 @@ export function Dashboard() {
                         <div className="flex-1 truncate">
                             <div className="font-medium text-charcoal-800 truncate">{device.friendlyName}</div>
                             <div className="text-xs text-gray-400 font-mono">{device.deviceCode}</div>
+                            {printerProblem(device) && (
+                                <div className="text-xs text-orange-500 truncate">{printerProblem(device)}</div>
+                            )}
                         </div>
                     </button>
                 ))}